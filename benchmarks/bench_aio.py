@@ -0,0 +1,140 @@
+""" Event loop latency while parsing with ``xpparse.aio``, under load
+
+Run with::
+
+    python benchmarks/bench_aio.py [--clients 16] [--docs 10]
+                                   [--engine pyparsing] [--limit 4]
+
+The load generator runs `clients` coroutines on one event loop, as for the
+connections of a server.  Each sends `docs` documents, alternating the two
+sample files, one after the other, parsing each with ``aio.read_protocols``,
+with a semaphore allowing `limit` parses at a time over all clients.  A probe
+coroutine sleeps for 1 ms in a loop, and records how late it wakes, as the
+latency of the event loop.
+
+For each way of parsing, prints the documents parsed per second, the
+percentiles of the event loop latency, and the percentiles of the time from
+sending to parsing each document.  'inline' calls ``xpparse.read_protocols``
+in the event loop, for comparison.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import asyncio
+import argparse
+from os.path import join as pjoin, dirname, abspath
+from timeit import default_timer
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import xpparse as xpp
+
+SAMPLES = [pjoin(ROOT, 'xprotocol_sample.txt'),
+           pjoin(ROOT, 'xprotocol_sample2.txt')]
+
+PROBE_INTERVAL = 0.001
+
+
+def percentiles(values, pcts=(50, 99)):
+    values = sorted(values)
+    if not values:
+        return [float('nan')] * len(pcts)
+    return [values[min(len(values) - 1, int(len(values) * p / 100))]
+            for p in pcts]
+
+
+async def probe(lags, stop):
+    """ Record lateness of wake up from sleeps of ``PROBE_INTERVAL`` """
+    while not stop.is_set():
+        start = default_timer()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(default_timer() - start - PROBE_INTERVAL)
+
+
+async def client(parse, texts, n_docs, latencies):
+    for i in range(n_docs):
+        start = default_timer()
+        try:
+            await parse(texts[i % len(texts)])
+        finally:
+            latencies.append(default_timer() - start)
+
+
+async def run_load(parse, texts, n_clients, n_docs):
+    lags, latencies = [], []
+    stop = asyncio.Event()
+    prober = asyncio.ensure_future(probe(lags, stop))
+    await asyncio.sleep(0.05)
+    start = default_timer()
+    await asyncio.gather(*[client(parse, texts, n_docs, latencies)
+                           for i in range(n_clients)])
+    elapsed = default_timer() - start
+    stop.set()
+    await prober
+    return len(latencies) / elapsed, lags, latencies
+
+
+def make_parse(mode, executor, limit, engine):
+    if mode == 'inline':
+        async def parse(text):
+            return xpp.read_protocols(text, engine=engine)
+        return parse
+    semaphore = asyncio.Semaphore(limit)
+
+    async def parse(text):
+        return await xpp.aio.read_protocols(text, executor,
+                                            semaphore=semaphore,
+                                            engine=engine)
+    return parse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=16,
+                        help='number of concurrent clients')
+    parser.add_argument('--docs', type=int, default=10,
+                        help='documents per client')
+    parser.add_argument('--engine', default='pyparsing',
+                        help="parser engine, 'pyparsing' or 'fast'")
+    parser.add_argument('--limit', type=int, default=4,
+                        help='maximum parses at a time')
+    args = parser.parse_args()
+    texts = []
+    for fname in SAMPLES:
+        with open(fname, 'rt') as fobj:
+            texts.append(fobj.read())
+    n_cpus = os.cpu_count()
+    modes = [('inline', None),
+             ('thread x 1', lambda: ThreadPoolExecutor(1)),
+             ('thread x 4', lambda: ThreadPoolExecutor(4)),
+             ('process x {0}'.format(n_cpus),
+              lambda: ProcessPoolExecutor(n_cpus))]
+    print('{0} clients x {1} documents, engine {2}, limit {3}'.format(
+        args.clients, args.docs, args.engine, args.limit))
+    print('{0:14s} {1:>8s}  {2:>16s}  {3:>20s}'.format(
+        '', 'docs/s', 'loop lag p50 p99', 'doc latency p50 p99'))
+
+    async def run(mode, executor):
+        # Warm up executor workers and parsers
+        parse = make_parse(mode, executor, args.limit, args.engine)
+        await asyncio.gather(*[parse(text) for text in texts * args.limit])
+        return await run_load(parse, texts, args.clients, args.docs)
+
+    for mode, make_executor in modes:
+        executor = None if make_executor is None else make_executor()
+        try:
+            rate, lags, latencies = asyncio.run(run(mode, executor))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        print('{0:14s} {1:8.1f}  {2:7.1f} {3:7.1f}ms  {4:9.1f} {5:8.1f}ms'
+              .format(mode, rate,
+                      *[t * 1000 for t in percentiles(lags) +
+                        percentiles(latencies)]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+""" Benchmark ``parse_ascconv`` against naive per-line parsing
+
+Run with::
+
+    python benchmarks/bench_ascconv.py
+"""
+from __future__ import print_function, division
+
+import sys
+from os.path import join as pjoin, dirname, abspath
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import xpfast
+from xpascconv import parse_ascconv
+
+from bench_engines import best_time
+
+
+def naive_ascconv(text):
+    """ Per-line ``split('=')`` baseline, returning flat dict """
+    out = {}
+    for line in text.splitlines():
+        if line.startswith('#') or '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        value = value.split('#', 1)[0].strip()
+        if value.startswith('"'):
+            value = value.strip('"').replace('""', '"')
+        elif value.lower().startswith('0x'):
+            value = int(value, 16)
+        else:
+            try:
+                value = int(value)
+            except ValueError:
+                value = float(value)
+        out[key.strip()] = value
+    return out
+
+
+def main():
+    with open(pjoin(ROOT, 'xprotocol_sample2.txt'), 'rt') as fobj:
+        text = xpfast.read_protocols(fobj.read())[1].ascconv
+    assert naive_ascconv(text) == parse_ascconv(text)
+    print('ASCCONV section of {0} lines'.format(len(text.splitlines())))
+    for name, func in (('naive split', naive_ascconv),
+                       ('regex flat', parse_ascconv),
+                       ('regex nested', lambda t: parse_ascconv(t, True))):
+        t = best_time(lambda: func(text), 5, 20)
+        print('  {0:16s} {1:8.3f} ms'.format(name, t * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+""" Benchmark ``attr`` against MatchFirst of complete attribute rules
+
+``attr`` matches the tag once, then the value.  The older form tried each of
+``bool_attr``, ``float_attr``, ``int_attr``, ``string_attr``, ``list_attr`` in
+turn, each matching the tag again.  Parses the attributes of all blocks in
+the sample files with ``attrs`` built from each form.  Run with::
+
+    python benchmarks/bench_attr.py
+"""
+from __future__ import print_function, division
+
+import sys
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from pyparsing import Group, ZeroOrMore, Dict
+
+import xpparse as xpp
+
+from bench_engines import SAMPLES, best_time
+
+
+def alternatives_attr():
+    """ ``attr`` as MatchFirst of complete attribute rules """
+    return Group(xpp.bool_attr | xpp.float_attr | xpp.int_attr |
+                 xpp.string_attr | xpp.list_attr)
+
+
+def attr_sections(text):
+    """ Text of attribute sections of all indexed blocks in `text` """
+    index = xpp.index_blocks(text)
+    sections = []
+    for i in range(len(index)):
+        start, end = index.span(i)
+        block = text[start:end]
+        # Attributes start after the opening curly brace
+        sections.append(block[block.index('{') + 1:])
+    return sections
+
+
+def main():
+    old = Dict(ZeroOrMore(alternatives_attr()))('attrs')
+    new = xpp.attrs
+    for fname in SAMPLES:
+        with open(fname, 'rt') as fobj:
+            contents = fobj.read()
+        sections = attr_sections(contents)
+        for section in sections:
+            assert (old.parseString(section).asList() ==
+                    new.parseString(section).asList())
+        t_old = best_time(lambda: [old.parseString(s) for s in sections], 3, 1)
+        t_new = best_time(lambda: [new.parseString(s) for s in sections], 3, 1)
+        t_all = best_time(lambda: xpp.read_protocols(contents), 3, 1)
+        print('{0} ({1} blocks)'.format(fname, len(sections)))
+        print('  attrs, MatchFirst of attribute rules {0:8.2f} ms'.format(
+            t_old * 1000))
+        print('  attrs, tag then value                {0:8.2f} ms'.format(
+            t_new * 1000))
+        print('  read_protocols                       {0:8.2f} ms'.format(
+            t_all * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+""" Time ``read_protocols`` disk cache and memo hits against parsing
+
+Run with::
+
+    python benchmarks/bench_cache.py
+"""
+from __future__ import print_function, division
+
+import sys
+import shutil
+import tempfile
+from os.path import dirname, abspath
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import xpparse as xpp
+import xpcache
+
+from bench_engines import SAMPLES, best_time
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for fname in SAMPLES:
+            with open(fname, 'rt') as fobj:
+                contents = fobj.read()
+            print(fname)
+            for engine in ('pyparsing', 'fast'):
+                for result in ('native', 'nodes'):
+                    kwargs = dict(engine=engine, result=result)
+                    parse = best_time(
+                        lambda: xpp.read_protocols(contents, **kwargs))
+                    xpp.read_protocols(contents, cache_dir=tmpdir, **kwargs)
+                    hit = best_time(lambda: xpp.read_protocols(
+                        contents, cache_dir=tmpdir, **kwargs))
+                    xpp.enable_memo()
+                    try:
+                        memo = best_time(
+                            lambda: xpp.read_protocols(contents, **kwargs))
+                    finally:
+                        xpp.disable_memo()
+                    print('  {0:10s} {1:7s} parse {2:8.2f} ms  disk hit '
+                          '{3:6.2f} ms ({4:4.1f}%)  memo hit {5:6.3f} ms'
+                          .format(engine, result, parse * 1000, hit * 1000,
+                                  hit / parse * 100, memo * 1000))
+        print(xpcache.get_cache(tmpdir).stats())
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
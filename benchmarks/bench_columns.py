@@ -0,0 +1,119 @@
+""" Time ``to_columns`` and ``.npz`` storage for a corpus of protocols
+
+Run with::
+
+    python benchmarks/bench_columns.py [--copies 200]
+
+Parses `copies` variants of the second sample file, then times flattening
+the protocols to a list of Python row tuples, against ``to_columns`` from the
+parse results and from nodes, and saving and loading the table.  Prints times per 1000 protocols, and the
+estimated load time for 100000 protocols.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+from os.path import join as pjoin, dirname, abspath
+from timeit import default_timer
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # Import before timing
+
+import xpparse as xpp
+from xpnodes import ListValue
+
+from bench_memory import variants
+
+SAMPLE2 = pjoin(ROOT, 'xprotocol_sample2.txt')
+
+
+def python_rows(nodes, sources):
+    """ Flatten nodes to list of (source, path, index, value) tuples """
+    rows = []
+
+    def add(source, path, value):
+        if isinstance(value, ListValue):
+            for i, v in enumerate(value.args):
+                rows.append((source, path, i, v))
+            for key in value.kwargs:
+                add(source, path + '.' + key, value.kwargs[key])
+        elif isinstance(value, tuple):
+            for i, v in enumerate(value):
+                rows.append((source, path, i, v))
+        else:
+            rows.append((source, path, -1, value))
+
+    def add_blocks(source, prefix, blocks):
+        for block in blocks:
+            path = '{0}{1}["{2}"]'.format(prefix, block.tag_type,
+                                          block.tag_name)
+            for name in block.attrs:
+                add(source, path + '@' + name, block.attrs[name])
+            if block.tag_type in ('parammap', 'paramfunctor', 'pipeservice'):
+                add_blocks(source, path + '/', block.value or ())
+            else:
+                add(source, path, block.value)
+
+    for protocol, source in zip(nodes, sources):
+        for name in protocol.attrs:
+            add(source, '@' + name, protocol.attrs[name])
+        add_blocks(source, '', protocol.param_blocks)
+    return rows
+
+
+def timed(func):
+    start = default_timer()
+    res = func()
+    return res, default_timer() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--copies', type=int, default=200)
+    args = parser.parse_args()
+    with open(SAMPLE2, 'rt') as fobj:
+        sample2 = fobj.read()
+    parsed, sources = [], []
+    start = default_timer()
+    for i, text in enumerate(variants(sample2, args.copies)):
+        protocols = xpp.read_protocols(text, engine='fast')
+        parsed += protocols
+        sources += ['file{0}'.format(i)] * len(protocols)
+    n = len(parsed)
+    per_k = 1000 / n
+    print('{0} protocols, parse {1:.2f} s per 1000'.format(
+        n, (default_timer() - start) * per_k))
+    nodes = xpp.to_nodes(parsed)
+    rows, t = timed(lambda: python_rows(nodes, sources))
+    print('python rows   {0:6.3f} s per 1000 ({1} rows)'.format(
+        t * per_k, len(rows)))
+    del rows
+    for name, protocols in (('parsed', parsed), ('nodes', nodes)):
+        for ascconv in (False, True):
+            columns, t = timed(lambda: xpp.to_columns(protocols, sources,
+                                                      ascconv))
+            print('to_columns {0:6s} {1:6.3f} s per 1000 ({2} rows, ascconv '
+                  '{3})'.format(name, t * per_k, len(columns), ascconv))
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for compressed in (False, True):
+            fname = pjoin(tmpdir, 'columns.npz')
+            _, t_save = timed(lambda: xpp.save_columns(fname, columns,
+                                                       compressed))
+            _, t_load = timed(lambda: xpp.load_columns(fname))
+            print('npz compressed {0!s:5s} {1:6.1f} MB per 1000, save '
+                  '{2:6.3f} s, load {3:6.3f} s per 1000; load 100k {4:5.1f} s'
+                  .format(compressed, os.path.getsize(fname) / 1e6 * per_k,
+                          t_save * per_k, t_load * per_k,
+                          t_load * per_k * 100))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+""" Throughput of ``from_dicom`` over a directory of large DICOM files
+
+Run with::
+
+    python benchmarks/bench_dicom.py [--files 20] [--mbytes 64]
+
+Writes `files` synthetic multi-frame DICOM files to a temporary directory,
+each with the CSA headers of a Siemens file, with ``MrPhoenixProtocol``
+from the second sample, and `mbytes` MB of pixel data.  Then reports files
+per second for:
+
+* 'csa text': ``xpdicom.read_csa_text``, the memory mapped tag walker;
+* 'from_dicom fast': ``xpparse.from_dicom`` with the 'fast' engine;
+* 'read + walk': reading each whole file into memory, then walking the tags,
+  as for loading the file with a DICOM library;
+* 'pydicom': ``pydicom.dcmread``, and decoding the CSA header, if pydicom is
+  installed.
+
+The files are in the page cache after writing, so the times do not include
+disk reads; reading uncached files makes the difference between the whole
+file reads and the tag walker larger.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import shutil
+import struct
+import argparse
+import tempfile
+from os.path import join as pjoin, dirname, abspath
+from timeit import default_timer
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import xpparse as xpp
+import xpdicom
+from test_xpdicom import make_dicom, siemens_elements
+
+SAMPLE = pjoin(ROOT, 'xprotocol_sample2.txt')
+
+
+def write_files(dirname, n_files, n_bytes, text):
+    header = make_dicom(siemens_elements(text), pixels=b'')
+    # Multi-frame pixel data after the header elements
+    header = header[:-4] + struct.pack('<I', n_bytes)
+    chunk = os.urandom(2 ** 20)
+    fnames = []
+    for i in range(n_files):
+        fname = pjoin(dirname, 'image_{0:04d}.dcm'.format(i))
+        with open(fname, 'wb') as fobj:
+            fobj.write(header)
+            for j in range(n_bytes // len(chunk)):
+                fobj.write(chunk)
+            fobj.write(chunk[:n_bytes % len(chunk)])
+        fnames.append(fname)
+    return fnames
+
+
+def read_walk(fname):
+    with open(fname, 'rb') as fobj:
+        buf = fobj.read()
+    data = xpdicom.find_private(buf, 0x0029, xpdicom.CSA_CREATOR, 0x20)
+    return xpdicom.csa_items(data, 'MrPhoenixProtocol')[0]
+
+
+def pydicom_text(fname):
+    import pydicom
+    dcm = pydicom.dcmread(fname)
+    block = dcm.private_block(0x0029, 'SIEMENS CSA HEADER')
+    return xpdicom.csa_items(block[0x20].value, 'MrPhoenixProtocol')[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=20,
+                        help='number of files')
+    parser.add_argument('--mbytes', type=int, default=64,
+                        help='MB of pixel data in each file')
+    args = parser.parse_args()
+    with open(SAMPLE, 'rt') as fobj:
+        text = fobj.read()
+    cases = [('csa text', xpdicom.read_csa_text),
+             ('from_dicom fast', lambda f: xpp.from_dicom(f, engine='fast')),
+             ('read + walk', read_walk)]
+    try:
+        import pydicom
+    except ImportError:
+        pass
+    else:
+        cases.append(('pydicom', pydicom_text))
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fnames = write_files(tmpdir, args.files, args.mbytes * 2 ** 20, text)
+        print('{0} files of {1} MB'.format(args.files, args.mbytes))
+        for label, func in cases:
+            func(fnames[0])
+            start = default_timer()
+            for fname in fnames:
+                func(fname)
+            elapsed = default_timer() - start
+            print('  {0:16s} {1:10.1f} files/s {2:8.2f} ms/file'.format(
+                label, len(fnames) / elapsed, elapsed / len(fnames) * 1000))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+""" Benchmark pyparsing and fast engines for ``read_protocols``
+
+Run with::
+
+    python benchmarks/bench_engines.py
+"""
+from __future__ import print_function, division
+
+import sys
+from os.path import join as pjoin, dirname, abspath
+from timeit import default_timer
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import xpparse as xpp
+
+SAMPLES = [pjoin(ROOT, 'xprotocol_sample.txt'),
+           pjoin(ROOT, 'xprotocol_sample2.txt')]
+
+
+def best_time(func, repeat=5, number=3):
+    """ Best average time for `number` calls to `func` over `repeat` runs """
+    times = []
+    for i in range(repeat):
+        start = default_timer()
+        for j in range(number):
+            func()
+        times.append((default_timer() - start) / number)
+    return min(times)
+
+
+def main():
+    for fname in SAMPLES:
+        with open(fname, 'rt') as fobj:
+            contents = fobj.read()
+        mbytes = len(contents) / 1e6
+        print(fname)
+        for engine in ('pyparsing', 'fast'):
+            t = best_time(lambda: xpp.read_protocols(contents, engine=engine))
+            print('  {0:10s} {1:8.2f} ms {2:8.2f} MB/s'.format(
+                engine, t * 1000, mbytes / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+""" Benchmark ``emc`` against ``Each`` for ParamFunctor events, methods and
+connections
+
+Parses a protocol with many ParamFunctor blocks, with the Event, Method and
+Connection in varying order, using ``param_functor`` built with ``Each``, and
+with the current ``KeywordEach``.  Run with::
+
+    python benchmarks/bench_functor.py [--functors 200]
+"""
+from __future__ import print_function, division
+
+import sys
+import argparse
+import itertools
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from pyparsing import Each, Group, ZeroOrMore
+
+import xpparse as xpp
+
+from bench_engines import SAMPLES, best_time
+
+EMC = dict(
+    event='<Event."ImageReady">  { "int32_t" "class IceAs &" }',
+    method='<Method."ComputeImage">  { "int32_t" "class IceAs &" }',
+    connection='<Connection."c1">  { "ImageReady" "" "ComputeImage" }')
+
+FUNCTOR = """      <ParamFunctor."F{0}">
+      {{
+        <Class> "F{0}@Functors"
+        <ParamBool."EXECUTE">  {{ "true" }}
+        <ParamLong."Threshold">  {{ {0} }}
+        {1}
+      }}
+"""
+
+
+def functors_protocol(n_functors):
+    """ Protocol text with `n_functors` functors """
+    orders = list(itertools.permutations(sorted(EMC)))
+    functors = [FUNCTOR.format(i, '\n        '.join(
+        EMC[key] for key in orders[i % len(orders)]))
+        for i in range(n_functors)]
+    return ('<XProtocol>\n{\n  <ParamMap."">\n  {\n' + ''.join(functors) +
+            '  }\n}\n')
+
+
+def each_functor():
+    """ ``param_functor`` with ``Each`` for event, method, connection """
+    emc = Each([Group(xpp.event)('event'),
+                Group(xpp.method)('method'),
+                Group(xpp.connection)('connection')])
+    return xpp.make_named_block('paramfunctor',
+                                pre=xpp.class_,
+                                contents=ZeroOrMore(Group(xpp.param_block)),
+                                post=emc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--functors', type=int, default=200)
+    args = parser.parse_args()
+    text = functors_protocol(args.functors)
+    # Functor blocks only, for the two definitions
+    start = text.index('<ParamFunctor')
+    end = text.rindex('}', 0, text.rindex('}'))
+    blocks = text[start:end]
+    old = ZeroOrMore(Group(each_functor()))
+    new = ZeroOrMore(Group(xpp.param_functor))
+    old_res = old.parseString(blocks, True)
+    new_res = new.parseString(blocks, True)
+    assert old_res.asList() == new_res.asList()
+    assert old_res.dump() == new_res.dump()
+    t_old = best_time(lambda: old.parseString(blocks, True), 3, 1)
+    t_new = best_time(lambda: new.parseString(blocks, True), 3, 1)
+    print('{0} functors'.format(args.functors))
+    print('  Each         {0:8.2f} ms'.format(t_old * 1000))
+    print('  KeywordEach  {0:8.2f} ms'.format(t_new * 1000))
+    print('  speedup      {0:8.2f}x'.format(t_old / t_new))
+    t_all = best_time(lambda: xpp.read_protocols(text), 3, 1)
+    print('  read_protocols, whole protocol {0:8.2f} ms'.format(t_all * 1000))
+    for fname in SAMPLES:
+        with open(fname, 'rt') as fobj:
+            contents = fobj.read()
+        print('{0}: read_protocols {1:8.2f} ms'.format(
+            fname, best_time(lambda: xpp.read_protocols(contents)) * 1000))
+
+
+if __name__ == '__main__':
+    main()
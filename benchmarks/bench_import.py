@@ -0,0 +1,97 @@
+""" Start-up time of ``xpparse``, with and without a first parse
+
+Run with::
+
+    python benchmarks/bench_import.py [--repeat 5]
+
+Runs each case in a new Python process with ``python -X importtime``
+(Python >= 3.7), and reports the best over `repeat` processes of:
+
+* the cumulative import time of ``xpparse``, from ``-X importtime``;
+* the import time of ``xpgrammar`` and ``pyparsing``, where the case imports
+  them;
+* the time from the start of the import to the end of the first parse of the
+  first sample file, if the case parses.
+
+The cases are the import alone, and the import then a parse with each engine.
+A parse with the 'fast' engine should not import pyparsing or build the
+grammar.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import re
+import argparse
+import subprocess
+from os.path import join as pjoin, dirname, abspath
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+SAMPLE = pjoin(ROOT, 'xprotocol_sample.txt')
+
+CASES = [('import', None),
+         ('import + fast parse', 'fast'),
+         ('import + pyparsing parse', 'pyparsing')]
+
+SCRIPT = """\
+from timeit import default_timer
+start = default_timer()
+import xpparse
+engine = {engine!r}
+if engine is not None:
+    with open({sample!r}, 'rt') as fobj:
+        xpparse.read_protocols(fobj.read(), engine=engine)
+print('elapsed', default_timer() - start)
+"""
+
+# Lines from -X importtime: "import time: self | cumulative | name"
+_IMPORT_LINE = re.compile(r'import time:\s+\d+ \|\s+(\d+) \|\s+(\S+)$')
+
+
+def run_case(engine):
+    """ Cumulative import times (s) by module name, elapsed time (s) """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    proc = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c',
+         SCRIPT.format(engine=engine, sample=SAMPLE)],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    out, err = proc.communicate()
+    if proc.returncode:
+        raise RuntimeError(err)
+    times = {}
+    for line in err.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match is not None:
+            times[match.group(2)] = int(match.group(1)) / 1e6
+    elapsed = float(out.split()[-1])
+    return times, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of processes for each case')
+    args = parser.parse_args()
+    print('{0:26s} {1:>9s} {2:>9s} {3:>9s} {4:>9s}'.format(
+        'case (ms)', 'xpparse', 'xpgrammar', 'pyparsing', 'elapsed'))
+    for label, engine in CASES:
+        best = {}
+        for i in range(args.repeat):
+            times, elapsed = run_case(engine)
+            times['elapsed'] = elapsed
+            for name in ('xpparse', 'xpgrammar', 'pyparsing', 'elapsed'):
+                if name in times:
+                    best[name] = min(best.get(name, times[name]), times[name])
+        print('{0:26s} {1} {2} {3} {4}'.format(
+            label, *['{0:9.1f}'.format(best[name] * 1000) if name in best
+                     else '{0:>9s}'.format('-')
+                     for name in ('xpparse', 'xpgrammar', 'pyparsing',
+                                  'elapsed')]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+""" Scaling of ``read_protocols_many`` with number of worker processes
+
+Run with::
+
+    python benchmarks/bench_many.py [--copies 200] [--engine fast]
+                                    [--result native] [--files]
+
+Parses `copies` copies of each sample file with 1, 2, 4, ... workers, up to
+the number of CPUs, and prints throughput and speedup over one worker.
+``--files`` passes file names to the workers, instead of strings.
+"""
+from __future__ import print_function, division
+
+import sys
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from os.path import join as pjoin, dirname, abspath
+from timeit import default_timer
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import xpparse as xpp
+
+SAMPLES = [pjoin(ROOT, 'xprotocol_sample.txt'),
+           pjoin(ROOT, 'xprotocol_sample2.txt')]
+
+
+def worker_counts(max_workers):
+    counts = []
+    n = 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    return counts + [max_workers]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--copies', type=int, default=200,
+                        help='copies of each sample to parse')
+    parser.add_argument('--engine', default='fast')
+    parser.add_argument('--result', default='native')
+    parser.add_argument('--chunksize', type=int, default=4)
+    parser.add_argument('--max-workers', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--files', action='store_true',
+                        help='pass file names rather than strings')
+    args = parser.parse_args()
+    contents = []
+    for fname in SAMPLES:
+        with open(fname, 'rt') as fobj:
+            contents.append(fobj.read())
+    mbytes = sum(len(c) for c in contents) * args.copies / 1e6
+    tmpdir = None
+    if args.files:
+        tmpdir = tempfile.mkdtemp()
+        items = []
+        for i in range(args.copies):
+            for j, text in enumerate(contents):
+                fname = pjoin(tmpdir, 'proto_{0}_{1}.txt'.format(i, j))
+                with open(fname, 'wt') as fobj:
+                    fobj.write(text)
+                items.append(fname)
+    else:
+        items = contents * args.copies
+    print('{0} items, {1:.1f} MB, engine {2}, result {3}'.format(
+        len(items), mbytes, args.engine, args.result))
+    try:
+        base = None
+        for workers in worker_counts(args.max_workers):
+            start = default_timer()
+            res = xpp.read_protocols_many(items, workers, args.chunksize,
+                                          paths=args.files,
+                                          engine=args.engine,
+                                          result=args.result)
+            t = default_timer() - start
+            assert not any(isinstance(r, Exception) for r in res)
+            if base is None:
+                base = t
+            print('{0:3d} workers {1:8.2f} s {2:8.1f} items/s {3:7.2f} MB/s '
+                  'speedup {4:5.2f}'.format(workers, t, len(items) / t,
+                                            mbytes / t, base / t))
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
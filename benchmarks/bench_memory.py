@@ -0,0 +1,99 @@
+""" Measure memory retained by ``read_protocols`` results
+
+Run with::
+
+    python benchmarks/bench_memory.py
+
+Uses ``tracemalloc`` (Python 3) to measure the memory still allocated after
+parsing, while the results are alive, and the peak memory during the parse.
+For each sample file, parses the file once.  Then parses a corpus of
+variants of the samples, as for the protocols of images in a series, where
+the variants differ in a few percent of their integer values.  Retained
+memory for 'shared' results includes the sharing pool table.
+"""
+from __future__ import print_function, division
+
+import sys
+import gc
+import re
+import random
+import tracemalloc
+from os.path import join as pjoin, dirname, abspath
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import xpparse as xpp
+import xpnodes
+
+SAMPLES = [pjoin(ROOT, 'xprotocol_sample.txt'),
+           pjoin(ROOT, 'xprotocol_sample2.txt')]
+
+MODES = [('pyparsing', 'native'),
+         ('pyparsing', 'nodes'),
+         ('fast', 'native'),
+         ('fast', 'nodes'),
+         ('fast', 'shared')]
+
+
+def retained(func):
+    """ Return bytes (retained, peak) allocated by `func` """
+    func()  # Warm up caches and lazy imports
+    xpnodes.default_pool.clear()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        res = func()
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del res
+    return current - before, peak - before
+
+
+def variants(text, n, fraction=0.02, seed=0):
+    """ `n` copies of `text` with `fraction` of integer values changed """
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        out.append(re.sub(r'(?<=[ {])[0-9]+(?=[ }\n])',
+                          lambda m: (str(rng.randint(0, 1000))
+                                     if rng.random() < fraction
+                                     else m.group()),
+                          text))
+    return out
+
+
+def report(label, func):
+    kept, peak = retained(func)
+    print('  {0:18s} retained {1:9.1f} KB peak {2:9.1f} KB'.format(
+        label, kept / 1024, peak / 1024))
+
+
+def main(n_variants=20):
+    texts = []
+    for fname in SAMPLES:
+        with open(fname, 'rt') as fobj:
+            contents = fobj.read()
+        texts.append(contents)
+        print('{0} ({1} bytes)'.format(fname, len(contents)))
+        for engine, result in MODES:
+            report(engine + ' ' + result,
+                   lambda: xpp.read_protocols(contents, engine=engine,
+                                              result=result))
+    nested = xpp.strip_twin_quote(
+        xpp.get(texts[0], 'ParamMap/ParamString["Protocol0"]'))
+    corpus = variants(texts[1], n_variants) + variants(nested, n_variants)
+    print('Corpus of {0} variants of sample2 and Protocol0 ({1} bytes)'
+          .format(len(corpus), sum(len(t) for t in corpus)))
+    for engine, result in MODES:
+        report(engine + ' ' + result,
+               lambda: [xpp.read_protocols(text, engine=engine,
+                                           result=result)
+                        for text in corpus])
+
+
+if __name__ == '__main__':
+    main()
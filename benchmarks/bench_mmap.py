@@ -0,0 +1,80 @@
+""" Peak memory of ``read_protocols_file`` with and without memory mapping
+
+Run with::
+
+    python benchmarks/bench_mmap.py [--copies 100] [--engine fast]
+                                    [--result nodes]
+
+Writes a file of `copies` concatenated copies of the second sample file and
+the nested protocol of the first, then parses it in a fresh process for each
+mode, and prints the time and peak resident set size of the process (Unix
+only).
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+from os.path import join as pjoin, dirname, abspath
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import xpparse as xpp
+
+SAMPLES = [pjoin(ROOT, 'xprotocol_sample.txt'),
+           pjoin(ROOT, 'xprotocol_sample2.txt')]
+
+CHILD = """
+import sys, resource
+from timeit import default_timer
+sys.path.insert(0, {root!r})
+import xpparse as xpp
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = default_timer()
+res = xpp.read_protocols_file({fname!r}, {mmap!r}, engine={engine!r},
+                              result={result!r})
+t = default_timer() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(len(res), t, before, rss)
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--copies', type=int, default=100)
+    parser.add_argument('--engine', default='fast')
+    parser.add_argument('--result', default='nodes')
+    args = parser.parse_args()
+    with open(SAMPLES[0], 'rt') as fobj:
+        nested = xpp.strip_twin_quote(
+            xpp.get(fobj.read(), 'ParamMap/ParamString["Protocol0"]'))
+    with open(SAMPLES[1], 'rt') as fobj:
+        sample2 = fobj.read()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fname = pjoin(tmpdir, 'dump.txt')
+        with open(fname, 'wt') as fobj:
+            for i in range(args.copies):
+                fobj.write(sample2 + '\n' + nested + '\n')
+        print('{0:.1f} MB file, engine {1}, result {2}'.format(
+            os.path.getsize(fname) / 1e6, args.engine, args.result))
+        for mmap in (False, True):
+            code = CHILD.format(root=ROOT, fname=fname, mmap=mmap,
+                                engine=args.engine, result=args.result)
+            out = subprocess.check_output([sys.executable, '-c', code])
+            n, t, before, rss = out.decode('ascii').split()
+            # ru_maxrss is in KB on Linux
+            print('mmap={0!s:5s} {1} protocols {2:7.2f} s  peak RSS '
+                  '{3:7.1f} MB (start {4:5.1f} MB)'.format(
+                      mmap, n, float(t), int(rss) / 1024,
+                      int(before) / 1024))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+""" Benchmark ``SimpleValue`` token against MatchFirst of value rules
+
+Parses a list of 10,000 mixed values with ``list_value`` built from each
+form of ``simple_value``.  Run with::
+
+    python benchmarks/bench_simple_value.py
+"""
+from __future__ import print_function, division
+
+import sys
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from pyparsing import Regex, Literal, Group, ZeroOrMore, Dict
+
+import xpparse as xpp
+from xpfast import FLOAT, INT
+
+from bench_engines import best_time
+
+N_VALUES = 10000
+
+
+def make_list_value(simple_value):
+    key_values = Group(xpp.bare_tag + simple_value + ZeroOrMore(simple_value))
+    list_entries = (Group(ZeroOrMore(simple_value))('args') +
+                    Dict(ZeroOrMore(key_values))('kwargs'))
+    return xpp.LCURLY + list_entries + xpp.RCURLY
+
+
+def match_first_value():
+    """ ``simple_value`` as MatchFirst of separate rules """
+    true = Literal('"true"').setParseAction(lambda s, l, t: [True])
+    false = Literal('"false"').setParseAction(lambda s, l, t: [False])
+    int_num = Regex(INT).setParseAction(lambda s, l, t: [int(t[0])])
+    float_num = Regex(FLOAT).setParseAction(lambda s, l, t: [float(t[0])])
+    return true | false | float_num | int_num | xpp.quoted_multi
+
+
+def make_source(n_values=N_VALUES):
+    cycle = ['{0}', '{0}.5', '"str{0}"', '"true"', '-{0}']
+    return '{ ' + ' '.join(cycle[i % len(cycle)].format(i)
+                           for i in range(n_values)) + ' }'
+
+
+def main():
+    source = make_source()
+    old = make_list_value(match_first_value())
+    new = make_list_value(xpp.simple_value)
+    assert (old.parseString(source).asList() ==
+            new.parseString(source).asList())
+    t_old = best_time(lambda: old.parseString(source, True), 3, 1)
+    t_new = best_time(lambda: new.parseString(source, True), 3, 1)
+    print('{0} values'.format(N_VALUES))
+    print('  MatchFirst  {0:8.2f} ms'.format(t_old * 1000))
+    print('  SimpleValue {0:8.2f} ms'.format(t_new * 1000))
+    print('  speedup     {0:8.2f}x'.format(t_old / t_new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+""" Peak memory of streaming with ``iter_protocols`` against ``read_protocols``
+
+Run with::
+
+    python benchmarks/bench_stream.py [--copies 50] [--engine fast]
+
+Writes a file of `copies` concatenated copies of the second sample file and
+the nested protocol of the first, then counts the protocols in the file by
+streaming them with ``iter_protocols``, and by parsing the whole file with
+``read_protocols``.  Prints the time for each, and the peak ``tracemalloc``
+allocation from a second run, because tracing slows allocation.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from os.path import join as pjoin, dirname, abspath
+from timeit import default_timer
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import xpparse as xpp
+
+SAMPLES = [pjoin(ROOT, 'xprotocol_sample.txt'),
+           pjoin(ROOT, 'xprotocol_sample2.txt')]
+
+
+def count_streamed(fname, engine):
+    return sum(1 for p in xpp.iter_protocols(fname, engine=engine))
+
+
+def count_read(fname, engine):
+    with open(fname, 'rt') as fobj:
+        return len(xpp.read_protocols(fobj.read(), engine=engine))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--copies', type=int, default=50)
+    parser.add_argument('--engine', default='fast')
+    args = parser.parse_args()
+    with open(SAMPLES[0], 'rt') as fobj:
+        nested = xpp.strip_twin_quote(
+            xpp.get(fobj.read(), 'ParamMap/ParamString["Protocol0"]'))
+    with open(SAMPLES[1], 'rt') as fobj:
+        sample2 = fobj.read()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fname = pjoin(tmpdir, 'dump.txt')
+        with open(fname, 'wt') as fobj:
+            for i in range(args.copies):
+                fobj.write(sample2 + '\n' + nested + '\n')
+        print('{0:.1f} MB file, engine {1}'.format(
+            os.path.getsize(fname) / 1e6, args.engine))
+        for name, func in (('iter_protocols', count_streamed),
+                           ('read_protocols', count_read)):
+            start = default_timer()
+            n = func(fname, args.engine)
+            t = default_timer() - start
+            tracemalloc.start()
+            try:
+                func(fname, args.engine)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            print('{0:15s} {1} protocols {2:7.2f} s  peak {3:8.1f} MB'.format(
+                name, n, t, peak / 2 ** 20))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+""" Benchmark suite for whole documents and individual grammar elements
+
+Run with::
+
+    python benchmarks/bench_suite.py [--output results.json]
+                                     [--compare baseline.json]
+
+Times ``read_protocols`` with each engine on the sample files and on the
+nested ``Protocol0`` protocol of the first sample, and the grammar elements
+``quoted_multi``, ``param_array``, ``param_card_layout``, ``param_functor``
+and ``ascconv_block`` on snippets taken from the samples.
+
+For each case, reports throughput in MB/s at the median time per call,
+latency percentiles per call, and the peak memory allocated during one call,
+measured with ``tracemalloc``.  ``--output`` saves the results as JSON;
+``--compare`` prints the ratio of the median times to those in an earlier
+JSON file (ratio < 1 is faster).
+"""
+from __future__ import print_function, division
+
+import sys
+import re
+import gc
+import json
+import platform
+import argparse
+import tracemalloc
+from os.path import join as pjoin, dirname, abspath
+from timeit import default_timer
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import xpparse as xpp
+
+SAMPLES = [pjoin(ROOT, 'xprotocol_sample.txt'),
+           pjoin(ROOT, 'xprotocol_sample2.txt')]
+
+PERCENTILES = (50, 90, 99)
+
+
+def read_file(fname):
+    with open(fname, 'rt') as fobj:
+        return fobj.read()
+
+
+def block_snippet(text, tag_type):
+    """ Text of first block of type `tag_type` in `text` """
+    index = xpp.index_blocks(text)
+    start, end = index.span(index.find(tag_type)[0])
+    return text[start:end]
+
+
+def get_cases():
+    """ Return list of (name, func, text) for benchmark cases """
+    sample, sample2 = [read_file(fname) for fname in SAMPLES]
+    # Quoted string containing the nested protocol, and the protocol itself
+    param_string = block_snippet(sample, 'paramstring')
+    quoted = re.search(xpp.QUOTED_MULTI, param_string[param_string.index('{'):])
+    quoted = quoted.group()
+    nested = xpp.strip_twin_quote(quoted[1:-1])
+    ascconv = re.search('### ASCCONV BEGIN ###.*?### ASCCONV END ###',
+                        nested, re.S).group()
+    cases = []
+    for name, text in (('sample', sample),
+                       ('sample2', sample2),
+                       ('protocol0', nested)):
+        for engine in ('pyparsing', 'fast'):
+            cases.append(('read_protocols[{0},{1}]'.format(name, engine),
+                          lambda text=text, engine=engine:
+                          xpp.read_protocols(text, engine=engine),
+                          text))
+    for name, text in (('quoted_multi', quoted),
+                       ('param_array', block_snippet(sample2, 'paramarray')),
+                       ('param_card_layout',
+                        block_snippet(sample2, 'paramcardlayout')),
+                       ('param_functor',
+                        block_snippet(sample2, 'paramfunctor')),
+                       ('ascconv_block', ascconv)):
+        element = getattr(xpp, name)
+        cases.append((name,
+                      lambda text=text, element=element:
+                      element.parseString(text, True),
+                      text))
+    return cases
+
+
+def time_calls(func, min_time=0.5, min_calls=5, max_calls=10000):
+    """ Per-call times for `func`, for at least `min_time` seconds """
+    func()  # Warm up
+    times = []
+    total = 0
+    while (len(times) < min_calls or total < min_time) and \
+            len(times) < max_calls:
+        start = default_timer()
+        func()
+        t = default_timer() - start
+        times.append(t)
+        total += t
+    return sorted(times)
+
+
+def percentile(sorted_values, pct):
+    """ Nearest-rank percentile `pct` of sorted sequence `sorted_values` """
+    i = int(round(pct / 100 * (len(sorted_values) - 1)))
+    return sorted_values[i]
+
+
+def peak_memory(func):
+    """ Peak bytes allocated by one call to `func` """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(name, func, text, min_time=0.5):
+    times = time_calls(func, min_time)
+    median = percentile(times, 50)
+    result = dict(name=name,
+                  bytes=len(text),
+                  calls=len(times),
+                  mb_per_s=len(text) / 1e6 / median,
+                  peak_memory=peak_memory(func))
+    result['min_ms'] = times[0] * 1000
+    for pct in PERCENTILES:
+        result['p{0}_ms'.format(pct)] = percentile(times, pct) * 1000
+    return result
+
+
+def print_result(result, baseline=None):
+    line = ('{name:36s} {mb_per_s:8.2f} MB/s  p50 {p50_ms:9.3f}  '
+            'p90 {p90_ms:9.3f}  p99 {p99_ms:9.3f} ms  '
+            'peak {peak_kb:8.1f} KB').format(
+                peak_kb=result['peak_memory'] / 1024, **result)
+    if baseline is not None and result['name'] in baseline:
+        line += '  x{0:.2f}'.format(
+            result['p50_ms'] / baseline[result['name']]['p50_ms'])
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='save results to JSON file')
+    parser.add_argument('--compare', help='compare to results in JSON file')
+    parser.add_argument('--min-time', type=float, default=0.5,
+                        help='minimum seconds to time each case')
+    parser.add_argument('--filter', default='',
+                        help='only run cases with names containing this')
+    args = parser.parse_args()
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'rt') as fobj:
+            baseline = dict((r['name'], r) for r in json.load(fobj)['results'])
+    results = []
+    for name, func, text in get_cases():
+        if args.filter not in name:
+            continue
+        result = run_case(name, func, text, args.min_time)
+        print_result(result, baseline)
+        results.append(result)
+    if args.output:
+        with open(args.output, 'wt') as fobj:
+            json.dump(dict(python=sys.version,
+                           platform=platform.platform(),
+                           results=results),
+                      fobj, indent=2)
+
+
+if __name__ == '__main__':
+    main()
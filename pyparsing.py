@@ -271,7 +271,7 @@ class ParseResults(object):
        - by list index (C{results[0], results[1]}, etc.)
        - by attribute (C{results.<resultsName>})
        """
-    def __new__(cls, toklist, name=None, asList=True, modal=True ):
+    def __new__(cls, toklist=None, name=None, asList=True, modal=True ):
         if isinstance(toklist, cls):
             return toklist
         retobj = object.__new__(cls)
@@ -786,6 +786,70 @@ def _trim_arity(func, maxargs=2):
                 raise
     return wrapper
  
+class _PackratCache(object):
+    """Memo for packrat parsing.
+
+       Holds parse results (or exceptions) keyed on parse element, input
+       string and location.  If C{size} is not None, the cache keeps at most
+       C{size} entries, evicting the least recently used.  C{hits} and
+       C{misses} count lookups since the last call to C{reset}.
+    """
+    def __init__( self, size=None ):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict() if size is not None else {}
+
+    def get( self, key ):
+        """Return cached value for C{key}, or None if not cached"""
+        data = self._data
+        try:
+            value = data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.size is not None:
+            # Move to most recently used
+            del data[key]
+            data[key] = value
+        return value
+
+    def set( self, key, value ):
+        data = self._data
+        data[key] = value
+        if self.size is not None and len(data) > self.size:
+            data.popitem(last=False)
+
+    def resize( self, size ):
+        """Set size limit, evicting entries as necessary"""
+        if size is not None and self.size is None:
+            self._data = collections.OrderedDict(self._data)
+        self.size = size
+        if size is not None:
+            while len(self._data) > size:
+                self._data.popitem(last=False)
+
+    def clear( self ):
+        """Drop cached values, keeping hit and miss counts"""
+        self._data.clear()
+
+    def reset( self ):
+        """Drop cached values and reset hit and miss counts"""
+        self._data.clear()
+        self.hits = self.misses = 0
+
+    def stats( self ):
+        return dict(hits=self.hits, misses=self.misses,
+                    currsize=len(self._data), maxsize=self.size)
+
+    def __len__( self ):
+        return len(self._data)
+
+    def __contains__( self, key ):
+        return key in self._data
+
+
 class ParserElement(object):
     """Abstract base level parser element class."""
     DEFAULT_WHITE_CHARS = " \n\t\r"
@@ -1036,31 +1100,46 @@ class ParserElement(object):
     # we can cache these arguments and save ourselves the trouble of re-parsing the contained expression
     def _parseCache( self, instring, loc, doActions=True, callPreParse=True ):
         lookup = (self,instring,loc,callPreParse,doActions)
-        if lookup in ParserElement._exprArgCache:
-            value = ParserElement._exprArgCache[ lookup ]
+        cache = ParserElement._exprArgCache
+        value = cache.get( lookup )
+        if value is not None:
             if isinstance(value, Exception):
                 raise value
             return (value[0],value[1].copy())
         else:
             try:
                 value = self._parseNoCache( instring, loc, doActions, callPreParse )
-                ParserElement._exprArgCache[ lookup ] = (value[0],value[1].copy())
+                cache.set( lookup, (value[0],value[1].copy()) )
                 return value
             except ParseBaseException as pe:
                 pe.__traceback__ = None
-                ParserElement._exprArgCache[ lookup ] = pe
+                cache.set( lookup, pe )
                 raise
 
     _parse = _parseNoCache
 
     # argument cache for optimizing repeated calls when backtracking through recursive expressions
-    _exprArgCache = {}
+    _exprArgCache = _PackratCache()
+    # depth of nested calls to parseString / scanString; the outermost call
+    # resets and clears the cache
+    _parseDepth = 0
     def resetCache():
-        ParserElement._exprArgCache.clear()
+        ParserElement._exprArgCache.reset()
     resetCache = staticmethod(resetCache)
 
+    def cacheStats():
+        """Return dict of packrat cache statistics.
+
+           Keys are C{hits} and C{misses}, counted since the start of the
+           last outermost call to C{parseString} (parse actions can parse
+           other strings), C{currsize}, the number of cached
+           entries, and C{maxsize}, the size limit, or None for no limit.
+        """
+        return ParserElement._exprArgCache.stats()
+    cacheStats = staticmethod(cacheStats)
+
     _packratEnabled = False
-    def enablePackrat():
+    def enablePackrat(cache_size=None):
         """Enables "packrat" parsing, which adds memoizing to the parsing logic.
            Repeated parse attempts at the same string location (which happens
            often in many complex grammars) can immediately return a cached value,
@@ -1075,12 +1154,29 @@ class ParserElement(object):
            C{enablePackrat} before calling C{psyco.full()}.  If you do not do this,
            Python will crash.  For best results, call C{enablePackrat()} immediately
            after importing pyparsing.
+
+           The cache only holds entries during a call to C{parseString}, and
+           is emptied when the outermost call returns, so it does not keep
+           input strings or results alive between parses.  If C{cache_size}
+           is not None, the cache also keeps at most C{cache_size} entries,
+           evicting the least recently used.  C{disablePackrat} removes the
+           size limit.
         """
+        ParserElement._exprArgCache.resize(cache_size)
         if not ParserElement._packratEnabled:
             ParserElement._packratEnabled = True
             ParserElement._parse = ParserElement._parseCache
     enablePackrat = staticmethod(enablePackrat)
 
+    def disablePackrat():
+        """Disables "packrat" parsing enabled by C{enablePackrat}."""
+        if ParserElement._packratEnabled:
+            ParserElement._packratEnabled = False
+            ParserElement._parse = ParserElement._parseNoCache
+        ParserElement._exprArgCache.clear()
+        ParserElement._exprArgCache.resize(None)
+    disablePackrat = staticmethod(disablePackrat)
+
     def parseString( self, instring, parseAll=False ):
         """Execute the parse expression with the given string.
            This is the main interface to the client code, once the complete
@@ -1103,7 +1199,6 @@ class ParserElement(object):
             - explictly expand the tabs in your input string before calling
               C{parseString}
         """
-        ParserElement.resetCache()
         if not self.streamlined:
             self.streamline()
             #~ self.saveAsList = True
@@ -1111,6 +1206,9 @@ class ParserElement(object):
             e.streamline()
         if not self.keepTabs:
             instring = instring.expandtabs()
+        if not ParserElement._parseDepth:
+            ParserElement.resetCache()
+        ParserElement._parseDepth += 1
         try:
             loc, tokens = self._parse( instring, 0 )
             if parseAll:
@@ -1125,6 +1223,13 @@ class ParserElement(object):
                 raise exc
         else:
             return tokens
+        finally:
+            # release input string and results held by packrat cache, after
+            # the outermost parse; nested parses, from parse actions, keep
+            # the entries of the parses that called them
+            ParserElement._parseDepth -= 1
+            if not ParserElement._parseDepth:
+                ParserElement._exprArgCache.clear()
 
     def scanString( self, instring, maxMatches=_MAX_INT, overlap=False ):
         """Scan the input string for expression matches.  Each match will return the
@@ -1146,7 +1251,9 @@ class ParserElement(object):
         loc = 0
         preparseFn = self.preParse
         parseFn = self._parse
-        ParserElement.resetCache()
+        if not ParserElement._parseDepth:
+            ParserElement.resetCache()
+        ParserElement._parseDepth += 1
         matches = 0
         try:
             while loc <= instrlen and matches < maxMatches:
@@ -1175,6 +1282,10 @@ class ParserElement(object):
             else:
                 # catch and re-raise exception from here, clears out pyparsing internal stack trace
                 raise exc
+        finally:
+            ParserElement._parseDepth -= 1
+            if not ParserElement._parseDepth:
+                ParserElement._exprArgCache.clear()
 
     def transformString( self, instring ):
         """Extension to C{L{scanString}}, to modify matching text with modified tokens that may
@@ -0,0 +1,151 @@
+""" Test asyncio interface
+"""
+
+from os.path import join as pjoin, dirname
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import xpparse as xpp
+import xpaio
+
+from pyparsing import ParseException
+
+from nose.tools import (assert_true, assert_false, assert_equal,
+                        assert_raises)
+
+
+DATA_PATH = dirname(__file__)
+EG_PROTO = pjoin(DATA_PATH, 'xprotocol_sample.txt')
+EG_PROTO2 = pjoin(DATA_PATH, 'xprotocol_sample2.txt')
+
+
+def _contents(fname=EG_PROTO):
+    with open(fname, 'rt') as fobj:
+        return fobj.read()
+
+
+def test_read_protocols():
+    contents = _contents()
+    expected = xpp.read_protocols(contents, result='nodes')
+    assert_true(xpp.aio is xpaio)
+
+    async def main():
+        res = await xpaio.read_protocols(contents)
+        assert_equal(res.asList(), xpp.read_protocols(contents).asList())
+        with ThreadPoolExecutor(2) as executor:
+            for engine in ('pyparsing', 'fast'):
+                res = await xpaio.read_protocols(
+                    contents, executor, engine=engine, result='nodes')
+                assert_equal(res, expected)
+        sem = asyncio.Semaphore(2)
+        res = await asyncio.gather(*[
+            xpaio.read_protocols(contents, semaphore=sem, engine='fast',
+                                 result='nodes')
+            for i in range(4)])
+        assert_equal(res, [expected] * 4)
+        await asyncio.sleep(0.01)
+        assert_equal(sem._value, 2)
+        try:
+            await xpaio.read_protocols(contents + ' junk')
+        except ParseException:
+            pass
+        else:
+            raise AssertionError('Expected ParseException')
+
+    asyncio.run(main())
+    with ProcessPoolExecutor(1) as executor:
+        res = asyncio.run(xpaio.read_protocols(
+            contents, executor, engine='fast', result='nodes'))
+    assert_equal(res, expected)
+
+
+def test_timeout_cancel():
+    # Slow parse, with pyparsing engine
+    slow = _contents(EG_PROTO2) * 10
+    contents = _contents()
+
+    async def main():
+        sem = asyncio.Semaphore(1)
+        try:
+            await xpaio.read_protocols(slow, timeout=0.01, semaphore=sem)
+        except asyncio.TimeoutError:
+            pass
+        else:
+            raise AssertionError('Expected TimeoutError')
+        # Running parse keeps the semaphore until it finishes
+        assert_true(sem.locked())
+        await asyncio.wait_for(sem.acquire(), 10)
+        sem.release()
+        # Cancel parse waiting in the executor queue; it does not run
+        with ThreadPoolExecutor(1) as executor:
+            running = asyncio.ensure_future(
+                xpaio.read_protocols(slow, executor))
+            waiting = asyncio.ensure_future(
+                xpaio.read_protocols(contents, executor, semaphore=sem))
+            await asyncio.sleep(0.01)
+            waiting.cancel()
+            await asyncio.sleep(0)
+            assert_true(waiting.cancelled())
+            # Slot released without waiting for running parse
+            await asyncio.sleep(0.01)
+            assert_false(running.done())
+            assert_false(sem.locked())
+            await running
+
+    asyncio.run(main())
+
+
+def test_read_protocols_many():
+    contents = _contents()
+    expected = xpp.read_protocols(contents, result='nodes')
+    texts = [contents, contents + ' junk', contents]
+    read = []
+
+    def source(n):
+        for i in range(n):
+            read.append(i)
+            yield texts[i % 3]
+
+    async def asource(n):
+        for text in source(n):
+            yield text
+
+    async def main():
+        for src in (source, asource):
+            del read[:]
+            results = []
+            async for res in xpaio.read_protocols_many(
+                    src(9), limit=2, engine='fast', result='nodes'):
+                # Back-pressure: at most `limit` texts ahead of results
+                assert_true(len(read) <= len(results) + 2)
+                results.append(res)
+            assert_equal(len(results), 9)
+            for i, res in enumerate(results):
+                if i % 3 == 1:
+                    assert_true(isinstance(res, xpp.xpfast.ParseError))
+                else:
+                    assert_equal(res, expected)
+        # Timeouts as results
+        slow = _contents(EG_PROTO2) * 20
+        with ThreadPoolExecutor(2) as executor:
+            results = [res async for res in xpaio.read_protocols_many(
+                [slow, contents], executor, timeout=0.2)]
+        assert_true(isinstance(results[0], asyncio.TimeoutError))
+        assert_equal(results[1].asList(),
+                     xpp.read_protocols(contents).asList())
+        # Leaving loop early cancels parses in flight
+        del read[:]
+        gen = xpaio.read_protocols_many(source(100), limit=3,
+                                        engine='fast')
+        async for res in gen:
+            break
+        await gen.aclose()
+        assert_equal(len(read), 3)
+        others = [t for t in asyncio.all_tasks()
+                  if t is not asyncio.current_task()]
+        await asyncio.sleep(0.01)
+        assert_true(all(t.done() for t in others))
+
+    asyncio.run(main())
+    agen = xpaio.read_protocols_many([], limit=0)
+    assert_raises(ValueError, asyncio.run, agen.__anext__())
@@ -0,0 +1,90 @@
+""" Test ASCCONV parser
+"""
+
+from os.path import join as pjoin, dirname
+
+import xpparse as xpp
+import xpascconv as xpa
+
+from nose.tools import assert_true, assert_equal, assert_raises
+
+
+DATA_PATH = dirname(__file__)
+EG_PROTO2 = pjoin(DATA_PATH, 'xprotocol_sample2.txt')
+
+ASCCONV = r'''### ASCCONV BEGIN ###
+ulVersion                                = 0x14b44b6
+tSequenceFileName                        = "%SiemensSeq%\ep2d_diff"
+tQuoted                                  = ""A ""quoted"" name""
+tEmpty                                   = ""
+lProtID                                  = -434
+dFloat                                   = -1.5e-3  # comment
+sKSpace.ucDimension                      = 0x2
+sKSpace.dPhaseResolution                 = 1.
+sSliceArray.asSlice[0].dThickness        = 2.5
+sSliceArray.asSlice[2].dThickness        = 3.5
+sSliceArray.asSlice[2].sPosition.dTra    = 4
+aMatrix[1][0]                            = 7
+### ASCCONV END ###'''
+
+
+def test_parse_ascconv():
+    res = xpp.parse_ascconv(ASCCONV, nested=True)
+    assert_equal(res['ulVersion'], 0x14b44b6)
+    assert_equal(res['tSequenceFileName'], r'%SiemensSeq%\ep2d_diff')
+    assert_equal(res['tQuoted'], 'A "quoted" name')
+    assert_equal(res['tEmpty'], '')
+    assert_equal(res['lProtID'], -434)
+    assert_equal(res['dFloat'], -1.5e-3)
+    assert_equal(res['sKSpace'], dict(ucDimension=2, dPhaseResolution=1.0))
+    assert_equal(res['sSliceArray'],
+                 dict(asSlice=[dict(dThickness=2.5),
+                               None,
+                               dict(dThickness=3.5,
+                                    sPosition=dict(dTra=4))]))
+    assert_equal(res['aMatrix'], [None, [7]])
+    flat = xpp.parse_ascconv(ASCCONV)
+    assert_equal(len(flat), 12)
+    assert_equal(flat['sSliceArray.asSlice[2].sPosition.dTra'], 4)
+    assert_equal(xpa.nest_keys(flat), res)
+    # Conflicting keys, in either order
+    assert_raises(ValueError, xpp.parse_ascconv, 'a.b = 1\na.b.c = 2',
+                  True)
+    assert_raises(ValueError, xpp.parse_ascconv, 'a.b.c = 2\na.b = 1',
+                  True)
+    assert_raises(ValueError, xpp.parse_ascconv, 'a[0] = 1\na.b = 2',
+                  True)
+    assert_raises(ValueError, xpp.parse_ascconv, 'a.b = 2\na[0] = 1',
+                  True)
+    assert_raises(ValueError, xpp.parse_ascconv, 'a[0].b = 1\na[0] = 2',
+                  True)
+    assert_raises(ValueError, xpp.parse_ascconv, 'a[0][1] = 1\na = 2',
+                  True)
+    # Repeated keys keep the last value
+    assert_equal(xpp.parse_ascconv('a.b = 1\na.b = 2', True),
+                 dict(a=dict(b=2)))
+    assert_raises(ValueError, xpp.parse_ascconv, 'a..b = 1', True)
+
+
+def test_split_key():
+    assert_equal(xpa.split_key('sKSpace.asSlice[2].dThickness'),
+                 ['sKSpace', 'asSlice', 2, 'dThickness'])
+    assert_equal(xpa.split_key('a[1][0]'), ['a', 1, 0])
+    for bad in ('a.', 'a[x]', '.a', 'a.[0]'):
+        assert_raises(ValueError, xpa.split_key, bad)
+
+
+def test_sample_ascconv():
+    with open(EG_PROTO2, 'rt') as fobj:
+        protocols = xpp.read_protocols(fobj.read(), engine='fast')
+    text = protocols[1].ascconv
+    n_assign = len([line for line in text.splitlines()
+                    if not line.startswith('###')])
+    assert_equal(len(xpp.parse_ascconv(text)), n_assign)
+    res = xpp.parse_ascconv(text, nested=True)
+    assert_equal(res['ulVersion'], 0x14b44b6)
+    assert_equal(res['sProtConsistencyInfo']['tBaselineString'],
+                 'N4_VB17A_LATEST_20090307')
+    slices = res['sSliceArray']['asSlice']
+    assert_true(len(slices) > 1)
+    assert_true(isinstance(slices[0]['dThickness'], float))
@@ -0,0 +1,185 @@
+""" Test on-disk cache of parsed protocols
+"""
+
+from os.path import join as pjoin, dirname
+import os
+import time
+import shutil
+import tempfile
+
+import xpparse as xpp
+import xpcache as xpc
+
+from nose.tools import assert_true, assert_false, assert_equal
+
+
+DATA_PATH = dirname(__file__)
+EG_PROTO2 = pjoin(DATA_PATH, 'xprotocol_sample2.txt')
+
+
+def test_cache():
+    with open(EG_PROTO2, 'rt') as fobj:
+        contents = fobj.read()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache = xpc.get_cache(tmpdir)
+        assert_true(xpc.get_cache(pjoin(tmpdir, '.')) is cache)
+        assert_true(xpc.get_cache(cache) is cache)
+        for engine in ('fast', 'pyparsing'):
+            for result in ('native', 'nodes'):
+                expected = xpp.read_protocols(contents, engine=engine,
+                                              result=result)
+                for i in range(2):
+                    res = xpp.read_protocols(contents, engine=engine,
+                                             result=result, cache_dir=tmpdir)
+                    if engine == 'pyparsing' and result == 'native':
+                        assert_equal(res.asList(), expected.asList())
+                        assert_equal(res[0].attrs.Name,
+                                     expected[0].attrs.Name)
+                    else:
+                        assert_equal(res, expected)
+        stats = cache.stats()
+        assert_equal((stats['hits'], stats['misses'], stats['writes']),
+                     (4, 4, 4))
+        assert_true(stats['currsize'] > 0)
+        # No temporary files left over
+        assert_equal(len(os.listdir(tmpdir)), 4)
+        # Corrupt entries are misses
+        for name in os.listdir(tmpdir):
+            with open(pjoin(tmpdir, name), 'wb') as fobj:
+                fobj.write(b'junk')
+        xpp.read_protocols(contents, engine='fast', cache_dir=tmpdir)
+        assert_equal(cache.stats()['misses'], 5)
+        cache.clear()
+        assert_equal(os.listdir(tmpdir), [])
+        assert_equal(cache.stats()['hits'], 0)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_eviction():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache = xpc.DiskCache(pjoin(tmpdir, 'cache'), max_bytes=400)
+        for i in range(3):
+            cache.set('key{0}'.format(i), 'x' * 100)
+            # Make sure modification times differ
+            os.utime(cache._path('key{0}'.format(i)),
+                     (time.time() - 10 + i,) * 2)
+        # Use first entry, so second is least recently used
+        assert_equal(cache.get('key0'), 'x' * 100)
+        cache.set('key3', 'x' * 100)
+        assert_equal(cache.stats()['evictions'], 1)
+        assert_true(cache.stats()['currsize'] <= 400)
+        assert_equal(cache.get('key1'), None)
+        for key in ('key0', 'key2', 'key3'):
+            assert_equal(cache.get(key), 'x' * 100)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_cache_key():
+    key = xpc.cache_key('<XProtocol> { }', 'fast native True')
+    assert_equal(key, xpc.cache_key('<XProtocol> { }', 'fast native True'))
+    assert_false(key == xpc.cache_key('<XProtocol> { }', 'fast nodes True'))
+    assert_false(key == xpc.cache_key('<XProtocol> {  }', 'fast native True'))
+
+
+def test_memo_cache():
+    memo = xpc.MemoCache(2)
+    calls = []
+
+    def parser(value):
+        def parse():
+            calls.append(value)
+            return [value]
+        return parse
+
+    res = memo.lookup('a', 'opt', parser('a'), copy=True)
+    res2 = memo.lookup('a', 'opt', parser('a'), copy=True)
+    assert_equal(res2, ['a'])
+    # Hits with copy return copies; changing results does not change the
+    # cache
+    assert_false(res2 is res)
+    res2.append('b')
+    assert_equal(memo.lookup('a', 'opt', parser('a'), copy=True), ['a'])
+    assert_equal(calls, ['a'])
+    # Otherwise hits return the result itself
+    res = memo.lookup('a', 'other', parser('a2'))
+    assert_true(memo.lookup('a', 'other', parser('a2')) is res)
+    memo.lookup('b', 'opt', parser('b'))
+    # ('a', 'opt') was least recently used
+    assert_equal(memo.stats(), dict(hits=3, misses=3, currsize=2, maxsize=2))
+    memo.lookup('b', 'opt', parser('b'))
+    memo.lookup('a', 'other', parser('a2'))
+    memo.lookup('a', 'opt', parser('a'))
+    assert_equal(calls, ['a', 'a2', 'b', 'a'])
+    memo.resize(1)
+    assert_equal(memo.stats()['currsize'], 1)
+    memo.clear()
+    assert_equal(memo.stats(), dict(hits=0, misses=0, currsize=0, maxsize=1))
+    # Disabled memo always parses
+    memo.resize(0)
+    memo.lookup('a', 'opt', parser('a'))
+    memo.lookup('a', 'opt', parser('a'))
+    assert_equal(memo.stats()['currsize'], 0)
+    assert_equal(len(calls), 6)
+
+
+def test_memo():
+    with open(pjoin(DATA_PATH, 'xprotocol_sample.txt'), 'rt') as fobj:
+        contents = fobj.read()
+    assert_equal(xpp.memo_stats()['maxsize'], 0)
+    xpp.enable_memo(4)
+    try:
+        res = xpp.read_protocols(contents, engine='fast')
+        assert_equal(xpp.read_protocols(contents, engine='fast'), res)
+        assert_false(xpp.read_protocols(contents) is res)
+        assert_false(xpp.read_protocols(contents, engine='fast',
+                                        result='nodes') is res)
+        assert_equal(xpp.memo_stats(),
+                     dict(hits=1, misses=3, currsize=3, maxsize=4))
+        # Embedded protocols in different parses use the memo
+        res2 = xpp.read_protocols(contents + ' ', engine='fast')
+        assert_false(res2 is res)
+        embedded = res[0].param_blocks[0].value[2].value
+        embedded2 = res2[0].param_blocks[0].value[2].value
+        assert_false(embedded is embedded2)
+        hits = xpp.memo_stats()['hits']
+        assert_equal(embedded.parsed, embedded2.parsed)
+        assert_equal(xpp.memo_stats()['hits'], hits + 1)
+        # Nodes and shared hits return stored nodes, in a new list
+        for result in ('nodes', 'shared'):
+            nodes = xpp.read_protocols(contents, engine='fast', result=result)
+            nodes2 = xpp.read_protocols(contents, engine='fast',
+                                        result=result)
+            assert_false(nodes2 is nodes)
+            assert_true(nodes2[0] is nodes[0])
+            nodes2.append(None)
+            assert_equal(len(xpp.read_protocols(contents, engine='fast',
+                                                result=result)), 1)
+    finally:
+        xpp.disable_memo()
+    assert_equal(xpp.memo_stats(),
+                 dict(hits=0, misses=0, currsize=0, maxsize=0))
+    assert_false(xpp.read_protocols(contents, engine='fast') is
+                 xpp.read_protocols(contents, engine='fast'))
+
+
+def test_memo_read_file():
+    # Combining results from the memo does not change the memo
+    one = '<XProtocol> { <ParamLong."A"> { 1 } }'
+    tmpdir = tempfile.mkdtemp()
+    xpp.enable_memo(16)
+    try:
+        fname = pjoin(tmpdir, 'protocols.txt')
+        with open(fname, 'wt') as fobj:
+            fobj.write(one + '\n' + one)
+        for engine in ('pyparsing', 'fast'):
+            assert_equal(len(xpp.read_protocols(one, engine=engine)), 1)
+            res = xpp.read_protocols_file(fname, True, engine=engine)
+            assert_equal(len(res), 2)
+            assert_equal(len(xpp.read_protocols(one, engine=engine)), 1)
+    finally:
+        xpp.disable_memo()
+        shutil.rmtree(tmpdir)
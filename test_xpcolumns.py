@@ -0,0 +1,85 @@
+""" Test columnar tables of protocol values
+"""
+
+from os.path import join as pjoin, dirname
+import io
+from unittest import SkipTest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import xpparse as xpp
+import xpcolumns as xpcol
+import xpnodes as xpn
+
+from nose.tools import assert_true, assert_equal, assert_raises
+
+from test_xpnodes import EXAMPLE
+
+DATA_PATH = dirname(__file__)
+EG_PROTO2 = pjoin(DATA_PATH, 'xprotocol_sample2.txt')
+
+
+def test_to_columns():
+    if np is None:
+        raise SkipTest('Need numpy for columns')
+    protocols = xpp.read_protocols(EXAMPLE + EXAMPLE.replace('450', '451'),
+                                   engine='fast')
+    columns = xpp.to_columns(protocols, sources=['a', 'b'])
+    rows = list(columns)
+    assert_equal(rows[:4],
+                 [('a', '@Name', -1, 'string', 'Nodes'),
+                  ('a', '@LimitRange', 0, 'bool', False),
+                  ('a', '@LimitRange', 1, 'bool', True),
+                  ('a', '@LimitRange.hi', 0, 'int', 1)])
+    arr = 'parammap[""]/paramarray["Arr"]'
+    assert_true(('a', 'parammap[""]/paramlong["Count"]', -1, 'int', 1)
+                in rows)
+    assert_true(('a', 'parammap[""]/paramstring["Empty"]', -1, 'null', None)
+                in rows)
+    assert_true(('a', arr, 0, 'int', 450) in rows)
+    assert_true(('b', arr, 0, 'int', 451) in rows)
+    assert_true(('b', 'ascconv/ulVersion', -1, 'int', 0x14b44b6) in rows)
+    assert_equal(len(rows), len(columns))
+    # Dictionary encoding and null masks
+    assert_equal(columns.paths.count(arr), 1)
+    assert_equal(columns.strings.count('Nodes'), 1)
+    is_int = np.isin(columns.type, [xpcol.BOOL, xpcol.INT])
+    assert_true(np.all(columns.int_null == ~is_int))
+    assert_true(np.all(columns.float_null))
+    assert_true(np.all(columns.int[columns.int_null] == 0))
+    # Same table from other engine, result types
+    for kwargs in (dict(), dict(result='nodes'), dict(result='shared')):
+        protocols = xpp.read_protocols(EXAMPLE + EXAMPLE.replace('450', '451'),
+                                       **kwargs)
+        assert_equal(list(xpp.to_columns(protocols, ['a', 'b'])), rows)
+    xpn.default_pool.clear()
+    assert_equal(xpcol.to_columns(protocols, ascconv=False).sources,
+                 ['0', '1'])
+    assert_raises(ValueError, xpp.to_columns, protocols, ['a'])
+    # Ints out of int64 range are strings
+    big = '<XProtocol> { <Big> { 1 %d } <Small> 2 }' % 2 ** 64
+    for engine in ('fast', 'pyparsing'):
+        big_protocols = xpp.read_protocols(big, engine=engine)
+        assert_equal(list(xpp.to_columns(big_protocols)),
+                     [('0', '@Big', 0, 'int', 1),
+                      ('0', '@Big', 1, 'string', str(2 ** 64)),
+                      ('0', '@Small', -1, 'int', 2)])
+
+
+def test_save_load():
+    if np is None:
+        raise SkipTest('Need numpy for columns')
+    with open(EG_PROTO2, 'rt') as fobj:
+        contents = fobj.read()
+    protocols = xpp.read_protocols(contents, engine='fast')
+    columns = xpp.to_columns(protocols, sources=[u'f\xe9.txt', 'b'])
+    for compressed in (False, True):
+        out = io.BytesIO()
+        xpp.save_columns(out, columns, compressed)
+        out.seek(0)
+        loaded = xpp.load_columns(out)
+        assert_equal(list(loaded), list(columns))
+        assert_equal(loaded.int.dtype, np.int64)
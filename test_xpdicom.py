@@ -0,0 +1,165 @@
+""" Test reading protocols from CSA headers of DICOM files
+"""
+
+from os.path import join as pjoin, dirname
+import struct
+import shutil
+import tempfile
+
+import xpparse as xpp
+import xpdicom
+from xpdicom import DicomError
+
+from nose.tools import assert_true, assert_equal, assert_raises
+
+
+DATA_PATH = dirname(__file__)
+EG_PROTO = pjoin(DATA_PATH, 'xprotocol_sample.txt')
+
+EXPLICIT_LE = '1.2.840.10008.1.2.1'
+IMPLICIT_LE = '1.2.840.10008.1.2'
+EXPLICIT_BE = '1.2.840.10008.1.2.2'
+
+
+def make_csa(tags):
+    """ CSA2 header for list of (name, vr, items) tuples
+
+    Items are bytes; each element has at least 6 items, as for Siemens
+    headers, the extra items being empty.
+    """
+    out = [b'SV10', b'\4\3\2\1', struct.pack('<2I', len(tags), 77)]
+    for name, vr, items in tags:
+        n_items = max(6, len(items))
+        out.append(struct.pack('<64si4s3i', name.encode('latin-1'), 1,
+                               vr.encode('latin-1'), 3, n_items, 77))
+        for i in range(n_items):
+            data = items[i] + b'\0' if i < len(items) else b''
+            n = len(data)
+            out.append(struct.pack('<4i', n, n, 77, n) + data +
+                       b'\0' * (-n % 4))
+    return b''.join(out)
+
+
+def _element(tag, vr, value, explicit, endian, length=None):
+    if len(value) % 2:
+        value += b'\0'
+    if length is None:
+        length = len(value)
+    head = struct.pack(endian + 'HH', tag >> 16, tag & 0xFFFF)
+    if tag >> 16 == 0xFFFE or not explicit:
+        return head + struct.pack(endian + 'I', length) + value
+    if vr.encode('ascii') in xpdicom._LONG_VRS:
+        return (head + vr.encode('ascii') + b'\0\0' +
+                struct.pack(endian + 'I', length) + value)
+    return head + vr.encode('ascii') + struct.pack(endian + 'H',
+                                                   length) + value
+
+
+def make_dicom(elements, syntax=EXPLICIT_LE, pixels=b''):
+    """ DICOM file bytes for list of (tag, vr, value) `elements`
+
+    `value` can be a list of lists of (tag, vr, value), for a sequence of
+    undefined length, with items of undefined length.  `pixels` is the pixel
+    data value.
+    """
+    explicit, endian = xpdicom.TRANSFER_SYNTAXES.get(syntax, (True, '<'))
+    meta = _element(0x00020010, 'UI', syntax.encode('ascii'), True, '<')
+    meta = _element(0x00020000, 'UL', struct.pack('<I', len(meta)), True,
+                    '<') + meta
+
+    def encode(elements):
+        out = []
+        for tag, vr, value in elements:
+            if isinstance(value, list):  # Sequence
+                items = [_element(0xFFFEE000, None, encode(item) +
+                                  _element(0xFFFEE00D, None, b'', explicit,
+                                           endian),
+                                  explicit, endian, 0xFFFFFFFF)
+                         for item in value]
+                out.append(_element(
+                    tag, vr, b''.join(items) +
+                    _element(0xFFFEE0DD, None, b'', explicit, endian),
+                    explicit, endian, 0xFFFFFFFF))
+            else:
+                out.append(_element(tag, vr, value, explicit, endian))
+        return b''.join(out)
+
+    elements = sorted(elements) + [(xpdicom.PIXEL_DATA, 'OW', pixels)]
+    return b'\0' * 128 + b'DICM' + meta + encode(elements)
+
+
+def siemens_elements(text, block=0x10):
+    """ Data elements with CSA headers, with protocol `text` """
+    series = make_csa([('UsedPatientWeight', 'IS', [b'70']),
+                       ('MrPhoenixProtocol', 'UN', [text.encode('latin-1')]),
+                       ('Other', 'LO', [])])
+    image = make_csa([('EchoLinePosition', 'IS', [b'64'])])
+    return [(0x00080060, 'CS', b'MR'),
+            (0x00081140, 'SQ', [[(0x00081150, 'UI', b'1.2.3'),
+                                 (0x00081155, 'UI', b'1.2.3.4')],
+                                [(0x00081150, 'UI', b'1.2.3')]]),
+            (0x00290000 | block, 'LO', b'SIEMENS CSA HEADER'),
+            (0x00290000 | block + 1, 'LO', b'SIEMENS MEDCOM HEADER2'),
+            (0x00290010 | block << 8, 'OB', image),
+            (0x00290020 | block << 8, 'OB', series),
+            (0x00290060 | (block + 1) << 8, 'LO', b'COMPRESSED'),
+            (0x00291008, 'CS', b'IMAGE NUM 4'),
+            (0x00310010, 'LO', b'AFTER CSA')]
+
+
+def test_from_dicom():
+    with open(EG_PROTO, 'rt') as fobj:
+        contents = fobj.read()
+    expected = xpp.read_protocols(contents, engine='fast')
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fname = pjoin(tmpdir, 'image.dcm')
+        # Pixel data that is not a valid element; walker stops before it
+        pixels = b'\xff' * 1001
+        for syntax in (EXPLICIT_LE, IMPLICIT_LE, EXPLICIT_BE,
+                       '1.2.840.10008.1.2.4.50'):
+            for block in (0x10, 0x11):
+                with open(fname, 'wb') as fobj:
+                    fobj.write(make_dicom(siemens_elements(contents, block),
+                                          syntax, pixels))
+                assert_equal(xpdicom.read_csa_text(fname), contents)
+                assert_equal(xpp.from_dicom(fname, engine='fast'), expected)
+                assert_equal(xpdicom.read_csa_text(
+                    fname, 'EchoLinePosition', 'image'), '64')
+        res = xpp.from_dicom(fname, result='nodes')
+        assert_equal(res, xpp.read_protocols(contents, result='nodes'))
+        with open(fname, 'rb') as fobj:
+            buf = fobj.read()
+        tags = [e[0] for e in xpdicom.iter_elements(buf)]
+        assert_equal(tags[0], 0x00080060)
+        assert_equal(tags[-1], 0x00310010)
+        assert_equal(len(tags), 9)
+        # Errors
+        assert_raises(DicomError, xpdicom.read_csa_text, fname, 'Missing')
+        assert_raises(DicomError, xpdicom.read_csa_text, fname, 'Other')
+        with open(fname, 'wb') as fobj:
+            fobj.write(make_dicom(siemens_elements(contents)[:2]))
+        assert_raises(DicomError, xpp.from_dicom, fname)
+        with open(fname, 'wb') as fobj:
+            fobj.write(make_dicom(siemens_elements(contents))[:1000])
+        assert_raises(DicomError, xpp.from_dicom, fname)
+        for data in (b'', b'not dicom' * 100):
+            with open(fname, 'wb') as fobj:
+                fobj.write(data)
+            assert_raises(DicomError, xpp.from_dicom, fname)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_csa_items():
+    csa = make_csa([('A', 'IS', [b'1', b'22']),
+                    ('MrPhoenixProtocol', 'UN', [b'text'])])
+    assert_equal(xpdicom.csa_items(csa, 'A'), [b'1', b'22'])
+    assert_equal(xpdicom.csa_items(csa, 'MrPhoenixProtocol'), [b'text'])
+    assert_equal(xpdicom.csa_items(csa, 'B'), None)
+    # CSA1 headers
+    assert_raises(DicomError, xpdicom.csa_items, csa[8:], 'A')
+    # Truncated headers
+    for n in (20, 100, 200):
+        assert_raises(DicomError, xpdicom.csa_items, csa[:-n], 'B')
+    assert_true(isinstance(DicomError(), ValueError))
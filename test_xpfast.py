@@ -0,0 +1,168 @@
+""" Test hand-written xprotocol parser against pyparsing parser
+"""
+
+from os.path import join as pjoin, dirname
+
+import xpparse as xpp
+import xpfast as xpf
+
+from pyparsing import ParseResults
+
+from nose.tools import (assert_true, assert_false, assert_equal,
+                        assert_raises)
+
+
+DATA_PATH = dirname(__file__)
+EG_PROTO = pjoin(DATA_PATH, 'xprotocol_sample.txt')
+EG_PROTO2 = pjoin(DATA_PATH, 'xprotocol_sample2.txt')
+
+
+def pp_to_plain(res, as_dict=False):
+    """ Convert pyparsing results to plain structures of the fast engine
+    """
+    if not isinstance(res, ParseResults):
+        return res
+    if not (as_dict or res.haskeys()):
+        return [pp_to_plain(v) for v in res]
+    out = {}
+    for key in res.keys():
+        out[key] = pp_to_plain(res[key], key in ('attrs', 'kwargs'))
+    if 'tag_type' in out:  # pyparsing drops empty tag names
+        out.setdefault('tag_name', '')
+    if out.get('tag_type') == 'paramcardlayout' and 'value' in out:
+        out['value'] = [(entry[0], pp_entry_value(entry))
+                        for entry in res['value']]
+    return out
+
+
+def pp_entry_value(entry):
+    if 'args' in entry:
+        return dict(args=pp_to_plain(entry['args']),
+                    kwargs=pp_to_plain(entry['kwargs'], True))
+    return entry[1]
+
+
+def pp_protocols(in_str):
+    protocols = []
+    for protocol in xpp.read_protocols(in_str):
+        plain = pp_to_plain(protocol, True)
+        for key in ('param_blocks', 'card_layouts', 'dependencies'):
+            plain.setdefault(key, [])
+        protocols.append(plain)
+    return protocols
+
+
+def fast_protocols(in_str):
+    return xpp.read_protocols(in_str, engine='fast')
+
+
+def assert_same_parse(in_str):
+    assert_equal(fast_protocols(in_str), pp_protocols(in_str))
+
+
+def find_block(blocks, prefix):
+    for block in blocks:
+        if block.tag_name.startswith(prefix):
+            return block
+
+
+def test_samples():
+    for fname in (EG_PROTO, EG_PROTO2):
+        with open(fname, 'rt') as fobj:
+            contents = fobj.read()
+        assert_same_parse(contents)
+    # Nested protocol from first sample
+    with open(EG_PROTO, 'rt') as fobj:
+        protocol = fast_protocols(fobj.read())[0]
+    assert_equal(protocol.attrs.Name, 'PhoenixMetaProtocol')
+    assert_equal(len(protocol.param_blocks), 1)
+    assert_equal(len(protocol.dependencies), 0)
+    nested = find_block(protocol.param_blocks[0].value, 'Protocol')
+    proto_str = xpp.strip_twin_quote(nested.value)
+    assert_same_parse(proto_str)
+    res = fast_protocols(proto_str)
+    assert_equal(len(res), 2)
+    assert_false('ascconv' in res[0])
+    assert_true(res[1].ascconv.startswith('### ASCCONV BEGIN ###'))
+    assert_true(res[1].ascconv.endswith('### ASCCONV END ###'))
+
+
+def test_blocks():
+    assert_same_parse("""
+<XProtocol>
+{
+  <Name> "A ""name"" here"
+  <Userversion> 2.0
+  <ParamMap."">
+  {
+    <ParamBool."IsInlineComposed"> { <LimitRange> { "false" "true" } }
+    <ParamLong."Count"> { <Default> -1 1 }
+    <ParamString."Name"> { "true" }
+    <ParamChoice."Choose"> { <Limit> { "a" "b" } "a" }
+    <ParamArray."Arr">
+    {
+      <MinSize> 1
+      <Default> <ParamMap.""> { <ParamLong."L"> { } }
+      { 450 2.5 <hi> "ho" 1 }
+    }
+    <PipeService."EVA">
+    {
+      <Class> "PipeLinkService@MrParc"
+      <ParamFunctor."F">
+      {
+        <Class> "F@Functors"
+        <ParamBool."EXECUTE"> { }
+        <Method."M"> { "int32_t" }
+        <Connection."c1"> { "ImageReady" "" "ComputeImage" }
+        <Event."E"> { }
+      }
+    }
+  }
+  <ParamCardLayout."Multistep">
+  {
+    <Repr> "LAYOUT_10X2_WIDE_CONTROLS"
+    <Control>  { <Param> "MultiStep.IsMultistep" <Pos> 110 3 }
+    <Line>  { 126 3 126 33 }
+  }
+  <Dependency."D"> {"MultiStep.TpPosMode" <Dll> "MrMultiStepDependencies" }
+}
+### ASCCONV BEGIN ###
+ulVersion                                = 0x14b44b6
+### ASCCONV END ###
+<XProtocol> { }""")
+
+
+def test_attribute_access():
+    protocol = fast_protocols("""
+<XProtocol>
+{
+  <LimitRange> { "false" "true" <hi> 1 2 }
+  <ParamLong."Count"> { 1 }
+}""")[0]
+    assert_equal(protocol.attrs.LimitRange.args, [False, True])
+    assert_equal(protocol.attrs.LimitRange.kwargs.hi, [1, 2])
+    block = protocol.param_blocks[0]
+    assert_equal((block.tag_type, block.tag_name, block.value),
+                 ('paramlong', 'Count', 1))
+    # Missing keys give empty string, as for ParseResults
+    assert_equal(protocol.ascconv, '')
+    assert_raises(KeyError, protocol.__getitem__, 'ascconv')
+    assert_raises(AttributeError, getattr, protocol, '__missing_dunder__')
+
+
+def test_errors():
+    for bad in ('', '<XProtocol> {', '<XProtocol> { } junk',
+                '<XProtocol> { <ParamLong."Count"> { 1.5 } }',
+                '<XProtocol> { <PipeService."P"> { } }',
+                '<XProtocol> { <ParamFunctor."F"> { <Event."E"> { } } }'):
+        assert_raises(xpf.ParseError, fast_protocols, bad)
+    # Trailing text is OK without parse_all
+    res = xpp.read_protocols('<XProtocol> { } junk', False, engine='fast')
+    assert_equal(len(res), 1)
+    try:
+        fast_protocols('<XProtocol>\n{ junk }')
+    except xpf.ParseError as err:
+        assert_equal((err.loc, err.lineno, err.col), (14, 2, 3))
+    else:
+        raise AssertionError('Expected ParseError')
+    assert_raises(ValueError, xpp.read_protocols, '', engine='foo')
@@ -0,0 +1,193 @@
+""" Test structural index of xprotocol blocks
+"""
+
+from os.path import join as pjoin, dirname
+
+import xpparse as xpp
+import xpfast as xpf
+
+from nose.tools import assert_true, assert_equal, assert_raises
+
+
+DATA_PATH = dirname(__file__)
+EG_PROTO = pjoin(DATA_PATH, 'xprotocol_sample.txt')
+EG_PROTO2 = pjoin(DATA_PATH, 'xprotocol_sample2.txt')
+
+SIMPLE = """<XProtocol>
+{
+  <Name> "A {curly} ""name"" here"
+  <ParamMap."">
+  {
+    <ParamLong."Count"> { <LimitRange> { 1 2 } 1 }
+    <ParamArray."Arr"> { <Default> <ParamLong.""> { } { 1 } }
+  }
+  <Dependency."D"> { "x" }
+}"""
+
+
+def test_index_simple():
+    index = xpp.index_blocks(SIMPLE)
+    assert_equal(len(index), 6)
+    assert_equal([(t, n, d, p) for t, n, s, e, d, p in index],
+                 [('xprotocol', '', 0, -1),
+                  ('parammap', '', 1, 0),
+                  ('paramlong', 'Count', 2, 1),
+                  ('paramarray', 'Arr', 2, 1),
+                  ('paramlong', '', 3, 3),
+                  ('dependency', 'D', 1, 0)])
+    assert_equal(index.span(0), (0, len(SIMPLE)))
+    start, end = index.span(2)
+    assert_equal(SIMPLE[start:end],
+                 '<ParamLong."Count"> { <LimitRange> { 1 2 } 1 }')
+    assert_equal(index.children(1), [2, 3])
+    assert_equal(index.find('ParamLong'), [2, 4])
+    assert_equal(index.find(tag_name='Count'), [2])
+    assert_equal(index.find('paramlong', parent=3), [4])
+    assert_equal(index.find(parent=-1), [0])
+
+
+def test_index_samples():
+    for fname in (EG_PROTO, EG_PROTO2):
+        with open(fname, 'rt') as fobj:
+            contents = fobj.read()
+        index = xpp.index_blocks(contents)
+        protocols = xpf.read_protocols(contents)
+        assert_equal(index.find('xprotocol'),
+                     index.find(parent=-1))
+        assert_equal(len(index.find('xprotocol')), len(protocols))
+        # Every indexed parameter block parses to its indexed end
+        for i in range(len(index)):
+            if index.tag_types[i] in xpf._BLOCK_BODIES:
+                block, end = xpf.parse_param_block(contents, index.starts[i])
+                assert_equal(end, index.ends[i])
+                assert_equal(block.tag_name, index.tag_names[i])
+    # The embedded protocol is one string, not indexed
+    with open(EG_PROTO, 'rt') as fobj:
+        index = xpp.index_blocks(fobj.read())
+    assert_true('Protocol0' in index.tag_names)
+    assert_equal(index.find('xprotocol'), [0])
+
+
+def test_protocol_spans():
+    with open(EG_PROTO, 'rt') as fobj:
+        nested = xpp.strip_twin_quote(
+            xpp.get(fobj.read(), 'ParamMap/ParamString["Protocol0"]'))
+    index = xpp.index_blocks(nested)
+    expected = [index.span(i) for i in index.find(parent=-1)]
+    assert_equal(len(expected), 2)
+    assert_equal(xpp.protocol_spans(nested), expected)
+    assert_equal(xpp.protocol_spans(nested.encode('latin-1')), expected)
+    # ASCCONV section goes with preceding protocol
+    assert_true(nested[:expected[1][1]].endswith('### ASCCONV END ###'))
+    # Stray content is skipped, unclosed protocol is dropped, scan stops at
+    # unmatched brace
+    assert_equal(xpp.protocol_spans(b'junk { } <XProtocol> { } <XProtocol> {'),
+                 [(9, 24)])
+    assert_equal(xpp.protocol_spans('<XProtocol> { } } <XProtocol> { }'),
+                 [(0, 15)])
+
+
+def test_stream_blocks():
+    chunks = ['<XProtocol> { <ParamLong."A"> { 1 } <Par', 'amMap."M"> { <',
+              'ParamBool."B"> { } } <Dependency."D"> { "a" } }\n',
+              '  ### ASCCONV BEGIN ###\nx = 1\n### ASCCONV ', 'END ###\n',
+              '\t<XProtocol> { }']
+    res = list(xpp.stream_blocks(chunks))
+    assert_equal([tag_type for tag_type, text in res],
+                 ['paramlong', 'parammap', 'dependency', 'xprotocol',
+                  'xprotocol'])
+    assert_equal(res[1][1], '<ParamMap."M"> { <ParamBool."B"> { } }')
+    assert_true(res[3][1].endswith('### ASCCONV END ###'))
+    # Second protocol starts at beginning of line
+    assert_equal(res[4][1], '\t<XProtocol> { }')
+    for bad in ('', ' junk ', '<XProtocol> { } junk', '<XProtocol> {',
+                '} <XProtocol> { }', '<ParamLong."x"> { }'):
+        assert_raises(xpf.ParseError, list, xpp.stream_blocks([bad]))
+    # Same protocols for any chunk size
+    text = ''.join(chunks)
+    protocols = [text for tag_type, text in res if tag_type == 'xprotocol']
+    for size in (1, 3, 10, 1000):
+        split = [text[i:i + size] for i in range(0, len(text), size)]
+        assert_equal(list(xpp.stream_protocols(split)), protocols)
+        assert_equal(list(xpp.stream_blocks(split)), res)
+    for bad in ('', ' junk ', '<XProtocol> { } junk', '<XProtocol> {',
+                '} <XProtocol> { }', '<XProtocol> { } "a"'):
+        assert_raises(xpf.ParseError, list, xpp.stream_protocols([bad]))
+
+
+def test_index_errors():
+    assert_raises(xpf.ParseError, xpp.index_blocks, '<XProtocol> { ')
+    assert_raises(xpf.ParseError, xpp.index_blocks, '<XProtocol> { } }')
+    try:
+        xpp.index_blocks('<XProtocol> {\n  <ParamMap."a"> { { }')
+    except xpf.ParseError as err:
+        assert_equal((err.lineno, err.col), (2, 3))
+    else:
+        raise AssertionError('Expected ParseError')
+
+
+def test_selector():
+    sel = xpp.Selector('ParamMap[""] / ParamLong["Count"]')
+    assert_equal(sel.steps, [('parammap', '', None),
+                             ('paramlong', 'Count', None)])
+    assert_equal(xpp.Selector("*['a']/ParamLong[-1]").steps,
+                 [(None, 'a', None), ('paramlong', None, -1)])
+    assert_equal(xpp.Selector('x["a""b"]').steps, [('x', 'a"b', None)])
+    for bad in ('', 'ParamMap[', 'ParamMap//ParamLong', 'Param.Map'):
+        assert_raises(ValueError, xpp.Selector, bad)
+    index = xpp.index_blocks(SIMPLE)
+    assert_equal(sel.find(index), [2])
+    assert_equal(xpp.Selector('parammap/*').find(index), [2, 3])
+    assert_equal(xpp.Selector('ParamMap/*[1]').find(index), [3])
+    assert_equal(xpp.Selector('ParamMap/*[-2]').find(index), [2])
+    assert_equal(xpp.Selector('ParamMap/*[2]').find(index), [])
+    assert_equal(xpp.Selector('XProtocol[0]/Dependency').find(index), [5])
+    assert_equal(xpp.Selector('ParamArray').find(index), [])
+
+
+def test_get():
+    for engine in ('fast', 'pyparsing'):
+        assert_equal(xpp.get(SIMPLE, 'ParamMap[""]/ParamLong["Count"]',
+                             engine=engine), 1)
+        assert_equal(list(xpp.get(SIMPLE, 'ParamMap/ParamArray["Arr"]',
+                                  engine=engine)), [1])
+        assert_equal(xpp.get(SIMPLE, 'ParamMap/ParamArray/ParamLong',
+                             engine=engine), None)
+        assert_equal(xpp.get(SIMPLE, 'ParamMap/ParamLong["Nope"]', 'dflt',
+                             engine=engine), 'dflt')
+        dep = xpp.get(SIMPLE, 'Dependency["D"]', engine=engine)
+        assert_equal(list(dep['args']), ['x'])
+    assert_raises(ValueError, xpp.get, SIMPLE, 'ParamMap', engine='foo')
+    with open(EG_PROTO, 'rt') as fobj:
+        contents = fobj.read()
+    index = xpp.index_blocks(contents)
+    for engine in ('fast', 'pyparsing'):
+        embedded = xpp.get(contents, 'ParamMap[""]/ParamString["Protocol0"]',
+                           index=index, engine=engine)
+        assert_true(isinstance(embedded, xpp.EmbeddedProtocol))
+        assert_equal(embedded.engine, engine)
+        nested = embedded.text
+        assert_equal(xpp.get(nested, 'ParamMap/ParamMap["PerformanceCache"]/'
+                             'ParamLong["recon_prio_can_set"]',
+                             engine=engine), 1)
+        ascconv = xpp.get(nested, 'XProtocol[1]', engine=engine)['ascconv']
+        assert_true(ascconv.startswith('### ASCCONV BEGIN ###'))
+    # Selector objects can be reused
+    sel = xpp.Selector('ParamMap/ParamLong["Count"]')
+    assert_equal(xpp.get(contents, sel, index=index), 1)
+    assert_equal(sel.get(contents, index=index), 1)
+
+
+def test_tabs():
+    # Tabs in values expand as for parsing the whole text
+    for text in ('<XProtocol> { <ParamString."S"> { "a\tb" } }',
+                 '<XProtocol>\n{\n\t <ParamString."S">\t{ "a\tb\n\tc" } }'):
+        expected = xpp.read_protocols(text)[0]['param_blocks'][0]['value']
+        assert_true('\t' not in expected)
+        for engine in ('fast', 'pyparsing'):
+            res = xpp.read_protocols(text, engine=engine)
+            assert_equal(res[0]['param_blocks'][0]['value'], expected)
+            assert_equal(xpp.get(text, 'ParamString["S"]', engine=engine),
+                         expected)
+            blocks = list(xpp.iter_param_blocks(text, engine=engine))
+            assert_equal(blocks[0]['value'], expected)
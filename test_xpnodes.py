@@ -0,0 +1,148 @@
+""" Test compact node results
+"""
+
+from os.path import join as pjoin, dirname
+import pickle
+
+import xpparse as xpp
+import xpnodes as xpn
+
+from nose.tools import (assert_true, assert_false, assert_equal,
+                        assert_raises)
+
+
+DATA_PATH = dirname(__file__)
+EG_PROTO = pjoin(DATA_PATH, 'xprotocol_sample.txt')
+EG_PROTO2 = pjoin(DATA_PATH, 'xprotocol_sample2.txt')
+
+EXAMPLE = """
+<XProtocol>
+{
+  <Name> "Nodes"
+  <LimitRange> { "false" "true" <hi> 1 2 }
+  <ParamMap."">
+  {
+    <ParamLong."Count"> { 1 }
+    <ParamString."Empty"> { }
+    <ParamArray."Arr">
+    {
+      <Default> <ParamLong.""> { }
+      { 450 2 }
+    }
+    <ParamFunctor."F">
+    {
+      <Class> "F@Functors"
+      <Method."M"> { "int32_t" }
+      <Connection."c1"> { "ImageReady" "" "ComputeImage" }
+      <Event."E"> { "int32_t" }
+    }
+  }
+  <ParamCardLayout."Multistep">
+  {
+    <Repr> "LAYOUT_10X2_WIDE_CONTROLS"
+    <Control>  { <Param> "MultiStep.IsMultistep" <Pos> 110 3 }
+  }
+  <Dependency."D"> {"MultiStep.TpPosMode" <Dll> "MrMultiStepDependencies" }
+}
+### ASCCONV BEGIN ###
+ulVersion                                = 0x14b44b6
+### ASCCONV END ###"""
+
+
+def test_nodes():
+    for engine in ('pyparsing', 'fast'):
+        protocol, = xpp.read_protocols(EXAMPLE, engine=engine, result='nodes')
+        assert_true(isinstance(protocol, xpn.XProtocol))
+        assert_equal(protocol.attrs['Name'], 'Nodes')
+        limits = protocol.attrs['LimitRange']
+        assert_equal(limits, xpn.ListValue((False, True), {'hi': (1, 2)}))
+        assert_equal(len(protocol.param_blocks), 1)
+        count, empty, arr, functor = protocol.param_blocks[0].value
+        assert_equal((count.tag_type, count.tag_name, count.value),
+                     ('paramlong', 'Count', 1))
+        assert_equal(count['value'], 1)
+        assert_equal(count.keys(), ['tag_type', 'tag_name', 'attrs', 'value'])
+        assert_equal(empty.value, None)
+        assert_false('value' in empty)
+        assert_raises(KeyError, empty.__getitem__, 'value')
+        assert_equal(arr.value, (450, 2))
+        assert_equal(arr.default.tag_type, 'paramlong')
+        assert_equal(functor['class'], 'F@Functors')
+        assert_equal(functor.event,
+                     xpn.Dependency('event', 'E', ('int32_t',), {}))
+        assert_raises(AttributeError, getattr, count, 'default')
+        layout, = protocol.card_layouts
+        assert_equal(layout.tag_type, 'paramcardlayout')
+        assert_equal(layout.value[1],
+                     ('Control', xpn.ListValue(
+                         (), {'Param': 'MultiStep.IsMultistep',
+                              'Pos': (110, 3)})))
+        dependency, = protocol.dependencies
+        assert_equal(dependency.kwargs, {'Dll': 'MrMultiStepDependencies'})
+        assert_true(protocol.ascconv.startswith('### ASCCONV BEGIN ###'))
+        # Nodes pickle
+        assert_equal(pickle.loads(pickle.dumps(protocol)), protocol)
+    assert_raises(ValueError, xpp.read_protocols, EXAMPLE, result='foo')
+
+
+def test_engines_agree():
+    for fname in (EG_PROTO, EG_PROTO2):
+        with open(fname, 'rt') as fobj:
+            contents = fobj.read()
+        nodes = xpp.read_protocols(contents, engine='fast', result='nodes')
+        assert_equal(nodes,
+                     xpp.read_protocols(contents, result='nodes'))
+        assert_equal(nodes,
+                     xpn.to_nodes(xpp.read_protocols(contents, engine='fast')))
+
+
+def test_shared():
+    with open(EG_PROTO, 'rt') as fobj:
+        contents = fobj.read()
+    pool = xpn.SharePool()
+    nodes = xpp.read_protocols(contents, engine='fast', result='nodes')
+    shared = xpn.share(nodes, pool)
+    assert_equal(shared, tuple(nodes))
+    n_unique = len(pool)
+    # Second tree from same text shares all its parts with the first
+    shared2 = xpn.share(
+        xpp.read_protocols(contents, engine='fast', result='nodes'), pool)
+    assert_true(shared2 is shared)
+    assert_equal(len(pool), n_unique)
+    # Equal subtrees share; tag names interned
+    protocol, = xpp.read_protocols(EXAMPLE, result='nodes')
+    sprotocol = xpn.share([protocol, protocol], pool)
+    assert_true(sprotocol[0] is sprotocol[1])
+    count = sprotocol[0].param_blocks[0].value[0]
+    assert_true(count.tag_name is xpn.intern('Count'))
+    # Dicts become read-only
+    attrs = sprotocol[0].attrs
+    assert_true(isinstance(attrs, xpn.FrozenDict))
+    assert_raises(TypeError, attrs.__setitem__, 'Name', 'Other')
+    assert_raises(TypeError, attrs.update, {})
+    assert_raises(TypeError, attrs.__ior__, {})
+    assert_equal(pickle.loads(pickle.dumps(sprotocol)), sprotocol)
+    # Equal values of different types stay separate
+    ones = xpn.share((1, True, 1.0), pool)
+    assert_equal([type(v) for v in ones], [int, bool, float])
+    assert_false(xpn.share((1,), pool) is xpn.share((True,), pool))
+    assert_false(xpn.share((0.0,), pool) is xpn.share((-0.0,), pool))
+    pool.clear()
+    assert_equal(len(pool), 0)
+    # Pool with size limit clears when full
+    small = xpn.SharePool(3)
+    values = [xpn.share((i,), small) for i in range(3)]
+    assert_true(xpn.share((0,), small) is values[0])
+    assert_equal(len(small), 3)
+    xpn.share((3,), small)
+    assert_equal(len(small), 1)
+    assert_false(xpn.share((0,), small) is values[0])
+    assert_equal(xpn.share((0,), small), values[0])
+    assert_equal(xpn.default_pool.maxsize, 2 ** 16)
+    # Default pool for result='shared'
+    res = xpp.read_protocols(contents, engine='fast', result='shared')
+    assert_equal(res, list(shared))
+    assert_true(xpp.read_protocols(contents, engine='fast',
+                                   result='shared')[0] is res[0])
+    xpn.default_pool.clear()
+
@@ -2,10 +2,19 @@
 """
 
 from os.path import join as pjoin, dirname
+import io
+import sys
+import pickle
+import itertools
+import shutil
+import tempfile
+import subprocess
+import threading
 
 import xpparse as xpp
 
-from pyparsing import ParseException
+from pyparsing import (ParseException, ParserElement, _PackratCache, Group,
+                       Literal, Each)
 
 from nose.tools import (assert_true, assert_false, assert_equal,
                         assert_not_equal, assert_raises)
@@ -13,6 +22,7 @@ from nose.tools import (assert_true, assert_false, assert_equal,
 
 DATA_PATH = dirname(__file__)
 EG_PROTO = pjoin(DATA_PATH, 'xprotocol_sample.txt')
+EG_PROTO2 = pjoin(DATA_PATH, 'xprotocol_sample2.txt')
 
 
 def to_comparable(parse_results, expected):
@@ -109,6 +119,17 @@ def test_attributes():
                   '<LimitRange> { "false" "true" "astring" 2.3 4 <hi> "ho"}',
                   [['LimitRange', # Tuple form of dict
                    [False, True, 'astring', 2.3, 4], [['hi', 'ho']]]])
+    # attr gives same results as the alternative attribute rules
+    alternatives = Group(xpp.bool_attr | xpp.float_attr | xpp.int_attr |
+                         xpp.string_attr | xpp.list_attr)
+    for source in ('<A> "true"', '<A> "false" 1', '<A> "trues"', '<A> -1.5e3',
+                   '<A> 1e5', '<A> -12', '<A> ""', '<A> { }',
+                   '<A> { 1 2.0 <b> "c" "d" }', '<A> 1 2'):
+        assert_equal(xpp.attr.parseString(source).asList(),
+                     alternatives.parseString(source).asList())
+    for source in ('<A>', '<A> B', '<A."b"> 1', '<A> {'):
+        assert_raises(ParseException, xpp.attr.parseString, source)
+        assert_raises(ParseException, alternatives.parseString, source)
     # A section is some attrs
     assert_tokens(xpp.attrs,
                   """<Label> "Inline Composing"
@@ -122,6 +143,24 @@ def test_attributes():
                                 kwargs={}))))
 
 
+def test_simple_value():
+    # Single regex token matches and converts in MatchFirst order
+    for source, expected in (('"true"', True),
+                             ('"false"', False),
+                             ('2.5', 2.5),
+                             ('-3', -3),
+                             ('1e3', 1000.),
+                             ('"a ""string"""', 'a ""string""'),
+                             ('"truely"', 'truely')):
+        assert_tokens(xpp.simple_value, source, [expected])
+    # Restricted kinds only match their own values
+    assert_tokens(xpp.int_num, '-3', [-3])
+    assert_raises(ParseException, xpp.int_num.parseString, '"true"')
+    assert_tokens(xpp.string_value, '"true"', ['true'])
+    assert_raises(ParseException, xpp.bool_.parseString, '2')
+    assert_raises(ValueError, xpp.SimpleValue, ['int', 'complex'])
+
+
 def test_keys_values():
     # Keys / values returns dict, with list as values
     assert_tokens(xpp.key_values,
@@ -255,6 +294,45 @@ def test_param_map():
                                    attrs={},
                                    value=1)]))
 
+def test_keyword_dispatch():
+    # param_block gives same results and errors as MatchFirst of blocks
+    alternatives = (xpp.param_bool | xpp.param_long | xpp.param_string |
+                    xpp.param_choice | xpp.param_array | xpp.param_map |
+                    xpp.param_functor | xpp.pipe_service)
+    for source in ('<ParamLong."Count"> { 1 }',
+                   '  < paramlong ."Count"> { 1 }',
+                   '<PARAMMAP."m"> { <ParamBool."b"> { "true" } }',
+                   '<PipeService."p"> { <Class> "c" <ParamLong."l"> { } }'):
+        assert_equal(xpp.param_block.parseString(source).asList(),
+                     alternatives.parseString(source).asList())
+    def error_loc(element, source):
+        try:
+            element.parseString(source)
+        except ParseException as err:
+            return err.loc
+
+    source = '<ParamLong."Count"> { 1.5 }'
+    assert_equal(error_loc(xpp.param_block, source), 23)
+    assert_equal(error_loc(alternatives, source), 23)
+    # Unknown tag types
+    for source, loc in (('<ParamLongs."C"> { }', 1),
+                        ('< ParamDouble."C"> { 1.5 }', 2),
+                        ('<> { }', 0),
+                        (' ParamLong', 1)):
+        assert_equal(error_loc(xpp.param_block, source), loc)
+    # Generic dispatch, case sensitive
+    word = xpp.KeywordDispatch(r'(\w+)', dict(a=Literal('a') + Literal('1'),
+                                               B=Literal('B')),
+                               caseless=False)
+    assert_equal(word.parseString(' a 1').asList(), ['a', '1'])
+    assert_equal(word.parseString('B').asList(), ['B'])
+    assert_raises(ParseException, word.parseString, 'b')
+    assert_raises(ParseException, word.parseString, 'a 2')
+    assert_equal((Literal('x') + word).leaveWhitespace().parseString(
+        'xB').asList(), ['x', 'B'])
+    assert_equal(str(word), '{{"a" "1"} | "B"}')
+
+
 def test_param_choice():
     assert_tokens(xpp.param_choice,
                   """
@@ -414,6 +492,30 @@ def test_functor():
                        kwargs={})})
 
 
+def test_keyword_each():
+    # emc matches event, method, connection in any order, as for Each
+    members = dict(event='<Event."E"> { "int32_t" }',
+                   method='<Method."M"> { "int32_t" <k> 1 }',
+                   connection='<Connection."c1"> { "E" "" "M" }')
+    each = Each([Group(xpp.event)('event'),
+                 Group(xpp.method)('method'),
+                 Group(xpp.connection)('connection')])
+    for order in itertools.permutations(sorted(members)):
+        source = '\n'.join(members[key] for key in order)
+        res = xpp.emc.parseString(source, True)
+        expected = each.parseString(source, True)
+        assert_equal(res.asList(), expected.asList())
+        assert_equal(res.dump(), expected.dump())
+        assert_equal(res['method']['kwargs']['k'], 1)
+    # All members needed, each only once
+    em = members['event'] + members['method']
+    for source in (em, em + members['method'], em + '<ParamLong."a"> { }'):
+        assert_raises(ParseException, xpp.emc.parseString, source, True)
+        assert_raises(ParseException, each.parseString, source, True)
+    assert_equal(str(xpp.KeywordEach(r'(\w)', dict(a=Literal('a')))),
+                 '{"a"}')
+
+
 def test_pipe_service():
     xpp.pipe_service.parseString(
         """
@@ -600,3 +702,342 @@ def test_sample_file():
     proto_str = xpp.strip_twin_quote(v.value)
     res2 = xpp.read_protocols(proto_str)
     assert_equal(len(res2), 2)
+
+
+def test_packrat():
+    with open(EG_PROTO, 'rt') as fobj:
+        contents = fobj.read()
+    expected = xpp.read_protocols(contents).asList()
+    for packrat in (True, 1000):
+        res = xpp.read_protocols(contents, packrat=packrat)
+        assert_equal(res.asList(), expected)
+        stats = xpp.packrat_stats()
+        assert_true(stats['hits'] > 0)
+        assert_true(stats['misses'] > 0)
+        # Cache emptied after parse
+        assert_equal(stats['currsize'], 0)
+        # Packrat state, and size limit, restored after parse
+        assert_equal(stats['maxsize'], None)
+        assert_false(ParserElement._packratEnabled)
+    # Nested parse, from a parse action, keeps the cache of the outer parse
+    sizes = []
+
+    def inner_parse(s, l, t):
+        before = len(ParserElement._exprArgCache)
+        Literal('b').parseString('b')
+        sizes.append((before, len(ParserElement._exprArgCache)))
+
+    outer = Literal('a') + Literal('a').setParseAction(inner_parse)
+    ParserElement.enablePackrat(10)
+    try:
+        outer.parseString('a a')
+        assert_true(sizes[0][0] > 0)
+        assert_true(sizes[0][1] > sizes[0][0])
+        assert_equal(ParserElement.cacheStats()['currsize'], 0)
+    finally:
+        ParserElement.disablePackrat()
+    # Disabling removes the size limit
+    assert_equal(ParserElement.cacheStats()['maxsize'], None)
+    assert_equal(ParserElement._parseDepth, 0)
+    # Cache entries limited
+    cache = _PackratCache(2)
+    for i in range(4):
+        cache.set(i, str(i))
+    assert_equal(len(cache), 2)
+    assert_equal(cache.get(0), None)
+    assert_equal(cache.get(2), '2')
+    cache.set(4, '4')
+    # 2 recently used, 3 evicted
+    assert_true(2 in cache)
+    assert_false(3 in cache)
+    assert_equal((cache.hits, cache.misses), (1, 1))
+
+
+def test_embedded_protocol():
+    with open(EG_PROTO, 'rt') as fobj:
+        contents = fobj.read()
+    for engine in ('pyparsing', 'fast'):
+        protocol = xpp.read_protocols(contents, engine=engine)[0]
+        values = dict((v.tag_name, v.value)
+                      for v in protocol.param_blocks[0].value)
+        assert_false(isinstance(values['Count'], xpp.EmbeddedProtocol))
+        embedded = values['Protocol0']
+        assert_true(isinstance(embedded, xpp.EmbeddedProtocol))
+        # Value is still the raw string
+        assert_true(embedded.startswith('<XProtocol>'))
+        assert_equal(embedded.text, xpp.strip_twin_quote(embedded))
+        assert_false('_parsed' in embedded.__dict__)
+        parsed = embedded.parsed
+        assert_equal(len(parsed), 2)
+        assert_equal(parsed[0].attrs['Name'], 'MultiStep Controller')
+        # Memoized
+        assert_true(embedded.parsed is parsed)
+        # Pickles as string, without parse
+        unpickled = pickle.loads(pickle.dumps(embedded))
+        assert_equal(unpickled, embedded)
+        assert_equal(unpickled.engine, engine)
+        assert_false('_parsed' in unpickled.__dict__)
+    # Ordinary strings, and XProtocol-like ParamChoice, stay as strings
+    protocol = xpp.read_protocols("""<XProtocol> {
+        <ParamString."S"> { "Protocol" }
+        <ParamChoice."C"> { "<XProtocol> { }" }
+        <ParamString."P"> { " <xprotocol > { }" } }""")[0]
+    types = [type(b.value) for b in protocol.param_blocks]
+    assert_equal(types, [str, str, xpp.EmbeddedProtocol])
+
+
+def test_read_protocols_many():
+    texts = []
+    for item in (EG_PROTO, EG_PROTO2):
+        with open(item, 'rt') as fobj:
+            texts.append(fobj.read())
+    expected = [xpp.read_protocols(text, engine='fast') for text in texts]
+    items = [texts[0], '<XProtocol> { junk }', texts[1],
+             '<XProtocol> { <ParamLong."Count"> { 1 } }',
+             # Text without "<" is still text, not a file name
+             'junk']
+    paths = [EG_PROTO, pjoin(DATA_PATH, 'no_such_file.txt'), EG_PROTO2]
+    for workers in (1, 2):
+        res = xpp.read_protocols_many(items, workers=workers, chunksize=2,
+                                      engine='fast')
+        assert_equal(len(res), 5)
+        assert_equal(res[0], expected[0])
+        assert_true(isinstance(res[1], xpp.xpfast.ParseError))
+        assert_equal(res[2], expected[1])
+        assert_equal(res[3][0].param_blocks[0].value, 1)
+        assert_true(isinstance(res[4], xpp.xpfast.ParseError))
+        res = xpp.read_protocols_many(paths, workers, paths=True,
+                                      engine='fast')
+        assert_equal(res[0], expected[0])
+        assert_true(isinstance(res[1], IOError))
+        assert_equal(res[2], expected[1])
+    # Default engine and result type, as for read_protocols
+    res = xpp.read_protocols_many(items[:2], workers=2)
+    assert_equal(res[0][0].attrs['Name'], 'PhoenixMetaProtocol')
+    assert_true(isinstance(res[1], ParseException))
+    res = xpp.read_protocols_many(items[3:4], workers=2, result='nodes')
+    assert_equal(res[0][0].param_blocks[0].value, 1)
+    # Invalid arguments raise before starting workers
+    for workers in (1, 2):
+        for kwargs in (dict(engine='foo'), dict(result='foo'), dict(foo=1)):
+            assert_raises((ValueError, TypeError), xpp.read_protocols_many,
+                          items[3:4], workers=workers, **kwargs)
+    # Errors setting up worker returned as results
+    xpp._init_worker(dict(engine='foo'))
+    try:
+        assert_true(isinstance(xpp._read_text(items[3]), ValueError))
+    finally:
+        xpp._init_worker({})
+    assert_equal(xpp._read_text(items[3]).asList(),
+                 xpp.read_protocols(items[3]).asList())
+
+
+def test_read_protocols_file():
+    with open(EG_PROTO, 'rt') as fobj:
+        sample = fobj.read()
+    with open(EG_PROTO2, 'rt') as fobj:
+        sample2 = fobj.read()
+    nested = xpp.strip_twin_quote(
+        xpp.get(sample, 'ParamMap/ParamString["Protocol0"]'))
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fname = pjoin(tmpdir, 'protocols.txt')
+        for contents in (sample + sample2 + '\n\t' + nested,
+                         sample2.replace('\n', '\r\n'),
+                         # Content between protocols, error in protocol
+                         sample + '\njunk\n' + sample2,
+                         '<XProtocol> { } \n  <XProtocol> { junk }',
+                         ''):
+            with open(fname, 'wb') as fobj:
+                fobj.write(contents.encode('latin-1'))
+            for engine in ('fast', 'pyparsing'):
+                for parse_all in (True, False):
+                    try:
+                        expected = list(xpp.read_protocols(
+                            contents.replace('\r\n', '\n'), parse_all,
+                            engine=engine))
+                    except (ParseException, xpp.xpfast.ParseError) as err:
+                        expected = err
+                    for mmap in (True, False):
+                        try:
+                            res = list(xpp.read_protocols_file(
+                                fname, mmap, 'latin-1', parse_all=parse_all,
+                                engine=engine))
+                        except (ParseException,
+                                xpp.xpfast.ParseError) as err:
+                            assert_equal(type(err), type(expected))
+                            assert_equal(err.loc, expected.loc)
+                        else:
+                            assert_equal(
+                                [p.attrs.get('Name') for p in res],
+                                [p.attrs.get('Name') for p in expected])
+                            if engine == 'fast':
+                                assert_equal(res, expected)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_iter_protocols():
+    with open(EG_PROTO, 'rt') as fobj:
+        sample = fobj.read()
+    nested = xpp.strip_twin_quote(
+        xpp.get(sample, 'ParamMap/ParamString["Protocol0"]'))
+    contents = '\n'.join([sample, nested, nested])
+    for engine in ('fast', 'pyparsing'):
+        expected = xpp.read_protocols(contents, engine=engine)
+        for source in (contents, io.StringIO(contents)):
+            res = list(xpp.iter_protocols(source, 100, engine=engine))
+            assert_equal(len(res), 5)
+            assert_equal([p.attrs['Name'] for p in res[:2]],
+                         [p.attrs['Name'] for p in expected[:2]])
+            if engine == 'fast':
+                assert_equal(res, expected)
+    res = list(xpp.iter_protocols(EG_PROTO, engine='fast'))
+    assert_equal(res, xpp.read_protocols(sample, engine='fast'))
+    res = list(xpp.iter_protocols(io.StringIO(contents), 100, engine='fast',
+                                  result='nodes'))
+    assert_equal(res, xpp.read_protocols(contents, result='nodes'))
+    # Top level blocks as they come
+    gen = xpp.iter_param_blocks(io.StringIO(contents), 100, engine='fast')
+    block = next(gen)
+    assert_equal(block.tag_type, 'parammap')
+    assert_equal([b.tag_name for b in block.value],
+                 ['IsInlineComposed', 'Count', 'Protocol0'])
+    assert_equal(len(list(gen)), 4)
+    for engine in ('fast', 'pyparsing'):
+        res = list(xpp.iter_param_blocks(contents, engine=engine,
+                                         result='nodes'))
+        assert_equal(res, [p for protocol in
+                           xpp.read_protocols(contents, result='nodes')
+                           for p in protocol.param_blocks])
+    assert_raises(xpp.xpfast.ParseError, list,
+                  xpp.iter_protocols(contents + ' junk'))
+    assert_raises(ValueError, list, xpp.iter_param_blocks(contents,
+                                                          engine='foo'))
+
+
+def test_lazy_grammar():
+    # Fast engine does not import pyparsing or build the grammar
+    code = ("import sys, xpparse; "
+            "xpparse.read_protocols(open({0!r}).read(), engine='fast'); "
+            "print(sorted(set(sys.modules) & "
+            "set(['pyparsing', 'xpgrammar', 'multiprocessing'])))".format(
+                EG_PROTO))
+    out = subprocess.check_output([sys.executable, '-c', code],
+                                  cwd=DATA_PATH or '.',
+                                  universal_newlines=True)
+    assert_equal(out.strip(), '[]')
+    # Grammar elements are available from xpparse
+    import xpgrammar
+    assert_true(xpp.param_block is xpgrammar.param_block)
+    assert_true(xpp.ParseException is ParseException)
+    assert_raises(AttributeError, getattr, xpp, 'not_a_grammar_element')
+
+
+def test_parser():
+    with open(EG_PROTO, 'rt') as fobj:
+        contents = fobj.read()
+    for packrat in (False, True, 1000):
+        parser = xpp.XProtocolParser(packrat=packrat)
+        res = parser.read_protocols(contents)
+        assert_equal(res.asList(), xpp.read_protocols(contents).asList())
+        assert_equal(parser.read_protocols(contents, result='nodes'),
+                     xpp.read_protocols(contents, result='nodes'))
+        stats = parser.packrat_stats()
+        assert_equal(stats['hits'] > 0, bool(packrat))
+        assert_equal(stats['currsize'], 0)
+        assert_equal(stats['maxsize'], 1000 if packrat == 1000 else None)
+        clone = parser.clone()
+        assert_equal(clone.packrat, packrat)
+        assert_false(clone._grammar.element is parser._grammar.element)
+        assert_raises(ParseException, parser.read_protocols, contents + 'junk')
+        assert_equal(parser.read_protocols(contents + 'junk', False).asList(),
+                     res.asList())
+    # Global packrat state unchanged
+    assert_false(ParserElement._packratEnabled)
+    # Embedded protocols parse with the parser, and memoize once
+    calls = []
+    parse_string = parser._grammar.parse_string
+    parser._grammar.parse_string = lambda *args: (calls.append(args) or
+                                                  parse_string(*args))
+    res = parser.read_protocols(contents)
+    embedded = res[0]['param_blocks'][0]['value'][2]['value']
+    assert_equal(embedded.parser, parser.read_protocols)
+    xpp.enable_memo(4)
+    try:
+        parsed = embedded.parsed
+        assert_equal(len(calls), 2)
+        assert_equal(xpp.memo_stats()['currsize'], 1)
+        assert_equal(parsed.asList(),
+                     xpp.read_protocols(embedded.text).asList())
+    finally:
+        xpp.disable_memo()
+    assert_equal(pickle.loads(pickle.dumps(embedded)).parser, None)
+    parser = xpp.XProtocolParser('fast')
+    assert_equal(parser.read_protocols(contents, result='shared'),
+                 xpp.read_protocols(contents, result='shared'))
+    assert_raises(ValueError, xpp.XProtocolParser, 'foo')
+    assert_raises(ValueError, parser.read_protocols, contents, result='foo')
+
+
+def test_parser_threads():
+    # Parse from many threads, with shared and cloned parsers, while another
+    # thread switches global packrat state
+    with open(EG_PROTO, 'rt') as fobj:
+        contents = fobj.read()
+    texts = [contents, contents + ' junk', contents[:2000]]
+    expected = []
+    for text in texts:
+        try:
+            expected.append(xpp.read_protocols(text, result='nodes'))
+        except ParseException as err:
+            expected.append((err.loc, err.msg))
+    shared = xpp.XProtocolParser(packrat=True)
+    parsers = [shared, shared, shared, shared.clone(),
+               xpp.XProtocolParser(packrat=100), xpp.XProtocolParser(),
+               xpp.XProtocolParser('fast')]
+    failures = []
+    stop = threading.Event()
+
+    def parse(parser, n_iters=6):
+        try:
+            for i in range(n_iters):
+                for text, exp in zip(texts, expected):
+                    if parser.engine == 'fast' and isinstance(exp, tuple):
+                        continue
+                    try:
+                        res = parser.read_protocols(text, result='nodes')
+                    except ParseException as err:
+                        res = (err.loc, err.msg)
+                    if res != exp:
+                        failures.append((parser, text[:20], res))
+        except Exception as err:
+            failures.append((parser, err))
+
+    def toggle():
+        try:
+            while not stop.is_set():
+                xpp.read_protocols(contents, packrat=True)
+                xpp.read_protocols(contents, packrat=False)
+        except Exception as err:
+            failures.append(('toggle', err))
+
+    old_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        toggler = threading.Thread(target=toggle)
+        toggler.start()
+        threads = [threading.Thread(target=parse, args=(parser,))
+                   for parser in parsers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stop.set()
+        toggler.join()
+    finally:
+        sys.setswitchinterval(old_interval)
+    assert_equal(failures, [])
+    # Global packrat state restored
+    assert_false(ParserElement._packratEnabled)
+    assert_equal(ParserElement._exprArgCache.size, None)
@@ -0,0 +1,47 @@
+""" Test grammar element profiler
+"""
+
+from pyparsing import ParserElement, Word, alphas, nums
+
+import xpparse as xpp
+import xpprofile as xpr
+
+from nose.tools import assert_true, assert_equal
+
+from test_xpnodes import EXAMPLE
+
+
+def test_element_names():
+    word = Word(alphas)
+    pair = word + Word(nums)
+    names = xpr.element_names(dict(word=word, pair=pair, _hidden=pair,
+                                   other=1))
+    assert_equal(sorted(names.values()), ['pair', 'pair.1', 'word'])
+
+
+def test_profile():
+    parse_no_cache = ParserElement.__dict__['_parseNoCache']
+    parse = ParserElement.__dict__['_parse']
+    for packrat in (None, True):
+        profile = xpp.profile(EXAMPLE, packrat=packrat)
+        rows = dict((row[0], row[1:]) for row in profile.rows)
+        for name in ('xprotocol', 'param_block', 'attr', 'emc',
+                     'param_functor', 'string_or_protocol'):
+            assert_true(name in rows)
+        for calls, successes, failures, cum, self_ in rows.values():
+            assert_equal(calls, successes + failures)
+            assert_true(cum >= self_ >= 0)
+        assert_equal(rows['xprotocol'][:3], (2, 1, 1))
+        assert_equal(rows['param_functor'][1], 1)
+        selftimes = [row[5] for row in profile.sorted()]
+        assert_equal(selftimes, sorted(selftimes, reverse=True))
+        assert_equal(len(profile.sorted('calls', 3)), 3)
+        lines = str(profile).splitlines()
+        assert_equal(len(lines), 21)
+        assert_true(lines[0].split() ==
+                    ['calls', 'successes', 'failures', 'cumtime',
+                     'selftime', 'name'])
+        # Parser restored
+        assert_true(ParserElement.__dict__['_parseNoCache'] is
+                    parse_no_cache)
+        assert_true(ParserElement.__dict__['_parse'] is parse)
@@ -0,0 +1,205 @@
+""" asyncio interface to parse protocols without blocking the event loop
+
+Available as ``xpparse.aio``.  ``read_protocols`` parses one document in an
+executor, and ``read_protocols_many`` parses a stream of documents, with a
+bounded number in flight, for back-pressure on the source.
+
+Parsing is CPU bound Python code, so parses in threads hold the GIL, and
+delay the event loop thread by up to the interpreter switch interval (see
+``sys.setswitchinterval``) for each busy parse thread.  The default executor
+therefore has one thread.  Use a ``concurrent.futures.ProcessPoolExecutor``
+to parse in parallel, and to keep the event loop latency lowest, at the cost
+of pickling the text and results.  See ``benchmarks/bench_aio.py``.
+
+Needs Python >= 3.7.
+"""
+
+import asyncio
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import xpparse
+
+# Parsers for each (engine, packrat) in each executor thread or process
+_local = threading.local()
+
+_default_executor = None
+_default_lock = threading.Lock()
+
+
+def default_executor():
+    """ Return executor for ``executor=None``, a pool of one thread """
+    global _default_executor
+    with _default_lock:
+        if _default_executor is None:
+            _default_executor = ThreadPoolExecutor(
+                1, thread_name_prefix='xpaio')
+        return _default_executor
+
+
+def _parse(text, engine, packrat, kwargs):
+    """ Parse `text` with an ``XProtocolParser`` for this thread """
+    try:
+        parsers = _local.parsers
+    except AttributeError:
+        parsers = _local.parsers = {}
+    key = (engine, packrat)
+    try:
+        parser = parsers[key]
+    except KeyError:
+        parser = parsers[key] = xpparse.XProtocolParser(engine, packrat)
+    return parser.read_protocols(text, **kwargs)
+
+
+def _release_when_done(future, semaphore, loop):
+    """ Release `semaphore` when executor `future` finishes """
+    def release(future):
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(semaphore.release)
+    future.add_done_callback(release)
+
+
+async def read_protocols(text, executor=None, timeout=None, semaphore=None,
+                         engine='pyparsing', packrat=False, **kwargs):
+    """ Parse one or more XProtocols from string `text` in an executor
+
+    Parameters
+    ----------
+    text : str
+        String containing protocols.
+    executor : None or ``concurrent.futures.Executor``, optional
+        Executor for the parse.  None gives ``default_executor()``.
+    timeout : None or float, optional
+        Seconds to wait for the result, from submitting the parse to the
+        executor, after acquiring `semaphore`.  None waits for as long as the
+        parse takes.
+    semaphore : None or ``asyncio.Semaphore``, optional
+        If not None, parse after acquiring `semaphore`, and release it when
+        the parse finishes, to limit the number of parses at a time, for
+        example from all connections of a server.
+    engine : {'pyparsing', 'fast'}, optional
+        Parser engine, as for ``xpparse.read_protocols``.
+    packrat : bool or int, optional
+        Packrat memoization for the pyparsing engine, as for
+        ``xpparse.XProtocolParser``.
+    **kwargs : dict
+        Other keyword arguments for ``XProtocolParser.read_protocols``:
+        `parse_all` and `result`.
+
+    Returns
+    -------
+    protocols : sequence
+        Parsed protocols.
+
+    Raises
+    ------
+    asyncio.TimeoutError
+        If the parse takes longer than `timeout`.
+
+    Notes
+    -----
+    On timeout or cancellation, a parse that has not started does not run.
+    A running parse cannot be stopped, and runs to completion in the
+    executor, keeping `semaphore` until it finishes, so that `semaphore`
+    always limits the work in the executor.
+    """
+    loop = asyncio.get_running_loop()
+    if executor is None:
+        executor = default_executor()
+    if semaphore is not None:
+        await semaphore.acquire()
+    try:
+        future = executor.submit(_parse, text, engine, packrat, kwargs)
+    except BaseException:
+        if semaphore is not None:
+            semaphore.release()
+        raise
+    if semaphore is not None:
+        _release_when_done(future, semaphore, loop)
+    # Cancelling the wrapper cancels `future`, if it has not started
+    return await asyncio.wait_for(asyncio.wrap_future(future, loop=loop),
+                                  timeout)
+
+
+async def _iterate(texts):
+    """ Iterate over iterable or asynchronous iterable `texts` """
+    if hasattr(texts, '__aiter__'):
+        async for text in texts:
+            yield text
+    else:
+        for text in texts:
+            yield text
+
+
+async def read_protocols_many(texts, executor=None, limit=4, timeout=None,
+                              semaphore=None, **kwargs):
+    """ Parse documents from `texts`, with at most `limit` in flight
+
+    Use as::
+
+        async for protocols in read_protocols_many(texts):
+            ...
+
+    Parameters
+    ----------
+    texts : iterable or asynchronous iterable
+        Strings containing protocols.  Reads the next string from `texts`
+        only when there are fewer than `limit` strings parsing, or with
+        results waiting for the caller, so a slow caller, or slow parses,
+        slow the reads from `texts`.
+    executor : None or ``concurrent.futures.Executor``, optional
+        Executor for the parses, as for ``read_protocols``.
+    limit : int, optional
+        Maximum number of strings read from `texts` for which this generator
+        has not yet returned a result.
+    timeout : None or float, optional
+        Timeout for each parse, as for ``read_protocols``.
+    semaphore : None or ``asyncio.Semaphore``, optional
+        Semaphore to limit parses, shared with other calls, as for
+        ``read_protocols``.
+    **kwargs : dict
+        Other keyword arguments for ``read_protocols``.
+
+    Yields
+    ------
+    protocols : sequence or Exception
+        Result of ``read_protocols`` for each string, in the order of
+        `texts`, or the exception instance raised by the parse, such as
+        ``ParseException``, ``xpfast.ParseError`` or ``asyncio.TimeoutError``.
+
+    Notes
+    -----
+    Closing the generator, for example by leaving an ``async for`` loop
+    early, or cancelling the task iterating over it, cancels the parses in
+    flight, as for ``read_protocols``.
+    """
+    if limit < 1:
+        raise ValueError('limit should be at least 1')
+    pending = collections.deque()
+    try:
+        async for text in _iterate(texts):
+            pending.append(asyncio.ensure_future(read_protocols(
+                text, executor, timeout, semaphore, **kwargs)))
+            if len(pending) >= limit:
+                yield await _next_result(pending)
+        while pending:
+            yield await _next_result(pending)
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _next_result(pending):
+    """ Result or exception of first task in `pending`, removing the task """
+    try:
+        result = await asyncio.shield(pending[0])
+    except asyncio.CancelledError:
+        if not pending[0].cancelled():
+            # Caller cancelled; task cancelled by ``read_protocols_many``
+            raise
+        result = asyncio.CancelledError()
+    except Exception as err:
+        result = err
+    pending.popleft()
+    return result
@@ -0,0 +1,187 @@
+""" Parser for ASCCONV (MrProt) sections of xprotocol text
+
+The ASCCONV section is a list of ``key = value`` lines between ``### ASCCONV
+BEGIN ###`` and ``### ASCCONV END ###``, such as::
+
+    ulVersion                                = 0x14b44b6
+    tSequenceFileName                        = "%SiemensSeq%\\ep2d_diff"
+    sGRADSPEC.sCrossTermCompensationYX.aflTimeConstant[0] = 0.5
+
+``parse_ascconv`` finds all assignments with one regular expression, and
+converts the values, returning a dict keyed by the keys as written.
+``nest_keys``, or ``parse_ascconv(text, nested=True)``, expands the dotted and
+indexed keys into nested dicts and lists.
+"""
+from __future__ import print_function
+
+import re
+
+_assign_re = re.compile(
+    r'^[ \t]*(?P<key>[A-Za-z_][A-Za-z0-9_.\[\]]*)[ \t]*=[ \t]*'
+    r'(?:(?P<hex>[-+]?0[xX][0-9a-fA-F]+)|'
+    r'(?P<float>[-+]?(?:[0-9]+\.[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?|'
+    r'[-+]?[0-9]+[eE][-+]?[0-9]+)|'
+    r'(?P<int>[-+]?[0-9]+)|'
+    r'(?P<string>"[^\n]*"))'
+    r'[ \t]*(?:#[^\n]*)?\r?$',
+    re.M)
+
+_key_re = re.compile(r'[A-Za-z_][A-Za-z0-9_]*'
+                     r'(?:\.[A-Za-z_][A-Za-z0-9_]*|\[[0-9]+\])*$')
+_key_part_re = re.compile(r'([A-Za-z_][A-Za-z0-9_]*)|\[([0-9]+)\]')
+
+
+def _string(token):
+    """ Decode quoted string value
+
+    The value may be quoted with single double quotes, or, as in protocol text
+    that has not been unescaped, with doubled double quotes.  Doubled quotes
+    inside the value become single quotes.
+    """
+    value = token[1:-1]
+    if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+        value = value[1:-1]
+    return value.replace('""', '"')
+
+
+def split_key(key):
+    """ Split ASCCONV `key` into list of str names and int indices
+
+    Examples
+    --------
+    >>> split_key('sKSpace.asSlice[2].dThickness')
+    ['sKSpace', 'asSlice', 2, 'dThickness']
+    """
+    if _key_re.match(key) is None:
+        raise ValueError('Invalid ASCCONV key "{0}"'.format(key))
+    return [name if name else int(index)
+            for name, index in _key_part_re.findall(key)]
+
+
+# Cache of key -> (tuple of (part, container type for part), last part).
+# Keys come from a limited vocabulary of protocol parameters, so the cache
+# stays small; it is cleared if it gets large.
+_path_cache = {}
+_PATH_CACHE_MAX = 100000
+
+
+def _key_path(key):
+    try:
+        return _path_cache[key]
+    except KeyError:
+        pass
+    parts = split_key(key)
+    path = (tuple((part, dict if isinstance(next_part, str) else list)
+                  for part, next_part in zip(parts[:-1], parts[1:])),
+            parts[-1])
+    if len(_path_cache) >= _PATH_CACHE_MAX:
+        _path_cache.clear()
+    _path_cache[key] = path
+    return path
+
+
+def _set_nested(out, key, value):
+    """ Set `value` in nested dicts / lists `out` at path given by `key`
+
+    Each container has the right type for the part indexing into it, by
+    construction, so we only need to check the types of existing children,
+    and that `value` does not replace a container.
+    """
+    path, last = _key_path(key)
+    container = out
+    for part, container_type in path:
+        if part.__class__ is int:
+            n = len(container)
+            if part >= n:
+                container.extend([None] * (part + 1 - n))
+            child = container[part]
+        else:
+            child = container.get(part)
+        if child is None:
+            child = container[part] = container_type()
+        elif child.__class__ is not container_type:
+            raise ValueError('Key "{0}" conflicts with earlier key'.format(
+                key))
+        container = child
+    if last.__class__ is int:
+        n = len(container)
+        if last >= n:
+            container.extend([None] * (last + 1 - n))
+        child = container[last]
+    else:
+        child = container.get(last)
+    if child.__class__ is dict or child.__class__ is list:
+        raise ValueError('Key "{0}" conflicts with earlier key'.format(key))
+    container[last] = value
+
+
+def parse_ascconv(text, nested=False):
+    """ Parse ASCCONV ``key = value`` lines in `text`
+
+    Parameters
+    ----------
+    text : str
+        ASCCONV section, with or without the ``### ASCCONV BEGIN ###`` and
+        ``### ASCCONV END ###`` lines, as in the ``ascconv`` result of
+        ``read_protocols``.  Lines that are not assignments, such as the
+        BEGIN and END lines, are ignored.
+    nested : {False, True}, optional
+        If False, return a flat dict keyed by the keys as written.  If True,
+        also expand dotted and indexed keys into nested dicts and lists, so
+        that ``a.b[1] = 2`` gives ``{'a': {'b': [None, 2]}}``.  Indices
+        missing from lists are None.  Expanding the keys takes about as long
+        again as parsing; see ``nest_keys``.
+
+    Returns
+    -------
+    values : dict
+        Parsed values.  Hex values (``0x1``) and integers are ints, decimals
+        are floats, and quoted strings (with single or doubled double quotes)
+        are str.  Where a key appears more than once, the last value wins.
+
+    Raises
+    ------
+    ValueError
+        If `nested` is True and keys conflict, such as ``a.b = 1`` and
+        ``a.b.c = 2``.
+    """
+    out = {}
+    for key, hex_, float_, int_, string in _assign_re.findall(text):
+        if int_:
+            out[key] = int(int_)
+        elif float_:
+            out[key] = float(float_)
+        elif hex_:
+            out[key] = int(hex_, 16)
+        else:
+            out[key] = _string(string)
+    return nest_keys(out) if nested else out
+
+
+def nest_keys(values):
+    """ Expand dotted and indexed keys of flat dict `values` into nested dicts
+
+    Parameters
+    ----------
+    values : dict
+        Flat dict, such as the result of ``parse_ascconv(text)``.
+
+    Returns
+    -------
+    nested : dict
+        Values in nested dicts and lists, as for ``parse_ascconv(text,
+        nested=True)``.
+
+    Raises
+    ------
+    ValueError
+        If keys conflict, such as ``a.b`` and ``a.b.c``.
+    """
+    out = {}
+    for key, value in values.items():
+        # Plain keys can conflict with nested keys set before them
+        if '.' in key or '[' in key or key in out:
+            _set_nested(out, key, value)
+        else:
+            out[key] = value
+    return out
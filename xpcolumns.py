@@ -0,0 +1,353 @@
+""" Columnar tables of values in parsed protocols, with ``.npz`` storage
+
+``to_columns`` flattens protocols into rows of (protocol, path, index, type,
+value), stored as NumPy arrays, one per column, with dictionary-encoded paths
+and string values.  ``save_columns`` and ``load_columns`` store the table in
+an ``.npz`` file, without pickles, so that loading a large table is a few
+array reads.
+
+NumPy is only needed for the functions in this module.
+"""
+from __future__ import print_function
+
+from xpnodes import XProtocol, ListValue, basestring, _BLOCK_LISTS
+from xpascconv import parse_ascconv
+
+# Value types, in order of type codes
+TYPES = ('null', 'bool', 'int', 'float', 'string')
+NULL, BOOL, INT, FLOAT, STRING = range(len(TYPES))
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+# Format version of saved tables
+_VERSION = 1
+
+
+class Columns(object):
+    """ Table of values in parsed protocols, one array per column
+
+    For row ``i``:
+
+    * ``protocol[i]`` is the position of the protocol in the input to
+      ``to_columns``; ``sources[protocol[i]]`` is its source label;
+    * ``paths[path[i]]`` is the path of the value (see ``to_columns``);
+    * ``index[i]`` is the position of the value in its sequence, for list and
+      array values, or -1 for single values;
+    * ``TYPES[type[i]]`` is the value type, one of 'null' for an empty
+      block, 'bool', 'int', 'float', 'string';
+    * ``int[i]`` is the value for 'bool' and 'int' types, and
+      ``int_null[i]`` is False for these types, True otherwise;
+    * ``float[i]`` and ``float_null[i]`` are the same, for 'float';
+    * ``strings[string[i]]`` is the value for 'string', and
+      ``string_null[i]`` is False for that type, True otherwise.
+
+    Values in null positions of the value columns are 0.
+    """
+    _arrays = ('protocol', 'path', 'index', 'type', 'int', 'int_null',
+               'float', 'float_null', 'string', 'string_null')
+    _tables = ('sources', 'paths', 'strings')
+
+    def __init__(self, **kwargs):
+        for name in self._arrays + self._tables:
+            setattr(self, name, kwargs[name])
+
+    def __len__(self):
+        return len(self.protocol)
+
+    def value(self, i):
+        """ Return Python value of row `i` """
+        code = self.type[i]
+        if code == BOOL:
+            return bool(self.int[i])
+        if code == INT:
+            return int(self.int[i])
+        if code == FLOAT:
+            return float(self.float[i])
+        if code == STRING:
+            return self.strings[self.string[i]]
+        return None
+
+    def __getitem__(self, i):
+        """ Return row `i` as (source, path, index, type, value) """
+        return (self.sources[self.protocol[i]], self.paths[self.path[i]],
+                int(self.index[i]), TYPES[self.type[i]], self.value(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def _step(tag_type, tag_name):
+    return '{0}["{1}"]'.format(tag_type, tag_name.replace('"', '""'))
+
+
+# Type codes for value classes; other classes are strings
+_TYPE_CODES = {bool: BOOL, int: INT, float: FLOAT, type(None): NULL}
+_SINGLE_CLASSES = frozenset(_TYPE_CODES) | frozenset([str])
+
+
+class _Builder(object):
+    """ Accumulate rows for ``to_columns``
+
+    Walks parse results from either engine with item access, and nodes with
+    attribute access, the faster access for each, without making nodes.
+    Appends the path id and index of each row to their column buffers, and
+    the value to a list for the current protocol.  At the end of each
+    protocol, splits the values by type into buffers for the type codes and
+    each value column, so the values of each type are in row order.
+    ``columns`` converts each buffer to an array with one call.
+    """
+
+    def __init__(self):
+        self.path = []
+        self.index = []
+        self.type = []
+        self.ints = []
+        self.floats = []
+        self.strings = []
+        self.values = []
+        self.counts = []
+        self.path_ids = {}
+        self.string_ids = {}
+
+    def _path_id(self, path):
+        paths = self.path_ids
+        try:
+            return paths[path]
+        except KeyError:
+            value = paths[path] = len(paths)
+            return value
+
+    def _flush(self):
+        """ Move values of current protocol to the typed buffers """
+        values = self.values
+        get = _TYPE_CODES.get
+        types = [get(v.__class__, STRING) for v in values]
+        ints = [v for v, t in zip(values, types) if t == INT or t == BOOL]
+        if ints and (min(ints) < _INT64_MIN or max(ints) > _INT64_MAX):
+            # Ints too large for the int column become strings
+            for i, (value, code) in enumerate(zip(values, types)):
+                if code == INT and not _INT64_MIN <= value <= _INT64_MAX:
+                    types[i] = STRING
+            ints = [v for v, t in zip(values, types) if t == INT or t == BOOL]
+        self.ints += ints
+        self.floats += [v for v, t in zip(values, types) if t == FLOAT]
+        ids = self.string_ids
+        self.strings += [ids.setdefault(str(v), len(ids))
+                         for v, t in zip(values, types) if t == STRING]
+        self.type += types
+        self.counts.append(len(values))
+        self.values = []
+
+    def value(self, path, value):
+        path_id = self._path_id(path)
+        if value.__class__ in _SINGLE_CLASSES or \
+                isinstance(value, basestring):  # Embedded protocol
+            self.path.append(path_id)
+            self.index.append(-1)
+            self.values.append(value)
+            return
+        kwargs = None
+        if isinstance(value, ListValue):
+            value, kwargs = value.args, value.kwargs
+        elif not isinstance(value, (tuple, list)) and 'args' in value:
+            value, kwargs = value['args'], value['kwargs']
+        n = len(value)
+        self.path += [path_id] * n
+        self.index += range(n)
+        self.values.extend(value)
+        if kwargs:
+            for key in kwargs.keys():
+                self.value(path + '.' + key, kwargs[key])
+
+    def attrs(self, path, attrs):
+        for name in attrs.keys():
+            self.value(path + '@' + name, attrs[name])
+
+    def blocks(self, prefix, blocks):
+        for block in blocks:
+            tag_type = block['tag_type']
+            path = prefix + _step(tag_type, block.get('tag_name', ''))
+            if 'attrs' in block:
+                self.attrs(path, block['attrs'])
+            value = block['value'] if 'value' in block else None
+            if tag_type in _BLOCK_LISTS:
+                if value is not None:
+                    self.blocks(path + '/', value)
+            else:
+                self.value(path, value)
+
+    def node_blocks(self, prefix, blocks):
+        for block in blocks:
+            path = prefix + _step(block.tag_type, block.tag_name)
+            self.attrs(path, block.attrs)
+            if block.tag_type in _BLOCK_LISTS:
+                if block.value is not None:
+                    self.node_blocks(path + '/', block.value)
+            else:
+                self.value(path, block.value)
+
+    def protocol_rows(self, protocol, ascconv):
+        if isinstance(protocol, XProtocol):
+            self.attrs('', protocol.attrs)
+            self.node_blocks('', protocol.param_blocks)
+            text = protocol.ascconv
+        else:
+            self.attrs('', protocol['attrs'])
+            self.blocks('', protocol.get('param_blocks', ()))
+            text = protocol.get('ascconv', None)
+        if ascconv and text:
+            values = parse_ascconv(text)
+            path_id = self._path_id
+            self.path += [path_id('ascconv/' + key) for key in values]
+            self.index += [-1] * len(values)
+            self.values.extend(values.values())
+        self._flush()
+
+    def columns(self, sources):
+        import numpy as np
+        n = len(self.type)
+        types = np.array(self.type, dtype=np.int8)
+
+        def column(null, buffer, dtype):
+            col = np.zeros(n, dtype=dtype)
+            col[~null] = buffer
+            return col
+
+        int_null = (types != INT) & (types != BOOL)
+        float_null = types != FLOAT
+        string_null = types != STRING
+        return Columns(protocol=np.repeat(
+                           np.arange(len(self.counts), dtype=np.int32),
+                           self.counts),
+                       path=np.array(self.path, dtype=np.int32),
+                       index=np.array(self.index, dtype=np.int32),
+                       type=types,
+                       int=column(int_null, self.ints, np.int64),
+                       int_null=int_null,
+                       float=column(float_null, self.floats, np.float64),
+                       float_null=float_null,
+                       string=column(string_null, self.strings, np.int32),
+                       string_null=string_null,
+                       sources=list(sources),
+                       paths=_table_list(self.path_ids),
+                       strings=_table_list(self.string_ids))
+
+
+def _table_list(table):
+    """ List of keys of `table` in order of their ids """
+    out = [None] * len(table)
+    for key, i in table.items():
+        out[i] = key
+    return out
+
+
+def to_columns(protocols, sources=None, ascconv=True):
+    """ Flatten parsed `protocols` into a ``Columns`` table
+
+    Parameters
+    ----------
+    protocols : sequence
+        Protocols as returned by ``read_protocols``, from either engine, and
+        with any `result` type.
+    sources : None or sequence, optional
+        Label for each protocol, such as the file it came from.  None gives
+        labels of ``'0'``, ``'1'``, ... for the protocol positions.
+    ascconv : {True, False}, optional
+        If True, add a row for each assignment in ASCCONV sections.
+
+    Returns
+    -------
+    columns : Columns
+        Table with one row for each single value, and for each element of
+        list and array values, in:
+
+        * the protocol attributes, with paths such as ``'@Name'``;
+        * parameter blocks, with ``/``-separated paths as for ``get``, using
+          the lower case tag type, e.g.
+          ``'parammap[""]/paramlong["Count"]'``, and attributes of these
+          blocks, e.g.  ``'parammap[""]/paramlong["Count"]@Precision'``.
+          Keyword values in list values add ``.`` and the keyword to the
+          path.  Blocks without values have one 'null' row;
+        * ASCCONV assignments, if `ascconv` is True, with paths such as
+          ``'ascconv/sTXSPEC.asNucleusInfo[0].lFrequency'``.
+
+        Card layouts, dependencies, ParamArray defaults and functor events
+        are not included.  Embedded protocols are string values.
+    """
+    builder = _Builder()
+    for protocol in protocols:
+        builder.protocol_rows(protocol, ascconv)
+    n_protocols = len(builder.counts)
+    if sources is None:
+        sources = [str(i) for i in range(n_protocols)]
+    elif len(sources) != n_protocols:
+        raise ValueError('Need one source for each of {0} protocols'.format(
+            n_protocols))
+    return builder.columns(sources)
+
+
+def _encode_strings(strings):
+    """ UTF-8 array and character offsets for list of str `strings` """
+    import numpy as np
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in strings], out=offsets[1:])
+    data = np.frombuffer(u''.join(strings).encode('utf-8'), dtype=np.uint8)
+    return data, offsets
+
+
+def _decode_strings(data, offsets):
+    """ List of str from outputs of ``_encode_strings`` """
+    text = data.tobytes().decode('utf-8')
+    offsets = offsets.tolist()
+    return [text[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def save_columns(fname, columns, compressed=False):
+    """ Save ``Columns`` table `columns` to ``.npz`` file `fname`
+
+    Parameters
+    ----------
+    fname : str or file-like
+        File to write.
+    columns : Columns
+        Table from ``to_columns``.
+    compressed : {False, True}, optional
+        If True, compress the arrays, for a smaller file that is slower to
+        load.
+    """
+    import numpy as np
+    arrays = dict((name, getattr(columns, name)) for name in columns._arrays)
+    for name in columns._tables:
+        data, offsets = _encode_strings(getattr(columns, name))
+        arrays[name + '_data'] = data
+        arrays[name + '_offsets'] = offsets
+    arrays['version'] = np.array(_VERSION)
+    (np.savez_compressed if compressed else np.savez)(fname, **arrays)
+
+
+def load_columns(fname):
+    """ Load ``Columns`` table from ``.npz`` file `fname`
+
+    Parameters
+    ----------
+    fname : str or file-like
+        File written by ``save_columns``.
+
+    Returns
+    -------
+    columns : Columns
+        Loaded table.
+    """
+    import numpy as np
+    with np.load(fname, allow_pickle=False) as npz:
+        version = int(npz['version'])
+        if version != _VERSION:
+            raise ValueError('Unknown columns file version {0}'.format(
+                version))
+        kwargs = dict((name, npz[name]) for name in Columns._arrays)
+        for name in Columns._tables:
+            kwargs[name] = _decode_strings(npz[name + '_data'],
+                                           npz[name + '_offsets'])
+    return Columns(**kwargs)
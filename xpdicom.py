@@ -0,0 +1,296 @@
+""" Find XProtocol text in Siemens CSA headers of DICOM files
+
+Siemens MR DICOM files store the protocol in the CSA series header, a private
+element ``(0029,xx20)``, where ``xx`` is the block of private creator
+``SIEMENS CSA HEADER``.  The CSA header is a list of named elements, each
+with a list of items; the ``MrPhoenixProtocol`` element has the protocol
+text.
+
+``iter_elements`` walks the top level data elements of a DICOM file, from
+memory mapped bytes, without reading values, and stops before pixel data, so
+the time to find the CSA header does not depend on the size of the image.
+``csa_items`` decodes the items for one element of a CSA2 header (starting
+``SV10``).  ``read_csa_text`` does both, for a DICOM file.  See
+``xpparse.from_dicom`` to parse the text.
+"""
+from __future__ import print_function
+
+import io
+import os
+from mmap import mmap, ACCESS_READ
+from struct import unpack_from, error as StructError
+
+PIXEL_DATA = 0x7FE00010
+
+# Transfer syntax UID -> (explicit VR, endian)
+TRANSFER_SYNTAXES = {
+    '1.2.840.10008.1.2': (False, '<'),
+    '1.2.840.10008.1.2.1': (True, '<'),
+    '1.2.840.10008.1.2.2': (True, '>'),
+}
+# Other syntaxes, for compressed pixel data, have explicit VR little endian
+_DEFAULT_SYNTAX = (True, '<')
+_DEFLATED = '1.2.840.10008.1.2.1.99'
+
+# Explicit VRs with 2 reserved bytes and 4 byte length
+_LONG_VRS = frozenset([b'OB', b'OD', b'OF', b'OL', b'OV', b'OW', b'SQ',
+                       b'SV', b'UC', b'UN', b'UR', b'UT', b'UV'])
+
+_UNDEFINED = 0xFFFFFFFF
+_ITEM = 0xFFFEE000
+_ITEM_END = 0xFFFEE00D
+_SEQUENCE_END = 0xFFFEE0DD
+
+CSA_CREATOR = b'SIEMENS CSA HEADER'
+# CSA header element in private block
+CSA_HEADERS = {'image': 0x10, 'series': 0x20}
+
+# Limit on tags and items, to detect corrupt headers
+_MAX_CSA_ITEMS = 1000
+
+
+class DicomError(ValueError):
+    """ Error for files that are not DICOM, or have no CSA element """
+
+
+def _read_tag(buf, pos, endian):
+    group, element = unpack_from(endian + 'HH', buf, pos)
+    return group << 16 | element
+
+
+def _read_element(buf, pos, explicit, endian):
+    """ Return tag, VR, value offset, value length of element at `pos`
+
+    VR is None for implicit VR, and for item and delimitation elements.
+    """
+    tag = _read_tag(buf, pos, endian)
+    if tag >> 16 == 0xFFFE or not explicit:
+        length, = unpack_from(endian + 'I', buf, pos + 4)
+        return tag, None, pos + 8, length
+    vr = buf[pos + 4:pos + 6]
+    if vr in _LONG_VRS:
+        length, = unpack_from(endian + 'I', buf, pos + 8)
+        return tag, vr, pos + 12, length
+    length, = unpack_from(endian + 'H', buf, pos + 6)
+    return tag, vr, pos + 8, length
+
+
+def _skip_undefined(buf, pos, explicit, endian):
+    """ Position after sequence of undefined length starting at `pos`
+
+    The sequence can be a sequence of items, or encapsulated pixel data.
+    """
+    while True:
+        tag, vr, start, length = _read_element(buf, pos, explicit, endian)
+        if tag == _SEQUENCE_END:
+            return start
+        if tag != _ITEM:
+            raise DicomError('Expecting item at {0}'.format(pos))
+        if length != _UNDEFINED:
+            pos = start + length
+            continue
+        # Item of undefined length; walk its data elements to the end
+        pos = start
+        while True:
+            tag, vr, start, length = _read_element(buf, pos, explicit,
+                                                   endian)
+            if tag == _ITEM_END:
+                pos = start
+                break
+            pos = _value_end(buf, vr, start, length, explicit, endian)
+
+
+def _value_end(buf, vr, start, length, explicit, endian):
+    """ Position after value of element at `start` with `length` """
+    if length != _UNDEFINED:
+        return start + length
+    # Contents of UN with undefined length are implicit VR little endian
+    if vr == b'UN':
+        return _skip_undefined(buf, start, False, '<')
+    return _skip_undefined(buf, start, explicit, endian)
+
+
+def _meta_syntax(buf):
+    """ Transfer syntax UID and end of file meta information in `buf` """
+    if buf[128:132] != b'DICM':
+        raise DicomError('No DICM prefix; not a DICOM file')
+    pos = 132
+    syntax = None
+    while pos < len(buf):
+        tag, vr, start, length = _read_element(buf, pos, True, '<')
+        if tag >> 16 != 0x0002:
+            break
+        if tag == 0x00020010:
+            syntax = buf[start:start + length].rstrip(b'\0 ').decode('ascii')
+        pos = start + length
+    if syntax is None:
+        raise DicomError('No transfer syntax in file meta information')
+    return syntax, pos
+
+
+def iter_elements(buf, stop=PIXEL_DATA):
+    """ Iterate over top level data elements in DICOM file bytes `buf`
+
+    Parameters
+    ----------
+    buf : bytes or mmap
+        Contents of DICOM file, with preamble and file meta information.
+    stop : int, optional
+        Tag, as ``group << 16 | element``, at which to stop.  Stops before
+        returning the first element with tag greater than or equal to
+        `stop`.  The default stops before the pixel data.
+
+    Yields
+    ------
+    tag : int
+        Element tag, as ``group << 16 | element``.
+    vr : bytes or None
+        Value representation, or None for data sets with implicit VR.
+    start : int
+        Offset of value in `buf`.
+    length : int
+        Length of value in bytes, or 0xFFFFFFFF for sequences of undefined
+        length.
+    """
+    syntax, pos = _meta_syntax(buf)
+    if syntax == _DEFLATED:
+        raise DicomError('Cannot read deflated data set')
+    explicit, endian = TRANSFER_SYNTAXES.get(syntax, _DEFAULT_SYNTAX)
+    end = len(buf)
+    while pos < end:
+        tag, vr, start, length = _read_element(buf, pos, explicit, endian)
+        if tag >= stop:
+            return
+        yield tag, vr, start, length
+        pos = _value_end(buf, vr, start, length, explicit, endian)
+
+
+def find_private(buf, group, creator, element):
+    """ Return value of private element in DICOM bytes `buf`, or None
+
+    Parameters
+    ----------
+    buf : bytes or mmap
+        Contents of DICOM file.
+    group : int
+        Odd group number, such as 0x0029.
+    creator : bytes
+        Private creator, such as ``b'SIEMENS CSA HEADER'``.
+    element : int
+        Element number in the private block, from 0 to 0xFF, such as 0x20.
+
+    Returns
+    -------
+    value : None or bytes
+        Bytes of the value of element ``(group, xxelement)``, where ``xx``
+        is the private block reserved for `creator`, or None if there is no
+        such element.
+    """
+    block = None
+    for tag, vr, start, length in iter_elements(buf, (group + 1) << 16):
+        if tag >> 16 != group:
+            continue
+        number = tag & 0xFFFF
+        if 0x10 <= number <= 0xFF:
+            if buf[start:start + length].rstrip(b'\0 ') == creator:
+                block = number
+        elif block is not None and number == block << 8 | element:
+            return buf[start:start + length]
+    return None
+
+
+def csa_items(data, name):
+    """ Return items of element `name` in CSA2 header `data`, or None
+
+    Parameters
+    ----------
+    data : bytes
+        CSA2 header, starting ``SV10``.
+    name : str
+        Name of CSA element, such as 'MrPhoenixProtocol'.
+
+    Returns
+    -------
+    items : None or list
+        Bytes of each non-empty item of element `name`, up to the first nul
+        byte, or None if there is no such element.
+    """
+    if data[:4] != b'SV10':
+        raise DicomError('Not a CSA2 header; CSA1 headers not supported')
+    try:
+        return _csa2_items(data, name.encode('latin-1'))
+    except StructError:
+        raise DicomError('Unexpected end of CSA header')
+
+
+def _csa2_items(data, target):
+    n_tags, = unpack_from('<I', data, 8)
+    if not 0 < n_tags <= _MAX_CSA_ITEMS:
+        raise DicomError('Expected 1 to {0} CSA tags, got {1}'.format(
+            _MAX_CSA_ITEMS, n_tags))
+    pos = 16
+    for i in range(n_tags):
+        tag_name = data[pos:pos + 64].split(b'\0', 1)[0]
+        n_items, = unpack_from('<i', data, pos + 76)
+        if not 0 <= n_items <= _MAX_CSA_ITEMS:
+            raise DicomError('Expected 0 to {0} CSA items, got {1}'.format(
+                _MAX_CSA_ITEMS, n_items))
+        pos += 84
+        items = []
+        for j in range(n_items):
+            item_len, = unpack_from('<i', data, pos + 4)
+            pos += 16
+            if item_len < 0 or pos + item_len > len(data):
+                raise DicomError('CSA item length out of range')
+            if item_len and tag_name == target:
+                items.append(data[pos:pos + item_len].split(b'\0', 1)[0])
+            # Items padded to 4 bytes
+            pos += (item_len + 3) & ~3
+        if tag_name == target:
+            return items
+    return None
+
+
+def read_csa_text(path, name='MrPhoenixProtocol', header='series',
+                  encoding='latin-1'):
+    """ Return text of CSA element `name` in DICOM file `path`
+
+    Parameters
+    ----------
+    path : str
+        DICOM file name.
+    name : str, optional
+        Name of CSA element.
+    header : {'series', 'image'}, optional
+        CSA header containing `name`.
+    encoding : str, optional
+        Encoding of element text.
+
+    Returns
+    -------
+    text : str
+        Text of first item of element `name`.
+
+    Raises
+    ------
+    DicomError
+        If the file is not DICOM, or does not have the CSA header, or
+        element `name`.
+    """
+    with io.open(path, 'rb') as fobj:
+        if not os.fstat(fobj.fileno()).st_size:
+            raise DicomError('Empty file')
+        buf = mmap(fobj.fileno(), 0, access=ACCESS_READ)
+    try:
+        data = find_private(buf, 0x0029, CSA_CREATOR, CSA_HEADERS[header])
+    except StructError:
+        raise DicomError('Unexpected end of file {0}'.format(path))
+    finally:
+        buf.close()
+    if data is None:
+        raise DicomError('No CSA {0} header in {1}'.format(header, path))
+    items = csa_items(data, name)
+    if not items:
+        raise DicomError('No {0} in CSA {1} header of {2}'.format(
+            name, header, path))
+    return items[0].decode(encoding)
@@ -0,0 +1,553 @@
+""" Hand-written recursive descent parser for Siemens xprotocol format
+
+This is an alternative engine for the grammar in ``xpparse``.  It scans the
+input in a single pass, using compiled regular expressions for the tokens, and
+returns nested ``AttrDict`` and ``list`` structures that index like the
+pyparsing results: ``protocol.attrs``, ``protocol.param_blocks``,
+``block.tag_name``, ``block.value``, ``protocol.ascconv`` and so on.
+
+The main differences from the pyparsing results are:
+
+* parameter card layout entries are ``(name, value)`` tuples;
+* list values are ``AttrDict`` instances with ``args`` and ``kwargs`` keys;
+* blocks always have a ``tag_name``, even when it is the empty string;
+* protocols always have ``param_blocks``, ``card_layouts`` and
+  ``dependencies`` lists, even when empty.
+"""
+from __future__ import print_function
+
+import re
+
+import xpcache
+
+# Pyparsing default whitespace
+_WS = r'[ \t\r\n]*'
+
+QUOTED_MULTI = r'"(?:[^"]|(?:"")|(?:\\x[0-9a-fA-F]+)|(?:\\.))*"'
+QUOTED_ONELINE = r'"(?:[^"\n\r\\]|(?:"")|(?:\\x[0-9a-fA-F]+)|(?:\\.))*"'
+FLOAT = r'[+-]?(?=\d*[.eE])(?=\.?\d)\d*\.?\d*(?:[eE][+-]?\d+)?'
+INT = r'[-]?[0-9]+'
+ASCCONV = r'### ASCCONV BEGIN ###$(.*?)^### ASCCONV END ###'
+
+_ws_match = re.compile(_WS).match
+# Simple value in same order of precedence as the pyparsing MatchFirst
+_value_match = re.compile(_WS + '(?:("true")|("false")|(%s)|(%s)|(%s))' %
+                          (FLOAT, INT, QUOTED_MULTI)).match
+_bool_match = re.compile(_WS + '(?:("true")|("false"))').match
+_int_match = re.compile(_WS + '(%s)' % INT).match
+_quoted_match = re.compile(_WS + '(%s)' % QUOTED_MULTI).match
+_oneline_match = re.compile(_WS + '(%s)' % QUOTED_ONELINE).match
+_bare_tag_match = re.compile(_WS + '<' + _WS + '([A-Za-z0-9]+)' + _WS +
+                             '>').match
+_named_tag_match = re.compile(_WS + '<' + _WS + '([A-Za-z0-9]+)' + _WS +
+                              r'\.' + _WS + '(' + QUOTED_ONELINE + ')' +
+                              _WS + '>').match
+_ascconv_match = re.compile(_WS + '(' + ASCCONV + ')', re.M | re.S).match
+_embedded_match = re.compile(_WS + '<' + _WS + 'xprotocol' + _WS + '>',
+                             re.I).match
+_dbl_quote_re = re.compile(r'(?<!")""(?!")')
+
+
+class AttrDict(dict):
+    """ Dictionary with attribute access to keys
+
+    As for pyparsing ``ParseResults``, attribute access to a missing key
+    returns the empty string.
+    """
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self.get(name, '')
+
+
+def strip_twin_quote(in_str):
+    """ Replaces two double quotes together with one double quote
+
+    Does so safely so that triple double quotes not touched.
+    """
+    return _dbl_quote_re.sub('"', in_str)
+
+
+class EmbeddedProtocol(str):
+    """ String value containing an XProtocol, parsed on first use
+
+    Phoenix protocols embed whole XProtocols in ``ParamString`` values, with
+    double quotes escaped as ``""``.  The instance is the string value as
+    parsed, with the doubled quotes.  ``text`` is the unescaped protocol text.
+    ``parsed`` parses ``text`` on first access, with the same engine as the
+    containing protocol, and returns the memoized result thereafter.  If the
+    process memo is enabled (see ``xpparse.enable_memo``), identical
+    embedded protocols share one memo entry.
+
+    `parser` is a callable to parse ``text``, such as the ``read_protocols``
+    method of the ``xpparse.XProtocolParser`` that parsed the containing
+    protocol.  None parses with the module grammar for the pyparsing engine.
+    Pickles do not keep `parser`.
+    """
+
+    def __new__(cls, value, engine='fast', parser=None):
+        self = super(EmbeddedProtocol, cls).__new__(cls, value)
+        self.engine = engine
+        self.parser = parser
+        return self
+
+    @property
+    def text(self):
+        return strip_twin_quote(self)
+
+    @property
+    def parsed(self):
+        try:
+            return self._parsed
+        except AttributeError:
+            pass
+        if self.parser is not None:
+            parse = lambda: self.parser(self.text)
+        elif self.engine == 'fast':
+            parse = lambda: read_protocols(self.text)
+        else:
+            import xpparse
+            # Without the memo of ``xpparse.read_protocols``
+            parse = lambda: xpparse._read_protocols(self.text, True,
+                                                    self.engine, None)
+        # Key on the escaped string, to save unescaping on a memo hit
+        self._parsed = xpcache.memo.lookup(
+            self, 'embedded {0}'.format(self.engine), parse, copy=True)
+        return self._parsed
+
+    def __reduce__(self):
+        # Pickle without the parsed result
+        return self.__class__, (str(self), self.engine)
+
+
+def string_value(value, engine='fast', parser=None):
+    """ Return `value`, or ``EmbeddedProtocol`` if `value` is an XProtocol
+    """
+    if _embedded_match(value) is None:
+        return value
+    return EmbeddedProtocol(value, engine, parser)
+
+
+class ParseError(ValueError):
+    """ Error for input not matching the xprotocol grammar """
+
+    def __init__(self, pstr, loc, msg):
+        self.pstr = pstr
+        self.loc = loc
+        self.msg = msg
+        super(ParseError, self).__init__(pstr, loc, msg)
+
+    @property
+    def lineno(self):
+        return self.pstr.count('\n', 0, self.loc) + 1
+
+    @property
+    def col(self):
+        return self.loc - self.pstr.rfind('\n', 0, self.loc)
+
+    def __str__(self):
+        return '%s (at char %d), (line:%d, col:%d)' % (
+            self.msg, self.loc, self.lineno, self.col)
+
+
+def _expect(s, pos, char):
+    """ Skip whitespace, check for `char` at `pos`, return position after """
+    pos = _ws_match(s, pos).end()
+    if not s.startswith(char, pos):
+        raise ParseError(s, pos, 'Expected "%s"' % char)
+    return pos + 1
+
+
+def _value(m):
+    """ Convert match from ``_value_match`` to Python value """
+    index = m.lastindex
+    if index == 5:
+        return m.group(5)[1:-1]
+    if index == 4:
+        return int(m.group(4))
+    if index == 3:
+        return float(m.group(3))
+    return index == 1
+
+
+def parse_list(s, pos):
+    """ Parse list entries up to closing curly brace
+
+    Parameters
+    ----------
+    s : str
+        String to parse.
+    pos : int
+        Position after the opening curly brace.
+
+    Returns
+    -------
+    list_value : AttrDict
+        With keys ``args`` (list of values) and ``kwargs`` (``AttrDict`` of
+        values, where keys with more than one value have a list).
+    pos : int
+        Position after the closing curly brace.
+    """
+    args = []
+    while True:
+        m = _value_match(s, pos)
+        if m is None:
+            break
+        args.append(_value(m))
+        pos = m.end()
+    kwargs = AttrDict()
+    while True:
+        m = _bare_tag_match(s, pos)
+        if m is None:
+            break
+        values = []
+        p = m.end()
+        while True:
+            vm = _value_match(s, p)
+            if vm is None:
+                break
+            values.append(_value(vm))
+            p = vm.end()
+        if not values:
+            break
+        kwargs[m.group(1)] = values[0] if len(values) == 1 else values
+        pos = p
+    return AttrDict(args=args, kwargs=kwargs), _expect(s, pos, '}')
+
+
+def _attr(s, pos):
+    """ Parse tag and value at `pos`, return (name, value, pos) or None """
+    m = _bare_tag_match(s, pos)
+    if m is None:
+        return None
+    pos = m.end()
+    vm = _value_match(s, pos)
+    if vm is not None:
+        return m.group(1), _value(vm), vm.end()
+    pos = _ws_match(s, pos).end()
+    if not s.startswith('{', pos):
+        return None
+    try:
+        value, pos = parse_list(s, pos + 1)
+    except ParseError:
+        return None
+    return m.group(1), value, pos
+
+
+def parse_attrs(s, pos):
+    """ Parse zero or more attributes, return ``AttrDict``, position """
+    attrs = AttrDict()
+    while True:
+        res = _attr(s, pos)
+        if res is None:
+            return attrs, pos
+        name, value, pos = res
+        attrs[name] = value
+
+
+def _attr_list(s, pos):
+    """ Parse zero or more attributes, return list of (name, value), pos """
+    out = []
+    while True:
+        res = _attr(s, pos)
+        if res is None:
+            return out, pos
+        out.append(res[:2])
+        pos = res[2]
+
+
+def _named_tag(s, pos, tag_types):
+    """ Parse named tag if its type is in `tag_types`
+
+    Returns (tag_type, tag_name, pos) or None
+    """
+    m = _named_tag_match(s, pos)
+    if m is None:
+        return None
+    tag_type = m.group(1).lower()
+    if tag_type not in tag_types:
+        return None
+    return tag_type, m.group(2)[1:-1], m.end()
+
+
+def _classes(s, pos, block):
+    """ Parse zero or more ``<Class> "name"`` entries into `block` """
+    while True:
+        m = _bare_tag_match(s, pos)
+        if m is None or m.group(1).lower() != 'class':
+            return pos
+        vm = _oneline_match(s, m.end())
+        if vm is None:
+            return pos
+        block['class'] = vm.group(1)[1:-1]
+        pos = vm.end()
+
+
+def _blocks(s, pos):
+    """ Parse zero or more parameter blocks, return list, position """
+    blocks = []
+    while True:
+        res = parse_param_block(s, pos)
+        if res is None:
+            return blocks, pos
+        block, pos = res
+        blocks.append(block)
+
+
+def _bool_body(s, pos, block):
+    block['attrs'], pos = parse_attrs(s, pos)
+    m = _bool_match(s, pos)
+    if m is not None:
+        block['value'] = m.lastindex == 1
+        pos = m.end()
+    return pos
+
+
+def _long_body(s, pos, block):
+    block['attrs'], pos = parse_attrs(s, pos)
+    m = _int_match(s, pos)
+    if m is not None:
+        block['value'] = int(m.group(1))
+        pos = m.end()
+    return pos
+
+
+def _string_body(s, pos, block):
+    block['attrs'], pos = parse_attrs(s, pos)
+    m = _quoted_match(s, pos)
+    if m is not None:
+        block['value'] = m.group(1)[1:-1]
+        pos = m.end()
+    return pos
+
+
+def _param_string_body(s, pos, block):
+    pos = _string_body(s, pos, block)
+    if 'value' in block:
+        block['value'] = string_value(block['value'])
+    return pos
+
+
+def _array_body(s, pos, block):
+    block['attrs'], pos = parse_attrs(s, pos)
+    while True:
+        m = _bare_tag_match(s, pos)
+        if m is None or m.group(1).lower() != 'default':
+            break
+        res = parse_param_block(s, m.end())
+        if res is None:
+            break
+        block['default'], pos = res
+    p = _ws_match(s, pos).end()
+    if s.startswith('{', p):
+        value, pos = parse_list(s, p + 1)
+        block['value'] = value['args']
+    return pos
+
+
+def _map_body(s, pos, block):
+    block['attrs'], pos = parse_attrs(s, pos)
+    blocks, pos = _blocks(s, pos)
+    if blocks:
+        block['value'] = blocks
+    return pos
+
+
+_EMC_TYPES = ('event', 'method', 'connection')
+
+
+def _functor_body(s, pos, block):
+    pos = _classes(s, pos, block)
+    blocks, pos = _blocks(s, pos)
+    if blocks:
+        block['value'] = blocks
+    # Event, method, connection, each once, in any order
+    todo = set(_EMC_TYPES)
+    while todo:
+        res = _named_tag(s, pos, todo)
+        if res is None:
+            raise ParseError(s, _ws_match(s, pos).end(),
+                             'Expected one of %s' % ', '.join(sorted(todo)))
+        block[res[0]], pos = parse_args_block(s, res)
+        todo.remove(res[0])
+    return pos
+
+
+def _pipe_service_body(s, pos, block):
+    pos = _classes(s, pos, block)
+    blocks, pos = _blocks(s, pos)
+    if not blocks:
+        raise ParseError(s, _ws_match(s, pos).end(),
+                         'Expected parameter block')
+    block['value'] = blocks
+    return pos
+
+
+_BLOCK_BODIES = {
+    'parambool': _bool_body,
+    'paramlong': _long_body,
+    'paramstring': _param_string_body,
+    'paramchoice': _string_body,
+    'paramarray': _array_body,
+    'parammap': _map_body,
+    'paramfunctor': _functor_body,
+    'pipeservice': _pipe_service_body,
+}
+
+
+def parse_param_block(s, pos):
+    """ Parse parameter block at `pos`
+
+    Returns
+    -------
+    res : None or tuple
+        None if there is no parameter block at `pos`, otherwise tuple of
+        (block, pos), where `block` is an ``AttrDict`` with keys
+        ``tag_type``, ``tag_name``, ``attrs`` and, where present, ``value``,
+        and `pos` is the position after the block.
+    """
+    res = _named_tag(s, pos, _BLOCK_BODIES)
+    if res is None:
+        return None
+    tag_type, tag_name, pos = res
+    block = AttrDict(tag_type=tag_type, tag_name=tag_name)
+    pos = _BLOCK_BODIES[tag_type](s, _expect(s, pos, '{'), block)
+    return block, _expect(s, pos, '}')
+
+
+def parse_args_block(s, tag):
+    """ Parse block of list entries such as ``<Event."name"> { ... }``
+
+    `tag` is the (tag_type, tag_name, pos) result from reading the tag.
+    Returns (block, pos).
+    """
+    tag_type, tag_name, pos = tag
+    value, pos = parse_list(s, _expect(s, pos, '{'))
+    return AttrDict(tag_type=tag_type, tag_name=tag_name,
+                    args=value['args'], kwargs=value['kwargs']), pos
+
+
+def parse_card_layout(s, tag):
+    """ Parse ``<ParamCardLayout."name"> { ... }`` block, return block, pos
+    """
+    tag_type, tag_name, pos = tag
+    block = AttrDict(tag_type=tag_type, tag_name=tag_name)
+    entries, pos = _attr_list(s, _expect(s, pos, '{'))
+    if entries:
+        block['value'] = entries
+    return block, _expect(s, pos, '}')
+
+
+def parse_protocol(s, pos):
+    """ Parse XProtocol at `pos`
+
+    Returns
+    -------
+    res : None or tuple
+        None if there is no ``<XProtocol>`` tag at `pos`, otherwise tuple of
+        (protocol, pos) where `protocol` is an ``AttrDict`` with keys
+        ``attrs``, ``param_blocks``, ``card_layouts``, ``dependencies`` and,
+        if present, ``ascconv``, and `pos` is the position after the
+        protocol.
+    """
+    m = _bare_tag_match(s, pos)
+    if m is None or m.group(1).lower() != 'xprotocol':
+        return None
+    protocol = AttrDict()
+    protocol['attrs'], pos = parse_attrs(s, _expect(s, m.end(), '{'))
+    protocol['param_blocks'], pos = _blocks(s, pos)
+    protocol['card_layouts'] = layouts = []
+    while True:
+        tag = _named_tag(s, pos, ('paramcardlayout',))
+        if tag is None:
+            break
+        layout, pos = parse_card_layout(s, tag)
+        layouts.append(layout)
+    protocol['dependencies'] = dependencies = []
+    while True:
+        tag = _named_tag(s, pos, ('dependency',))
+        if tag is None:
+            break
+        dependency, pos = parse_args_block(s, tag)
+        dependencies.append(dependency)
+    pos = _expect(s, pos, '}')
+    m = _ascconv_match(s, pos)
+    if m is not None:
+        protocol['ascconv'] = m.group(1)
+        pos = m.end()
+    return protocol, pos
+
+
+_ARGS_TYPES = ('dependency',) + _EMC_TYPES
+_BLOCK_TYPES = tuple(_BLOCK_BODIES) + ('paramcardlayout',) + _ARGS_TYPES
+
+
+def parse_block(s, pos):
+    """ Parse any named block, or XProtocol, at `pos`
+
+    Parameters
+    ----------
+    s : str
+        String to parse.
+    pos : int
+        Position of block tag, such as the block starts from
+        ``xpindex.index_blocks``.
+
+    Returns
+    -------
+    block : AttrDict
+        Parsed block, as for ``parse_param_block``, ``parse_card_layout``,
+        ``parse_args_block`` or ``parse_protocol``, depending on tag type.
+    pos : int
+        Position after the block.
+    """
+    res = parse_param_block(s, pos)
+    if res is None:
+        res = parse_protocol(s, pos)
+    if res is not None:
+        return res
+    tag = _named_tag(s, pos, _BLOCK_TYPES)
+    if tag is None:
+        raise ParseError(s, _ws_match(s, pos).end(), 'Expected block')
+    if tag[0] == 'paramcardlayout':
+        return parse_card_layout(s, tag)
+    return parse_args_block(s, tag)
+
+
+def read_protocols(in_str, parse_all=True):
+    """ Parse one or more XProtocols from string `in_str`
+
+    Parameters
+    ----------
+    in_str : str
+        String containing protocols.
+    parse_all : {True, False}, optional
+        If True, raise an error for anything but whitespace after the last
+        protocol.
+
+    Returns
+    -------
+    protocols : list
+        List of ``AttrDict`` protocols, see ``parse_protocol``.
+    """
+    # Pyparsing expands tabs before parsing; do the same to get same values
+    if '\t' in in_str:
+        in_str = in_str.expandtabs()
+    protocols = []
+    pos = 0
+    while True:
+        res = parse_protocol(in_str, pos)
+        if res is None:
+            break
+        protocol, pos = res
+        protocols.append(protocol)
+    if not protocols:
+        raise ParseError(in_str, _ws_match(in_str, 0).end(),
+                         'Expected "<XProtocol>"')
+    if parse_all:
+        pos = _ws_match(in_str, pos).end()
+        if pos != len(in_str):
+            raise ParseError(in_str, pos, 'Expected end of text')
+    return protocols
@@ -0,0 +1,467 @@
+""" Pyparsing grammar for Siemens xprotocol XML-like format
+
+``xpparse`` imports this module on first use of the pyparsing engine, or of
+a grammar element, such as ``xpparse.param_block``, so that programs using
+only the ``xpfast`` engine do not import pyparsing or build the grammar.
+"""
+from __future__ import print_function
+
+import re
+import copy
+import threading
+
+from pyparsing import (Regex, Suppress, OneOrMore, ZeroOrMore, Group, Optional,
+                       Forward, CaselessLiteral, Dict, removeQuotes,
+                       Word, alphanums, dblQuotedString,
+                       dictOf, Token, ParseException, ParserElement,
+                       ParseExpression, ParseResults, ParseBaseException,
+                       Empty, StringEnd, _PackratCache)
+
+import xpfast
+from xpfast import QUOTED_MULTI, FLOAT, INT
+
+
+# Character literals
+LCURLY = Suppress('{')
+RCURLY = Suppress('}')
+DOT = Suppress('.')
+LANGLE = Suppress('<')
+RANGLE = Suppress('>')
+
+def _spa(element, action):
+    """ Shortcut to set parse action """
+    return element.setParseAction(action)
+
+
+quoted_oneline = dblQuotedString
+quoted_multi = _spa(Regex(QUOTED_MULTI), removeQuotes)
+ascconv_block = Regex(r'### ASCCONV BEGIN ###$(.*?)^### ASCCONV END ###',
+                      flags=re.M | re.S)
+
+
+def make_literal_tag(tag_name):
+    return LANGLE + CaselessLiteral(tag_name) + RANGLE
+
+
+class SimpleValue(Token):
+    """ Match and convert a simple value with one regular expression
+
+    The regular expression is an alternation of named groups, one for each
+    kind of value, in order of precedence: ``"true"``, ``"false"``, float,
+    int, then quoted string.  A single ``match()`` call finds the value, and
+    the name of the matching group gives the converter.
+    """
+    kinds = (('true', '"true"', lambda v: True),
+             ('false', '"false"', lambda v: False),
+             ('float', FLOAT, float),
+             ('int', INT, int),
+             ('string', QUOTED_MULTI, lambda v: v[1:-1]))
+
+    def __init__(self, kinds=None):
+        """ Initialize token to match value kinds in `kinds`
+
+        Parameters
+        ----------
+        kinds : None or sequence, optional
+            Names of kinds of value to match, from 'true', 'false', 'float',
+            'int', 'string'.  None means all kinds.
+        """
+        super(SimpleValue, self).__init__()
+        known = [kind[0] for kind in self.kinds]
+        if kinds is None:
+            kinds = known
+        unknown = set(kinds).difference(known)
+        if unknown:
+            raise ValueError('Unknown value kinds: ' + ', '.join(unknown))
+        self.re = re.compile('|'.join('(?P<{0}>{1})'.format(name, pattern)
+                                      for name, pattern, conv in self.kinds
+                                      if name in kinds))
+        self.converters = dict((name, conv)
+                               for name, pattern, conv in self.kinds)
+        self.name = 'simple value ({0})'.format(', '.join(
+            name for name in known if name in kinds))
+        self.errmsg = 'Expected ' + self.name
+        self.mayIndexError = False
+        self.mayReturnEmpty = False
+
+    def parseImpl(self, instring, loc, doActions=True):
+        match = self.re.match(instring, loc)
+        if match is None:
+            raise ParseException(instring, loc, self.errmsg, self)
+        return match.end(), [self.converters[match.lastgroup](match.group())]
+
+
+class KeywordDispatch(ParseExpression):
+    """ Match the element selected by a keyword at the current position
+
+    Equivalent to a MatchFirst of elements that each start with a different
+    keyword, but finds the keyword once, with a regular expression, then
+    looks up the element to match in a dict, instead of trying each element
+    in turn.  The element matches from the start of the keyword match, so
+    it should match the keyword itself.  Errors for unknown keywords are at
+    the start of the keyword.
+    """
+
+    def __init__(self, pattern, table, caseless=True):
+        """ Initialize element with keyword `pattern` and element `table`
+
+        Parameters
+        ----------
+        pattern : str
+            Regular expression to match at the current position, where the
+            first group is the keyword.  The element skips leading whitespace
+            before matching `pattern`.
+        table : dict
+            Mapping of keyword to element.
+        caseless : {True, False}, optional
+            If True, the keywords in `table` are lower case, and the
+            lower case of the matched keyword selects the element.
+        """
+        elements = list(table.values())
+        super(KeywordDispatch, self).__init__(elements)
+        self.re = re.compile(pattern)
+        self.caseless = caseless
+        # Keyword -> index of element in ``exprs``, to allow for copies of
+        # ``exprs`` elements, e.g. from ``leaveWhitespace``
+        self.indices = dict((key, elements.index(element))
+                            for key, element in table.items())
+        self.mayReturnEmpty = any(e.mayReturnEmpty for e in elements)
+        self.errmsg = 'Expected one of: ' + ', '.join(sorted(table))
+
+    def parseImpl(self, instring, loc, doActions=True):
+        start = self.preParse(instring, loc)
+        match = self.re.match(instring, start)
+        if match is None:
+            raise ParseException(instring, start, self.errmsg, self)
+        key = match.group(1)
+        index = self.indices.get(key.lower() if self.caseless else key)
+        if index is None:
+            # Error at the unknown keyword
+            raise ParseException(instring, match.start(1), self.errmsg, self)
+        return self.exprs[index]._parse(instring, loc, doActions)
+
+    def streamline(self):
+        # Do not merge nested expressions, as for MatchFirst
+        ParserElement.streamline(self)
+        for e in self.exprs:
+            e.streamline()
+        return self
+
+    def __str__(self):
+        if hasattr(self, 'name'):
+            return self.name
+        if self.strRepr is None:
+            self.strRepr = '{' + ' | '.join(str(e) for e in self.exprs) + '}'
+        return self.strRepr
+
+
+class KeywordEach(KeywordDispatch):
+    """ Match all elements in a keyword table, in any order
+
+    Like ``Each`` of required elements that each start with a different
+    keyword.  At each position, finds the keyword, as for
+    ``KeywordDispatch``, and parses the element for that keyword once, with
+    parse actions, adding its tokens and names to the results.  ``Each``
+    instead tries all remaining elements at each position, then parses the
+    matching elements again.  Each element can match once.
+    """
+
+    def parseImpl(self, instring, loc, doActions=True):
+        remaining = dict(self.indices)
+        tokens = ParseResults([])
+        while remaining:
+            match = self.re.match(instring, self.preParse(instring, loc))
+            if match is None:
+                break
+            key = match.group(1)
+            index = remaining.pop(key.lower() if self.caseless else key, None)
+            if index is None:
+                break
+            loc, element_tokens = self.exprs[index]._parse(instring, loc,
+                                                           doActions)
+            tokens += element_tokens
+        if remaining:
+            raise ParseException(
+                instring, loc, 'Missing one or more required elements: ' +
+                ', '.join(sorted(remaining)), self)
+        return loc, tokens
+
+    def __str__(self):
+        if hasattr(self, 'name'):
+            return self.name
+        if self.strRepr is None:
+            self.strRepr = '{' + ' & '.join(str(e) for e in self.exprs) + '}'
+        return self.strRepr
+
+
+# Tag type of named tag such as ``<ParamLong."Count">``, for dispatch
+TAG_TYPE_RE = r'<[ \t\r\n]*([A-Za-z]+)'
+
+xprotocol_tag = make_literal_tag('xprotocol')
+bare_tag = LANGLE + Word(alphanums) + RANGLE
+int_num = SimpleValue(['int'])
+float_num = SimpleValue(['float'])
+string_value = SimpleValue(['string'])
+true = SimpleValue(['true'])
+false = SimpleValue(['false'])
+bool_ = SimpleValue(['true', 'false'])
+simple_value = SimpleValue()
+key_values = Group(bare_tag + OneOrMore(simple_value))
+keys_values = Dict(ZeroOrMore(key_values))
+list_entries = Group(ZeroOrMore(simple_value))('args') + keys_values('kwargs')
+# Return list value as list
+list_value = LCURLY + list_entries + RCURLY
+bool_attr = bare_tag + bool_
+float_attr = bare_tag + float_num
+int_attr = bare_tag + int_num
+string_attr = bare_tag + string_value
+list_attr = bare_tag + list_value
+# Same as Group(bool_attr | float_attr | int_attr | string_attr | list_attr),
+# but matching the tag once.  The value kinds are in the same order of
+# precedence in ``simple_value``, which fails on the first character of a
+# list value.
+attr = Group(bare_tag + (simple_value | list_value))
+attrs = Dict(ZeroOrMore(attr))('attrs')
+
+
+def make_named_tag(tag_type):
+    return (LANGLE +
+            CaselessLiteral(tag_type)('tag_type') +
+            DOT +
+            _spa(quoted_oneline, removeQuotes)('tag_name') +
+            RANGLE)
+
+
+def make_named_block(tag_type, contents=None, pre=None, post=None):
+    definition = make_named_tag(tag_type) + LCURLY
+    if pre is not None:
+        definition = definition + pre
+    definition = definition + contents('value')
+    if post is not None:
+        definition = definition + post
+    return definition + RCURLY
+
+
+def make_param_block(tag_type, contents):
+    return make_named_block(tag_type, pre=attrs, contents=contents)
+
+
+param_bool = make_param_block('parambool', Optional(bool_))
+param_long = make_param_block('paramlong', Optional(int_num))
+# String values containing XProtocols become lazy EmbeddedProtocol strings
+string_or_protocol = _spa(Regex(QUOTED_MULTI),
+                          lambda s, l, t: [xpfast.string_value(t[0][1:-1],
+                                                               'pyparsing')])
+param_string = make_param_block('paramstring', Optional(string_or_protocol))
+# Recursive definition of blocks, can include param_map
+param_block = Forward()
+array_default = dictOf(make_literal_tag('default'), param_block)
+param_array = make_named_block('paramarray',
+                               pre=attrs + array_default,
+                               contents=_spa(Optional(list_value),
+                                             lambda s, l, t: [t[0]]))
+# Not sure what value type should be for paramchoice
+param_choice = make_param_block('paramchoice', Optional(quoted_multi))
+param_map = make_param_block('parammap', ZeroOrMore(Group(param_block)))
+
+# Fancy functor and service stuff
+def make_args_block(tag_type):
+    return (make_named_tag(tag_type) +
+            LCURLY +
+            list_entries +
+            RCURLY)
+
+
+event = make_args_block("event")
+method = make_args_block("method")
+connection = make_args_block("connection")
+class_ = dictOf(make_literal_tag('class'), quoted_oneline)
+# Event, method and connection, in any order
+emc = KeywordEach(TAG_TYPE_RE, {
+    'event': Group(event)('event'),
+    'method': Group(method)('method'),
+    'connection': Group(connection)('connection')})
+param_functor = make_named_block('paramfunctor',
+                                 pre=class_,
+                                 contents=ZeroOrMore(Group(param_block)),
+                                 post=emc)
+pipe_service = make_named_block('pipeservice',
+                                pre=class_,
+                                contents=OneOrMore(Group(param_block)))
+
+# Now we can define block with param_map, functor, pipe_service definition.
+# Dispatch on the tag type, instead of trying each block type in turn.
+param_block <<= KeywordDispatch(TAG_TYPE_RE, {
+    'parambool': param_bool,
+    'paramlong': param_long,
+    'paramstring': param_string,
+    'paramchoice': param_choice,
+    'paramarray': param_array,
+    'parammap': param_map,
+    'paramfunctor': param_functor,
+    'pipeservice': pipe_service})
+
+param_card_layout = make_named_block('paramcardlayout', ZeroOrMore(attr))
+dependency = make_args_block('dependency')
+
+xprotocol = (xprotocol_tag +
+             LCURLY +
+             attrs +
+             ZeroOrMore(Group(param_block))('param_blocks') +
+             ZeroOrMore(Group(param_card_layout))('card_layouts') +
+             ZeroOrMore(Group(dependency))('dependencies') +
+             RCURLY +
+             Optional(ascconv_block)('ascconv'))
+xprotocols = OneOrMore(Group(xprotocol))
+
+
+# Grammar element for each indexed block type
+block_elements = {
+    'parambool': param_bool,
+    'paramlong': param_long,
+    'paramstring': param_string,
+    'paramchoice': param_choice,
+    'paramarray': param_array,
+    'parammap': param_map,
+    'paramfunctor': param_functor,
+    'pipeservice': pipe_service,
+    'paramcardlayout': param_card_layout,
+    'dependency': dependency,
+    'event': event,
+    'method': method,
+    'connection': connection,
+    'xprotocol': xprotocol,
+}
+
+
+def grammar_elements(element):
+    """ List of `element` and all elements reachable from it """
+    elements = []
+    seen = set()
+    todo = [element]
+    while todo:
+        element = todo.pop()
+        if id(element) in seen:
+            continue
+        seen.add(id(element))
+        elements.append(element)
+        todo.extend(getattr(element, 'exprs', None) or [])
+        if getattr(element, 'expr', None) is not None:
+            todo.append(element.expr)
+    return elements
+
+
+def _cached_parse(element, local):
+    """ Packrat parse method for `element`, with cache ``local.cache``
+
+    As for ``ParserElement._parseCache``, but with the cache from `local`,
+    instead of the class-level cache.
+    """
+    parse = element._parseNoCache
+
+    def _parse(instring, loc, doActions=True, callPreParse=True):
+        lookup = (element, instring, loc, callPreParse, doActions)
+        cache = local.cache
+        value = cache.get(lookup)
+        if value is not None:
+            if isinstance(value, Exception):
+                raise value
+            return value[0], value[1].copy()
+        try:
+            value = parse(instring, loc, doActions, callPreParse)
+        except ParseBaseException as pe:
+            pe.__traceback__ = None
+            cache.set(lookup, pe)
+            raise
+        cache.set(lookup, (value[0], value[1].copy()))
+        return value
+
+    return _parse
+
+
+class PrivateGrammar(object):
+    """ Copy of a grammar, independent of pyparsing global parse state
+
+    ``parseString`` uses state shared by all elements: the
+    ``ParserElement._parse`` method, switched by ``enablePackrat``, the
+    class-level packrat cache, which each call clears, and the
+    ``streamlined`` flag and ``exprs`` of each element, set on first parse.
+    Parses in different threads therefore interfere.  This class copies
+    `element` and all its sub-elements, streamlines the copies, and sets the
+    ``_parse`` method of each copy to parse without packrat memoization, or
+    with a packrat cache private to the grammar and the calling thread.  No
+    state of the copies changes during a parse, so several threads can parse
+    with the same ``PrivateGrammar``.
+
+    The parse actions of the copies are those of the originals.  The
+    xprotocol grammar parse actions have no state, and take the full ``(s,
+    l, t)`` arguments, so the pyparsing argument count detection in the
+    parse action wrapper does not change state either.
+
+    Parameters
+    ----------
+    element : ``ParserElement``
+        Grammar to copy.
+    packrat : bool or int, optional
+        If False, parse without packrat memoization.  True memoizes, with no
+        limit on cache size; an integer memoizes with cache size limited to
+        that many entries.
+    """
+
+    def __init__(self, element, packrat=False):
+        self.packrat = packrat
+        self._local = threading.local()
+        originals = grammar_elements(element)
+        copies = dict((id(e), copy.copy(e)) for e in originals)
+        for clone in copies.values():
+            clone.parseAction = list(clone.parseAction)
+            if getattr(clone, 'exprs', None) is not None:
+                clone.exprs = [copies[id(e)] for e in clone.exprs]
+            if getattr(clone, 'expr', None) is not None:
+                clone.expr = copies[id(clone.expr)]
+        self._copies = copies
+        self.element = copies[id(element)]
+        self._end = Empty() + StringEnd()
+        for root in (self.element, self._end):
+            root.streamline()
+            for e in grammar_elements(root):
+                e.streamline()
+                e._parse = (_cached_parse(e, self._local) if packrat
+                            else e._parseNoCache)
+
+    def copy_of(self, element):
+        """ Return the copy of grammar element `element` """
+        return self._copies[id(element)]
+
+    def _cache(self):
+        """ Packrat cache for calling thread """
+        local = self._local
+        try:
+            return local.cache
+        except AttributeError:
+            size = None if self.packrat is True else self.packrat
+            local.cache = _PackratCache(size or None)
+            return local.cache
+
+    def parse_string(self, instring, parse_all=False):
+        """ Parse `instring`, as for ``ParserElement.parseString`` """
+        cache = self._cache()
+        cache.reset()
+        element = self.element
+        if not element.keepTabs:
+            instring = instring.expandtabs()
+        try:
+            loc, tokens = element._parse(instring, 0)
+            if parse_all:
+                self._end._parse(instring, element.preParse(instring, loc))
+        finally:
+            # Release input string and results held by cache
+            cache.clear()
+        return tokens
+
+    def cache_stats(self):
+        """ Packrat cache statistics for last parse in calling thread
+
+        See ``ParserElement.cacheStats``.
+        """
+        return self._cache().stats()
@@ -0,0 +1,595 @@
+""" Structural index of blocks in xprotocol text, and path queries
+
+Finds the offsets of every ``<Type."name"> { ... }`` block, and every
+``<XProtocol> { ... }`` block, in one pass over the text, matching braces and
+skipping over quoted strings, without parsing the block contents.  Use the
+offsets to parse only the blocks you need, or use a ``Selector`` to find and
+parse blocks by path, such as ``'ParamMap[""]/ParamLong["Count"]'``.  See
+``xpparse.get`` to get the value at a path.
+"""
+from __future__ import print_function
+
+import re
+import sys
+from array import array
+
+import xpfast
+from xpfast import QUOTED_ONELINE, ParseError
+
+try:
+    intern = sys.intern
+except AttributeError:  # Python 2
+    pass
+
+# Tokens that affect block structure, after skipping other characters.
+# Quoted strings are consumed whole, so braces inside strings (including
+# embedded protocols) do not count.  The string pattern is an unrolled
+# equivalent of ``xpfast.QUOTED_MULTI``.  The ``other`` and ``end``
+# alternatives make sure the token always matches after the skip, to avoid
+# backtracking.  The ASCCONV body matches in a lookahead, and so cannot
+# backtrack, so an unterminated section, as at the end of a streamed buffer,
+# fails in one pass.
+_token_re = re.compile(
+    r'[^"<{}#]*(?:'
+    r'(?P<string>"[^"]*(?:""[^"]*)*")|'
+    r'(?P<ascconv>### ASCCONV BEGIN ###'
+    r'(?=(?P<ascconv_body>[^#]*(?:#(?!## ASCCONV END ###)[^#]*)*))'
+    r'(?P=ascconv_body)### ASCCONV END ###)|'
+    r'(?P<tag><[ \t\r\n]*(?P<tag_type>[A-Za-z0-9]+)[ \t\r\n]*'
+    r'(?:\.[ \t\r\n]*(?P<tag_name>' + QUOTED_ONELINE + r')[ \t\r\n]*)?>)|'
+    r'(?P<open>\{)|'
+    r'(?P<close>\})|'
+    r'(?P<other>["<#])|'
+    r'(?P<end>\Z))')
+# The same for bytes-like buffers, such as memory maps
+_bytes_token_re = re.compile(_token_re.pattern.encode('ascii'))
+
+
+class BlockIndex(object):
+    """ Offsets and nesting of blocks in xprotocol text
+
+    Blocks are in order of their start offsets.  For block ``i``:
+
+    * ``tag_types[i]`` is the lower case tag type, e.g. ``'paramlong'``, or
+      ``'xprotocol'`` for the protocol itself;
+    * ``tag_names[i]`` is the tag name, or ``''`` for ``<XProtocol>``;
+    * ``starts[i]`` is the offset of the opening ``<`` of the tag;
+    * ``ends[i]`` is the offset just after the closing ``}``, or, for
+      XProtocol blocks followed by an ASCCONV section, just after the end of
+      the section;
+    * ``depths[i]`` is the number of indexed blocks enclosing the block;
+    * ``parents[i]`` is the index of the enclosing block, or -1.
+    """
+
+    def __init__(self):
+        self.tag_types = []
+        self.tag_names = []
+        self.starts = array('l')
+        self.ends = array('l')
+        self.depths = array('l')
+        self.parents = array('l')
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        return (self.tag_types[i], self.tag_names[i], self.starts[i],
+                self.ends[i], self.depths[i], self.parents[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def span(self, i):
+        """ Return (start, end) offsets of block `i` """
+        return self.starts[i], self.ends[i]
+
+    def children(self, i):
+        """ Return indices of blocks with parent `i` """
+        return [j for j, parent in enumerate(self.parents) if parent == i]
+
+    def find(self, tag_type=None, tag_name=None, parent=None):
+        """ Return indices of blocks matching all of the given criteria
+
+        Parameters
+        ----------
+        tag_type : None or str, optional
+            Tag type to match, case insensitive.  None matches any type.
+        tag_name : None or str, optional
+            Tag name to match.  None matches any name.
+        parent : None or int, optional
+            Index of parent block to match, -1 for top level blocks.  None
+            matches any parent.
+
+        Returns
+        -------
+        indices : list
+            Indices of matching blocks.
+        """
+        if tag_type is not None:
+            tag_type = tag_type.lower()
+        out = []
+        for i in range(len(self)):
+            if tag_type is not None and self.tag_types[i] != tag_type:
+                continue
+            if tag_name is not None and self.tag_names[i] != tag_name:
+                continue
+            if parent is not None and self.parents[i] != parent:
+                continue
+            out.append(i)
+        return out
+
+
+def index_blocks(text):
+    """ Index offsets of named blocks in xprotocol string `text`
+
+    Parameters
+    ----------
+    text : str
+        String containing protocols.
+
+    Returns
+    -------
+    index : BlockIndex
+        Index of blocks, in order of their start offsets.
+
+    Raises
+    ------
+    xpfast.ParseError
+        If the braces in `text` do not match.
+    """
+    index = BlockIndex()
+    tag_types = index.tag_types
+    tag_names = index.tag_names
+    starts = index.starts
+    ends = index.ends
+    depths = index.depths
+    parents = index.parents
+    # Stack has index of block for named blocks, -1 for other braces
+    stack = []
+    # Index of innermost enclosing named block
+    parent = -1
+    depth = 0
+    tag = None
+    # Index of XProtocol block just closed, if any
+    protocol = -1
+    for m in _token_re.finditer(text):
+        kind = m.lastgroup
+        if kind == 'ascconv' and protocol >= 0:
+            ends[protocol] = m.end()
+        protocol = -1
+        if kind == 'open':
+            if tag is None:
+                stack.append(-1)
+                continue
+            tag_type, tag_name, start = tag
+            tag = None
+            parent_of = parent
+            parent = len(starts)
+            stack.append(parent)
+            tag_types.append(tag_type)
+            tag_names.append(tag_name)
+            starts.append(start)
+            ends.append(-1)
+            depths.append(depth)
+            parents.append(parent_of)
+            depth += 1
+        elif kind == 'close':
+            if not stack:
+                raise ParseError(text, m.start('close'), 'Unmatched "}"')
+            i = stack.pop()
+            if i >= 0:
+                ends[i] = m.end()
+                parent = parents[i]
+                depth -= 1
+                if tag_types[i] == 'xprotocol':
+                    protocol = i
+        elif kind == 'tag':
+            tag_type = m.group('tag_type').lower()
+            tag_name = m.group('tag_name')
+            if tag_name is not None:
+                tag = (intern(tag_type), tag_name[1:-1], m.start('tag'))
+            elif tag_type == 'xprotocol':
+                tag = ('xprotocol', '', m.start('tag'))
+            else:
+                tag = None
+        else:
+            tag = None
+    if stack:
+        unclosed = [i for i in stack if i >= 0]
+        loc = starts[unclosed[-1]] if unclosed else len(text)
+        raise ParseError(text, loc, 'Unmatched "{"')
+    return index
+
+
+def protocol_spans(buf):
+    """ Return offsets of top level XProtocol blocks in `buf`
+
+    Parameters
+    ----------
+    buf : str or bytes-like
+        Buffer containing protocols, such as an ``mmap.mmap`` of a file.
+        Scanning a bytes-like buffer does not copy it.
+
+    Returns
+    -------
+    spans : list
+        List of (start, end) offsets of each top level ``<XProtocol> { ...
+        }`` block, with any following ASCCONV section.  Scanning stops at an
+        unmatched ``}``; other content between the blocks, including blocks
+        not closed by the end of the buffer, is not checked or returned.
+    """
+    if isinstance(buf, str):
+        token_re, xprotocol = _token_re, 'xprotocol'
+    else:
+        token_re, xprotocol = _bytes_token_re, b'xprotocol'
+    spans = []
+    depth = 0
+    # Start of XProtocol tag at top level, and start of open protocol block
+    tag_start = start = None
+    closed = False
+    for m in token_re.finditer(buf):
+        kind = m.lastgroup
+        if kind == 'ascconv' and closed:
+            spans[-1] = (spans[-1][0], m.end())
+        closed = False
+        if kind == 'open':
+            if depth == 0:
+                start = tag_start
+            depth += 1
+        elif kind == 'close':
+            if depth == 0:
+                break
+            depth -= 1
+            if depth == 0 and start is not None:
+                spans.append((start, m.end()))
+                start = None
+                closed = True
+        tag_start = None
+        if (kind == 'tag' and depth == 0 and m.group('tag_name') is None and
+                m.group('tag_type').lower() == xprotocol):
+            tag_start = m.start('tag')
+    return spans
+
+
+def stream_protocols(chunks):
+    """ Generate protocol texts from iterable of text `chunks`
+
+    Reads `chunks` into a buffer, and finds the complete protocols in the
+    buffer as for ``protocol_spans``, resuming the scan after each read.
+    Keeps only the text of the current protocol in memory.
+
+    Parameters
+    ----------
+    chunks : iterable
+        Iterable of str, that concatenate to text containing protocols.
+
+    Yields
+    ------
+    text : str
+        Protocol text, with any following ASCCONV section, starting at the
+        beginning of the line, for the same tab expansion as in the whole
+        text.  Protocols come as soon as the end of the protocol (and any
+        following ASCCONV section) has been read.
+
+    Raises
+    ------
+    xpfast.ParseError
+        If there is anything but whitespace between the protocols, or the
+        braces do not match, or there are no protocols.  Error locations are
+        relative to the start of the text that was in memory at the time.
+    """
+    chunks = iter(chunks)
+    text = ''
+    eof = False
+    n_protocols = 0
+    state = (0, 0, None, None, None)
+    while not eof:
+        # Read at least as much as the unfinished token, so rescanning long
+        # tokens, such as embedded protocols, stays linear
+        pending = len(text) - state[0]
+        new = []
+        n_new = 0
+        for chunk in chunks:
+            new.append(chunk)
+            n_new += len(chunk)
+            if n_new > pending:
+                break
+        else:
+            eof = True
+        text += ''.join(new)
+        spans, done, state = _stream_spans(text, eof, state)
+        for start, end in spans:
+            yield text[start:end]
+        n_protocols += len(spans)
+        text = text[done:]
+    if not n_protocols:
+        raise ParseError(text, xpfast._ws_match(text, 0).end(),
+                         'Expected "<XProtocol>"')
+
+
+def _stream_spans(text, eof, state):
+    """ Return spans of complete protocols in `text`, end, and scan state
+
+    As for ``protocol_spans``, but checking the text between protocols, and
+    with protocols starting at the beginning of the line.  Unless `eof` is
+    True, stops at the first token that may continue after the end of `text`,
+    and returns the state to resume scanning from that token, relative to the
+    end of the last complete protocol.  A closed protocol is only complete at
+    the next token, which may be its ASCCONV section.
+    """
+    # Offset to resume from, brace depth, start of XProtocol tag at top
+    # level, start of open protocol, and span of closed protocol
+    pos, depth, tag_start, start, closed = state
+    n = len(text)
+    spans = []
+    # End of last complete protocol
+    done = 0
+    for m in _token_re.finditer(text, pos):
+        kind = m.lastgroup
+        # Unterminated strings, tags and ASCCONV sections match as ``other``;
+        # a token ending at the end of the text may continue, as for a
+        # string ending with the first of a pair of double quotes.
+        if (m.end() == n or kind == 'other') and not eof:
+            if tag_start is not None:
+                tag_start -= done
+            if start is not None:
+                start -= done
+            if closed is not None:
+                closed = (closed[0] - done, closed[1] - done)
+            return spans, done, (m.start() - done, depth, tag_start, start,
+                                 closed)
+        if closed is not None:
+            if kind == 'ascconv':
+                closed = (closed[0], m.end())
+            spans.append(closed)
+            done = closed[1]
+            closed = None
+            if kind == 'ascconv':
+                continue
+        if kind == 'open':
+            if depth == 0:
+                if tag_start is None or \
+                        xpfast._ws_match(text, done).end() < tag_start:
+                    raise ParseError(text, xpfast._ws_match(text, done).end(),
+                                     'Expected "<XProtocol>"')
+                # Start at beginning of line, not before end of last protocol
+                start = max(done, text.rfind('\n', 0, tag_start) + 1)
+            depth += 1
+        elif kind == 'close':
+            if depth == 0:
+                raise ParseError(text, m.start('close'), 'Unmatched "}"')
+            depth -= 1
+            if depth == 0:
+                closed = (start, m.end())
+        elif kind == 'end':
+            break
+        elif depth == 0 and kind != 'tag':
+            raise ParseError(text, m.start(kind), 'Expected "<XProtocol>"')
+        tag_start = None
+        if (kind == 'tag' and depth == 0 and m.group('tag_name') is None and
+                m.group('tag_type').lower() == 'xprotocol'):
+            tag_start = m.start('tag')
+    if depth:
+        raise ParseError(text, start, 'Unmatched "{"')
+    if xpfast._ws_match(text, done).end() < n:
+        raise ParseError(text, xpfast._ws_match(text, done).end(),
+                         'Expected "<XProtocol>"')
+    return spans, n, None
+
+
+def stream_blocks(chunks):
+    """ Generate protocols and their blocks from iterable of text `chunks`
+
+    Indexes each protocol from ``stream_protocols`` with ``index_blocks``.
+
+    Parameters
+    ----------
+    chunks : iterable
+        Iterable of str, that concatenate to text containing protocols.
+
+    Yields
+    ------
+    tag_type : str
+        Lower case tag type.  ``'xprotocol'`` for a protocol, otherwise the
+        type of a named block directly inside a protocol, such as
+        ``'paramlong'``.
+    text : str
+        For a protocol, the protocol text, as for ``stream_protocols``.  For
+        other blocks, the block text, with tabs expanded as for the whole text
+        (see ``read_protocols``).  The blocks of a protocol come before the
+        protocol itself.
+
+    Raises
+    ------
+    xpfast.ParseError
+        As for ``stream_protocols``.
+    """
+    for text in stream_protocols(chunks):
+        index = index_blocks(text)
+        for i in index.children(0):
+            yield index.tag_types[i], _block_text(text, *index.span(i))
+        yield 'xprotocol', text
+
+
+_step_re = re.compile(
+    r'\s*(?P<tag_type>[A-Za-z0-9]+|\*)\s*'
+    r'(?:\[\s*(?:"(?P<dq_name>(?:[^"]|"")*)"|'
+    r"'(?P<sq_name>[^']*)'|"
+    r'(?P<position>-?[0-9]+))\s*\])?\s*'
+    r'(?P<sep>/|$)')
+
+
+def _block_text(text, start, end):
+    """ Return ``text[start:end]``, with tabs expanded as for the whole text
+
+    ``read_protocols`` expands tabs in the whole text before parsing, so the
+    expansion depends on the column of each tab.  Expand from the start of
+    the line containing `start` to give the same values.
+    """
+    if text.find('\t', start, end) == -1:
+        return text[start:end]
+    line_start = text.rfind('\n', 0, start) + 1
+    prefix = text[line_start:start].expandtabs()
+    return text[line_start:end].expandtabs()[len(prefix):]
+
+
+def _fast_parser(text, start, end, tag_type):
+    if text.find('\t', start, end) == -1:
+        return xpfast.parse_block(text, start)[0]
+    return xpfast.parse_block(_block_text(text, start, end), 0)[0]
+
+
+class Selector(object):
+    """ Compiled path to blocks in xprotocol text
+
+    A path is a sequence of steps separated by ``/``.  Each step is a tag type
+    (case insensitive), or ``*`` for any type, optionally followed by a tag
+    name in square brackets, or by an integer position in square brackets.
+    For example: ``'ParamMap[""]/ParamString["Protocol0"]'``,
+    ``'ParamMap[0]/*["Count"]'``.  Positions count from 0 among the blocks
+    matching the tag type in the same parent; negative positions count from
+    the end.
+
+    A first step of ``XProtocol`` selects among the protocols in the text;
+    otherwise the first step selects blocks in any protocol.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.steps = []
+        pos = 0
+        while True:
+            m = _step_re.match(path, pos)
+            if m is None:
+                raise ValueError('Invalid path "{0}" at position {1}'.format(
+                    path, pos))
+            tag_type = m.group('tag_type').lower()
+            tag_name = m.group('dq_name')
+            if tag_name is not None:
+                tag_name = tag_name.replace('""', '"')
+            else:
+                tag_name = m.group('sq_name')
+            position = m.group('position')
+            if position is not None:
+                position = int(position)
+            self.steps.append((None if tag_type == '*' else tag_type,
+                               tag_name,
+                               position))
+            pos = m.end()
+            if m.group('sep') == '':
+                break
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(self.__class__.__name__, self.path)
+
+    def find(self, index):
+        """ Return indices of blocks in `index` matching path
+
+        Parameters
+        ----------
+        index : BlockIndex
+            Index of blocks in text.
+
+        Returns
+        -------
+        indices : list
+            Indices of matching blocks in `index`, in order of their start
+            offsets.
+        """
+        tag_types = index.tag_types
+        tag_names = index.tag_names
+        parents = index.parents
+        steps = self.steps
+        if steps[0][0] == 'xprotocol':
+            current = set([-1])
+        else:
+            current = set(index.find('xprotocol', parent=-1))
+        matches = []
+        for tag_type, tag_name, position in steps:
+            # Matching blocks, grouped by parent
+            by_parent = {}
+            for i in range(len(index)):
+                parent = parents[i]
+                if parent not in current:
+                    continue
+                if tag_type is not None and tag_types[i] != tag_type:
+                    continue
+                if tag_name is not None and tag_names[i] != tag_name:
+                    continue
+                by_parent.setdefault(parent, []).append(i)
+            matches = []
+            for parent, indices in by_parent.items():
+                if position is None:
+                    matches += indices
+                elif -len(indices) <= position < len(indices):
+                    matches.append(indices[position])
+            matches.sort()
+            current = set(matches)
+        return matches
+
+    def blocks(self, text, index=None, parser=None):
+        """ Parse blocks in `text` matching path
+
+        Parameters
+        ----------
+        text : str
+            String containing protocols.
+        index : None or BlockIndex, optional
+            Index of blocks in `text`.  If None, index `text`.
+        parser : None or callable, optional
+            Function with signature ``parser(text, start, end, tag_type)``,
+            returning parsed block.  None means use ``xpfast.parse_block``.
+
+        Returns
+        -------
+        blocks : list
+            Parsed blocks matching path.
+        """
+        if index is None:
+            index = index_blocks(text)
+        if parser is None:
+            parser = _fast_parser
+        return [parser(text, index.starts[i], index.ends[i],
+                       index.tag_types[i])
+                for i in self.find(index)]
+
+    def get(self, text, default=None, index=None, parser=None):
+        """ Return value of first block in `text` matching path
+
+        Parameters are as for ``blocks``, and:
+
+        default : object, optional
+            Value to return if there is no matching block, or if the block
+            has no value.
+
+        Returns
+        -------
+        value : object
+            The value of the block (its ``value`` key), or the block itself
+            for XProtocol and blocks without values such as dependencies.
+        """
+        if index is None:
+            index = index_blocks(text)
+        matches = self.find(index)
+        if not matches:
+            return default
+        if parser is None:
+            parser = _fast_parser
+        i = matches[0]
+        tag_type = index.tag_types[i]
+        block = parser(text, index.starts[i], index.ends[i], tag_type)
+        if tag_type in ('xprotocol', 'dependency') + xpfast._EMC_TYPES:
+            return block
+        return block.get('value', default)
+
+
+def _get(text, path, default=None, index=None, parser=None):
+    """ Return value of first block in `text` matching `path`
+
+    Helper for ``xpparse.get``, the public interface.  `path` can be a string
+    or a ``Selector``; see ``Selector.get`` for the other parameters.
+    """
+    if not isinstance(path, Selector):
+        path = Selector(path)
+    return path.get(text, default, index, parser)
@@ -0,0 +1,393 @@
+""" Compact node classes for parsed xprotocols
+
+Pyparsing ``ParseResults`` and ``xpfast.AttrDict`` trees carry a lot of
+per-object overhead.  The classes here use ``__slots__`` and hold plain
+dict, tuple and scalar payloads, to keep parsed protocols small in memory.
+Get node trees with ``read_protocols(..., result='nodes')``, or convert
+existing results with ``to_nodes``.  ``read_protocols(..., result='shared')``
+also shares identical subtrees between and within protocols; see
+``SharePool``.
+
+Nodes allow attribute access to their fields (``protocol.param_blocks``,
+``block.tag_name``, ``block.value``), and item access as for the other
+results (``block['value']``, ``block['class']``).  Fields that are not
+present in the protocol are None.
+"""
+from __future__ import print_function
+
+import sys
+
+try:
+    basestring
+except NameError:  # Python 3
+    basestring = str
+
+try:
+    intern = sys.intern
+except AttributeError:  # Python 2
+    pass
+
+_SCALARS = (basestring, bool, int, float)
+
+
+class Node(object):
+    """ Base class for nodes, with item access to fields """
+    __slots__ = ()
+    _fields = ()
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def keys(self):
+        return [key for key in self._fields if key in self]
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f)
+                   for f in self.__slots__)
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # Faster to unpickle than the default for slots; needs the slots to
+        # be in the order of the ``__init__`` arguments
+        return (self.__class__,
+                tuple([getattr(self, f) for f in self.__slots__]))
+
+    def __repr__(self):
+        return '{0}({1})'.format(
+            self.__class__.__name__,
+            ', '.join('{0}={1!r}'.format(f, getattr(self, f))
+                      for f in self.__slots__))
+
+
+class ListValue(Node):
+    """ List value ``{ ... }``, with tuple `args` and dict `kwargs` """
+    __slots__ = ('args', 'kwargs')
+    _fields = __slots__
+
+    def __init__(self, args, kwargs):
+        self.args = args
+        self.kwargs = kwargs
+
+
+class ParamBlock(Node):
+    """ Parameter block such as ``<ParamLong."Count"> { ... }``
+
+    `extras` is None, or a dict with any of the keys ``default`` (for
+    ParamArray), ``class`` (for ParamFunctor and PipeService), and
+    ``event``, ``method``, ``connection`` (for ParamFunctor).  Get these
+    with item access, e.g. ``block['class']``, or attribute access for valid
+    Python names, e.g. ``block.default``.
+    """
+    __slots__ = ('tag_type', 'tag_name', 'attrs', 'value', 'extras')
+    _fields = ('tag_type', 'tag_name', 'attrs', 'value')
+
+    def __init__(self, tag_type, tag_name, attrs, value=None, extras=None):
+        self.tag_type = tag_type
+        self.tag_name = tag_name
+        self.attrs = attrs
+        self.value = value
+        self.extras = extras
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            return Node.__getitem__(self, key)
+        if self.extras is None:
+            raise KeyError(key)
+        return self.extras[key]
+
+    def __getattr__(self, name):
+        # Only called for names that are not slots
+        extras = object.__getattribute__(self, 'extras')
+        if extras is None or name not in extras:
+            raise AttributeError(name)
+        return extras[name]
+
+    def keys(self):
+        keys = Node.keys(self)
+        if self.extras is not None:
+            keys += list(self.extras)
+        return keys
+
+
+class CardLayout(Node):
+    """ ``<ParamCardLayout."name"> { ... }``, with (name, value) entries """
+    __slots__ = ('tag_name', 'value')
+    _fields = ('tag_type', 'tag_name', 'value')
+    tag_type = 'paramcardlayout'
+
+    def __init__(self, tag_name, value=None):
+        self.tag_name = tag_name
+        self.value = value
+
+
+class Dependency(Node):
+    """ Block of list entries: dependency, event, method or connection """
+    __slots__ = ('tag_type', 'tag_name', 'args', 'kwargs')
+    _fields = __slots__
+
+    def __init__(self, tag_type, tag_name, args, kwargs):
+        self.tag_type = tag_type
+        self.tag_name = tag_name
+        self.args = args
+        self.kwargs = kwargs
+
+
+class XProtocol(Node):
+    """ Parsed ``<XProtocol> { ... }`` with optional ASCCONV section """
+    __slots__ = ('attrs', 'param_blocks', 'card_layouts', 'dependencies',
+                 'ascconv')
+    _fields = __slots__
+
+    def __init__(self, attrs, param_blocks=(), card_layouts=(),
+                 dependencies=(), ascconv=None):
+        self.attrs = attrs
+        self.param_blocks = param_blocks
+        self.card_layouts = card_layouts
+        self.dependencies = dependencies
+        self.ascconv = ascconv
+
+
+_ARGS_TYPES = ('dependency', 'event', 'method', 'connection')
+_BLOCK_LISTS = ('parammap', 'paramfunctor', 'pipeservice')
+
+
+def _value(value):
+    """ Node value from attribute, list entry or keyword value """
+    if isinstance(value, _SCALARS):
+        return value
+    if 'args' in value:
+        return ListValue(tuple(value['args']), _kwargs(value['kwargs']))
+    # Keyword with several values
+    return tuple(value)
+
+
+def _kwargs(kwargs):
+    return dict((key, _value(kwargs[key])) for key in kwargs.keys())
+
+
+def _entry(entry):
+    """ Card layout entry from (name, value) tuple or pyparsing group """
+    if 'args' in entry:  # pyparsing group for list value
+        return entry[0], _value(entry)
+    return entry[0], _value(entry[1])
+
+
+def block_node(block):
+    """ Node for parsed block `block` from either engine """
+    tag_type = block['tag_type']
+    tag_name = block.get('tag_name', '')
+    if tag_type in _ARGS_TYPES:
+        return Dependency(tag_type, tag_name, tuple(block['args']),
+                          _kwargs(block['kwargs']))
+    if tag_type == 'paramcardlayout':
+        return CardLayout(tag_name,
+                          tuple(_entry(e) for e in block['value'])
+                          if 'value' in block else None)
+    attrs = _kwargs(block['attrs']) if 'attrs' in block else {}
+    value = None
+    if 'value' in block:
+        value = block['value']
+        if tag_type in _BLOCK_LISTS:
+            value = tuple(block_node(b) for b in value)
+        elif tag_type == 'paramarray':
+            value = tuple(value)
+    extras = None
+    for key in ('default', 'class', 'event', 'method', 'connection'):
+        if key in block:
+            if extras is None:
+                extras = {}
+            extra = block[key]
+            extras[key] = extra if key == 'class' else block_node(extra)
+    return ParamBlock(tag_type, tag_name, attrs, value, extras)
+
+
+def protocol_node(protocol):
+    """ ``XProtocol`` node for parsed `protocol` from either engine """
+    return XProtocol(
+        _kwargs(protocol['attrs']),
+        tuple(block_node(b) for b in protocol.get('param_blocks', ())),
+        tuple(block_node(b) for b in protocol.get('card_layouts', ())),
+        tuple(block_node(b) for b in protocol.get('dependencies', ())),
+        protocol.get('ascconv', None))
+
+
+def to_nodes(protocols):
+    """ Convert sequence of parsed `protocols` to list of ``XProtocol``
+
+    Parameters
+    ----------
+    protocols : sequence
+        Protocols as returned by ``read_protocols`` from either engine.
+
+    Returns
+    -------
+    nodes : list
+        List of ``XProtocol`` nodes.
+    """
+    return [protocol_node(p) for p in protocols]
+
+
+class FrozenDict(dict):
+    """ Read-only dict, for attributes and keywords of shared nodes """
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('FrozenDict is read-only')
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = \
+        setdefault = update = _read_only
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+
+def _key(value):
+    """ Part of sharing key for shared `value`
+
+    Shared objects stay alive in the pool table, so their ids identify them.
+    Numbers are not shared, so use their values, with the type, so ``1`` and
+    ``True`` differ, and the representation of zero floats, so ``0.0`` and
+    ``-0.0`` differ.
+    """
+    cls = value.__class__
+    if cls is int or cls is bool:
+        return cls, value
+    if cls is float:
+        return (cls, value) if value else (cls, repr(value))
+    return id(value)
+
+
+class SharePool(object):
+    """ Table of unique values, for sharing identical subtrees
+
+    ``share`` returns the canonical copy of a node tree.  Strings, including
+    keys and tag names, are interned.  Tuples, dicts, and nodes that are
+    equal, with equal types all the way down, share one object.  Dicts become
+    ``FrozenDict``.  Sharing works across all trees shared with the same
+    pool.  Do not modify shared trees.
+
+    The pool table uses about as much memory as the unique values; use
+    ``clear`` to release it once you have shared all the trees you need,
+    at the cost of no sharing between trees before and after the clear.
+
+    Parameters
+    ----------
+    maxsize : None or int, optional
+        If not None, clear the table when it reaches `maxsize` entries, so
+        that a pool used for the life of a process stays bounded.  Trees
+        shared before the clear stay valid, but do not share with later
+        trees.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._table = {}
+
+    def __len__(self):
+        return len(self._table)
+
+    def clear(self):
+        self._table.clear()
+
+    def _unique(self, key, make):
+        try:
+            return self._table[key]
+        except KeyError:
+            pass
+        if self.maxsize is not None and len(self._table) >= self.maxsize:
+            # Keys hold ids of values reachable from their entries, so
+            # dropping whole entries does not leave stale ids
+            self._table.clear()
+        # Another thread may have stored an equal value since the lookup
+        return self._table.setdefault(key, make())
+
+    def share(self, value):
+        """ Return canonical copy of `value` in pool
+
+        Parameters
+        ----------
+        value : object
+            Node, tuple, dict or scalar, such as ``XProtocol`` node, or list of
+            nodes.
+
+        Returns
+        -------
+        shared : object
+            Canonical equal value, or tuple of these if `value` is a list.
+        """
+        cls = value.__class__
+        if cls is str:
+            return intern(value)
+        if cls in (tuple, list):
+            items = tuple([self.share(v) for v in value])
+            return self._unique((tuple,) + tuple([_key(v) for v in items]),
+                                lambda: items)
+        if cls is dict or cls is FrozenDict:
+            items = [(intern(str(k)), self.share(v))
+                     for k, v in value.items()]
+            key = [FrozenDict]
+            for k, v in items:
+                key += [id(k), _key(v)]
+            return self._unique(tuple(key), lambda: FrozenDict(items))
+        if isinstance(value, Node):
+            fields = [self.share(getattr(value, f)) for f in cls.__slots__]
+            return self._unique(
+                (cls,) + tuple([_key(f) for f in fields]),
+                lambda: cls(*fields))
+        if isinstance(value, basestring):  # EmbeddedProtocol
+            return self._unique(
+                (cls, getattr(value, 'engine', None), intern(str(value))),
+                lambda: value)
+        return value
+
+
+# Process-wide pool for result='shared'; about 20 MB when full
+default_pool = SharePool(2 ** 16)
+
+
+def share(value, pool=None):
+    """ Share identical subtrees in `value` using `pool`
+
+    Parameters
+    ----------
+    value : object
+        Node tree, or list of nodes, such as the result of ``to_nodes``.
+    pool : None or SharePool, optional
+        Pool of unique values.  None means the default pool for the process,
+        ``default_pool``, which ``read_protocols(..., result='shared')``
+        uses.  The default pool clears itself when it has 65536 entries, so
+        it does not keep every shared value alive for the life of the
+        process.
+
+    Returns
+    -------
+    shared : object
+        Canonical copy of `value`; see ``SharePool.share``.
+    """
+    if pool is None:
+        pool = default_pool
+    return pool.share(value)
@@ -1,154 +1,696 @@
 """ Pyparsing parser for Siemens xprotocol XML-like format
+
+The pyparsing grammar is in ``xpgrammar``, imported on first use, for
+example by ``read_protocols(..., engine='pyparsing')``.  Grammar elements are
+also available from this module, as in ``xpparse.param_block``.
+
+``xpparse.aio`` is the ``xpaio`` module, for parsing from asyncio code.
 """
 from __future__ import print_function
 
+import os
 import re
+import io
+import sys
+import locale
+from mmap import mmap as _mmap, ACCESS_READ
+
+import xpfast
+import xpcache
+from xpfast import EmbeddedProtocol, strip_twin_quote
+from xpindex import (index_blocks, BlockIndex, Selector, protocol_spans,
+                     stream_protocols, stream_blocks, _block_text, _get)
+from xpascconv import parse_ascconv
+from xpnodes import to_nodes, block_node, share
+from xpcolumns import to_columns, save_columns, load_columns
+from xpdicom import read_csa_text
+
+
+def _grammar():
+    """ Return ``xpgrammar`` module, building the grammar on first call """
+    import xpgrammar
+    return xpgrammar
+
+
+def __getattr__(name):
+    # ``aio`` module, grammar elements, and names imported into the grammar
+    # module, such as ``ParseException``, on first use (Python >= 3.7)
+    if name.startswith('__'):
+        raise AttributeError(name)
+    if name == 'aio':
+        import xpaio
+        return xpaio
+    try:
+        return getattr(_grammar(), name)
+    except AttributeError:
+        raise AttributeError(
+            "module 'xpparse' has no attribute '{0}'".format(name))
+
+
+if sys.version_info[:2] < (3, 7):
+    # No module __getattr__; build grammar now
+    for _name, _value in vars(_grammar()).items():
+        if not _name.startswith('__') and _name not in globals():
+            globals()[_name] = _value
+
+
+def _pyparsing_block(text, start, end, tag_type):
+    return _grammar().block_elements[tag_type].parseString(
+        _block_text(text, start, end), True)
+
+
+dbl_quote_re = xpfast._dbl_quote_re
+
+
+def read_protocols(in_str, parse_all=True, engine='pyparsing', packrat=None,
+                   result='native', cache_dir=None):
+    """ Parse one or more XProtocols from string `in_str`
+
+    Parameters
+    ----------
+    in_str : str
+        String containing protocols.
+    parse_all : {True, False}, optional
+        If True, raise an error for anything but whitespace after the last
+        protocol.
+    engine : {'pyparsing', 'fast'}, optional
+        'pyparsing' parses with the grammar in ``xpgrammar``, and returns
+        pyparsing ``ParseResults``.  'fast' uses the hand-written parser in
+        ``xpfast``, returning a list of ``xpfast.AttrDict`` protocols, and
+        raising ``xpfast.ParseError`` for invalid input.
+    packrat : None or bool or int, optional
+        Packrat memoization for the pyparsing engine.  None leaves the current
+        pyparsing setting.  False disables packrat parsing for this call.
+        True enables it for this call; the cache only lives for the duration
+        of the parse.  An integer enables it with the cache limited to that
+        many entries, evicting the least recently used.  See
+        ``packrat_stats`` for cache hits and misses.  The pyparsing engine
+        uses process-wide parse state; see ``XProtocolParser`` to parse from
+        several threads.
+    result : {'native', 'nodes', 'shared'}, optional
+        'native' returns the results of the engine, as below.  'nodes'
+        returns a list of compact ``xpnodes.XProtocol`` nodes, which use much
+        less memory than the native results.  'shared' returns nodes, with
+        strings interned, and identical subtrees shared, within and between
+        calls, using ``xpnodes.default_pool``.  Do not modify shared nodes.
+    cache_dir : None or str or ``xpcache.DiskCache``, optional
+        If not None, directory for an on-disk cache of results, keyed by a
+        hash of `in_str`, the options above except `packrat`, and the parser
+        source code.  Use ``xpcache.get_cache(cache_dir).stats()`` for
+        cache statistics, or pass a ``DiskCache`` to set the size limit.
+        See also ``enable_memo`` for a cache in memory.
+
+    Returns
+    -------
+    protocols : sequence
+        Sequence of parsed protocols.  ``ParamString`` values that contain an
+        XProtocol are ``EmbeddedProtocol`` strings, that parse the embedded
+        protocol on first access to their ``parsed`` attribute.
+    """
+    _check_result(result)
+    if not xpcache.memo.maxsize:
+        return _read_result(in_str, parse_all, engine, packrat, result,
+                            cache_dir)
+    # Copy native results, that callers may modify, on memo hits; return
+    # nodes directly, in a new list
+    protocols = xpcache.memo.lookup(
+        in_str, _options(parse_all, engine, result),
+        lambda: _read_result(in_str, parse_all, engine, packrat, result,
+                             cache_dir),
+        copy=result == 'native')
+    return protocols if result == 'native' else list(protocols)
+
+
+def _read_result(in_str, parse_all, engine, packrat, result, cache_dir):
+    if result == 'shared':
+        return [share(p) for p in _cached_read(
+            in_str, parse_all, engine, packrat, 'nodes', cache_dir)]
+    return _cached_read(in_str, parse_all, engine, packrat, result, cache_dir)
+
+
+def _check_result(result):
+    if result not in ('native', 'nodes', 'shared'):
+        raise ValueError('Unknown result "{0}"'.format(result))
+
+
+def _options(parse_all, engine, result):
+    """ Options string for cache keys """
+    return '{0} {1} {2}'.format(engine, result, bool(parse_all))
+
+
+def _cached_read(in_str, parse_all, engine, packrat, result, cache_dir):
+    if cache_dir is not None:
+        cache = xpcache.get_cache(cache_dir)
+        key = xpcache.cache_key(in_str,
+                                _options(parse_all, engine, result))
+        protocols = cache.get(key)
+        if protocols is None:
+            protocols = _cached_read(in_str, parse_all, engine, packrat,
+                                     result, None)
+            cache.set(key, protocols)
+        return protocols
+    protocols = _read_protocols(in_str, parse_all, engine, packrat)
+    if result == 'nodes':
+        return to_nodes(protocols)
+    return protocols
+
+
+def _parse_errors(engine):
+    """ Tuple of exceptions for syntax errors from parser `engine` """
+    if engine == 'pyparsing':
+        return (_grammar().ParseException, xpfast.ParseError)
+    return (xpfast.ParseError,)
+
+
+def _read_protocols(in_str, parse_all, engine, packrat):
+    if engine == 'fast':
+        return xpfast.read_protocols(in_str, parse_all)
+    if engine != 'pyparsing':
+        raise ValueError('Unknown engine "{0}"'.format(engine))
+    grammar = _grammar()
+    xprotocols, ParserElement = grammar.xprotocols, grammar.ParserElement
+    if packrat is None:
+        return xprotocols.parseString(in_str, parse_all)
+    was_enabled = ParserElement._packratEnabled
+    old_size = ParserElement._exprArgCache.size
+    if packrat is False:
+        ParserElement.disablePackrat()
+    else:
+        ParserElement.enablePackrat(None if packrat is True else packrat)
+    try:
+        return xprotocols.parseString(in_str, parse_all)
+    finally:
+        if was_enabled:
+            ParserElement.enablePackrat(old_size)
+        else:
+            ParserElement.disablePackrat()
+
+
+def profile(in_str, parse_all=True, packrat=None):
+    """ Parse `in_str` with pyparsing engine, timing each grammar element
+
+    Parameters
+    ----------
+    in_str : str
+        String containing protocols.
+    parse_all : {True, False}, optional
+        As for ``read_protocols``.
+    packrat : None or bool or int, optional
+        As for ``read_protocols``.
+
+    Returns
+    -------
+    profile : ``xpprofile.ParseProfile``
+        Calls, successes, failures, cumulative and self time for each element
+        of the grammar.  Elements have the names of the grammar elements in
+        ``xpgrammar``, such as ``attr`` or ``param_block``, or, for unnamed
+        sub-elements, the name of a parent element with the positions of the
+        sub-element, such as ``attr.0.1``.  ``print(profile)`` prints the
+        elements with the highest self time; see ``ParseProfile.report``.
+    """
+    import pyparsing
+    from xpprofile import ParseProfiler, element_names
+    names = element_names(dict((name, value)
+                               for name, value in vars(_grammar()).items()
+                               if not hasattr(pyparsing, name)))
+    with ParseProfiler(names) as profiler:
+        _read_protocols(in_str, parse_all, 'pyparsing', packrat)
+    return profiler.profile()
+
+
+def packrat_stats():
+    """ Return packrat cache statistics for last pyparsing parse
+
+    Returns
+    -------
+    stats : dict
+        With keys ``hits`` and ``misses`` for cache lookups in the last parse,
+        ``currsize`` for the number of entries in the cache (0 after the
+        parse has finished) and ``maxsize`` for the current cache size limit
+        (None for no limit).  ``read_protocols`` restores the packrat setting
+        after a parse with its `packrat` argument, so ``maxsize`` is then the
+        limit from before the parse.
+    """
+    return _grammar().ParserElement.cacheStats()
+
+
+class XProtocolParser(object):
+    """ Protocol parser with its own grammar and parse state
+
+    ``read_protocols`` with the pyparsing engine uses the module grammar,
+    and pyparsing state shared by all parses in the process, such as the
+    packrat setting and cache, so it is not safe to call from more than one
+    thread at a time.  An ``XProtocolParser`` has a private copy of the
+    grammar, and a packrat cache for each thread (see
+    ``xpgrammar.PrivateGrammar``).  Threads can share one parser, or use
+    their own, from ``clone``.
+
+    Parameters
+    ----------
+    engine : {'pyparsing', 'fast'}, optional
+        Parser engine, as for ``read_protocols``.
+    packrat : bool or int, optional
+        Packrat memoization for the pyparsing engine.  False parses without
+        memoization.  True memoizes, with no limit on the cache size; an
+        integer limits the cache to that many entries.
+    """
+
+    def __init__(self, engine='pyparsing', packrat=False):
+        if engine == 'pyparsing':
+            grammar = _grammar()
+            self._grammar = grammar.PrivateGrammar(grammar.xprotocols, packrat)
+            # Embedded protocols parse with this parser
+            self._grammar.copy_of(grammar.string_or_protocol).setParseAction(
+                lambda s, l, t: [xpfast.string_value(
+                    t[0][1:-1], 'pyparsing', self.read_protocols)])
+        elif engine != 'fast':
+            raise ValueError('Unknown engine "{0}"'.format(engine))
+        self.engine = engine
+        self.packrat = packrat
+
+    def clone(self):
+        """ Return new parser with the same options, and a new grammar """
+        return self.__class__(self.engine, self.packrat)
+
+    def read_protocols(self, in_str, parse_all=True, result='native'):
+        """ Parse one or more XProtocols from string `in_str`
+
+        As for the ``read_protocols`` function, without caches of results.
+        ``EmbeddedProtocol`` values parse with this method when first
+        accessed.
+
+        Parameters
+        ----------
+        in_str : str
+            String containing protocols.
+        parse_all : {True, False}, optional
+            If True, raise an error for anything but whitespace after the
+            last protocol.
+        result : {'native', 'nodes', 'shared'}, optional
+            Type of result, as for ``read_protocols``.
+
+        Returns
+        -------
+        protocols : sequence
+            Sequence of parsed protocols.
+        """
+        _check_result(result)
+        if self.engine == 'fast':
+            protocols = xpfast.read_protocols(in_str, parse_all)
+        else:
+            protocols = self._grammar.parse_string(in_str, parse_all)
+        if result == 'native':
+            return protocols
+        protocols = to_nodes(protocols)
+        if result == 'shared':
+            return [share(p) for p in protocols]
+        return protocols
+
+    def packrat_stats(self):
+        """ Return packrat cache statistics for last parse in this thread
+
+        See ``packrat_stats`` function for the returned dict.
+        """
+        if self.engine != 'pyparsing':
+            return dict(hits=0, misses=0, currsize=0, maxsize=None)
+        return self._grammar.cache_stats()
+
+
+def enable_memo(maxsize=128):
+    """ Memoize ``read_protocols`` results in this process
 
-from pyparsing import (Regex, Suppress, OneOrMore, ZeroOrMore, Group, Optional,
-                       Forward, CaselessLiteral, Dict, removeQuotes,
-                       Each, Word, alphanums, dblQuotedString, Literal,
-                       dictOf)
-
-
-# Character literals
-LCURLY = Suppress('{')
-RCURLY = Suppress('}')
-DOT = Suppress('.')
-LANGLE = Suppress('<')
-RANGLE = Suppress('>')
-
-def _spa(element, action):
-    """ Shortcut to set parse action """
-    return element.setParseAction(action)
-
-
-quoted_oneline = dblQuotedString
-quoted_multi = _spa(Regex(r'"(?:[^"]|(?:"")|(?:\\x[0-9a-fA-F]+)|(?:\\.))*"'),
-                    removeQuotes)
-ascconv_block = Regex(r'### ASCCONV BEGIN ###$(.*?)^### ASCCONV END ###',
-                      flags=re.M | re.S)
-
-
-def make_literal_tag(tag_name):
-    return LANGLE + CaselessLiteral(tag_name) + RANGLE
-
-
-xprotocol_tag = make_literal_tag('xprotocol')
-bare_tag = LANGLE + Word(alphanums) + RANGLE
-int_num = _spa(Regex(r'[-]?[0-9]+'), lambda s,l,t: [ int(t[0]) ] )
-float_num = _spa(Regex(
-    r'[+-]?(?=\d*[.eE])(?=\.?\d)\d*\.?\d*(?:[eE][+-]?\d+)?'),
-    lambda s,l,t: [ float(t[0]) ])
-true = _spa(Literal('"true"'), lambda s,l,t: [ True ])
-false = _spa(Literal('"false"'), lambda s,l,t: [ False ])
-bool_ = true | false
-simple_value = bool_ | float_num | int_num | quoted_multi
-key_values = Group(bare_tag + OneOrMore(simple_value))
-keys_values = Dict(ZeroOrMore(key_values))
-list_entries = Group(ZeroOrMore(simple_value))('args') + keys_values('kwargs')
-# Return list value as list
-list_value = LCURLY + list_entries + RCURLY
-bool_attr = bare_tag + bool_
-float_attr = bare_tag + float_num
-int_attr = bare_tag + int_num
-string_attr = bare_tag + quoted_multi
-list_attr = bare_tag + list_value
-attr = Group(bool_attr | float_attr | int_attr | string_attr | list_attr)
-attrs = Dict(ZeroOrMore(attr))('attrs')
-
-
-def make_named_tag(tag_type):
-    return (LANGLE +
-            CaselessLiteral(tag_type)('tag_type') +
-            DOT +
-            _spa(quoted_oneline, removeQuotes)('tag_name') +
-            RANGLE)
-
-
-def make_named_block(tag_type, contents=None, pre=None, post=None):
-    definition = make_named_tag(tag_type) + LCURLY
-    if pre is not None:
-        definition = definition + pre
-    definition = definition + contents('value')
-    if post is not None:
-        definition = definition + post
-    return definition + RCURLY
-
-
-def make_param_block(tag_type, contents):
-    return make_named_block(tag_type, pre=attrs, contents=contents)
-
-
-param_bool = make_param_block('parambool', Optional(bool_))
-param_long = make_param_block('paramlong', Optional(int_num))
-param_string = make_param_block('paramstring', Optional(quoted_multi))
-# Recursive definition of blocks, can include param_map
-param_block = Forward()
-array_default = dictOf(make_literal_tag('default'), param_block)
-param_array = make_named_block('paramarray',
-                               pre=attrs + array_default,
-                               contents=_spa(Optional(list_value),
-                                             lambda s, l, t: [t[0]]))
-# Not sure what value type should be for paramchoice
-param_choice = make_param_block('paramchoice', Optional(quoted_multi))
-param_map = make_param_block('parammap', ZeroOrMore(Group(param_block)))
-
-# Fancy functor and service stuff
-def make_args_block(tag_type):
-    return (make_named_tag(tag_type) +
-            LCURLY +
-            list_entries +
-            RCURLY)
-
-
-event = make_args_block("event")
-method = make_args_block("method")
-connection = make_args_block("connection")
-class_ = dictOf(make_literal_tag('class'), quoted_oneline)
-emc = Each([Group(event)('event'),
-            Group(method)('method'),
-            Group(connection)('connection')])
-param_functor = make_named_block('paramfunctor',
-                                 pre=class_,
-                                 contents=ZeroOrMore(Group(param_block)),
-                                 post=emc)
-pipe_service = make_named_block('pipeservice',
-                                pre=class_,
-                                contents=OneOrMore(Group(param_block)))
-
-# Now we can define block with param_map, functor, pipe_service definition
-param_block <<= (param_bool |
-                 param_long |
-                 param_string |
-                 param_choice |
-                 param_array |
-                 param_map |
-                 param_functor |
-                 pipe_service)
-
-param_card_layout = make_named_block('paramcardlayout', ZeroOrMore(attr))
-dependency = make_args_block('dependency')
-
-xprotocol = (xprotocol_tag +
-             LCURLY +
-             attrs +
-             ZeroOrMore(Group(param_block))('param_blocks') +
-             ZeroOrMore(Group(param_card_layout))('card_layouts') +
-             ZeroOrMore(Group(dependency))('dependencies') +
-             RCURLY +
-             Optional(ascconv_block)('ascconv'))
-xprotocols = OneOrMore(Group(xprotocol))
-
-
-dbl_quote_re = re.compile(r'(?<!")""(?!")')
-
-def strip_twin_quote(in_str):
-    """ Replaces two double quotes together with one double quote
-
-    Does so safely so that triple double quotes not touched.
+    Results are cached in memory, keyed by a digest of the input text and the
+    options that change the result.  For 'native' results, the memo stores
+    pickles, so calls with the same text and options return equal, but
+    separate, results, that callers can modify; a hit costs about a tenth of
+    a parse, to unpickle (see ``xpcache.MemoCache.lookup``).  For 'nodes' and
+    'shared' results, hits return the stored nodes, in a new list, at the
+    cost of a dict lookup; do not modify these nodes.  The parses of embedded
+    protocols (see ``EmbeddedProtocol``) use the same cache.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of results to keep, evicting the least recently used.
+    """
+    xpcache.memo.resize(maxsize)
+
+
+def disable_memo():
+    """ Stop memoizing ``read_protocols`` results, and clear the memo """
+    xpcache.memo.resize(0)
+    xpcache.memo.clear()
+
+
+def memo_stats():
+    """ Return memo statistics, as dict
+
+    Keys are ``hits`` and ``misses`` since the memo was last cleared,
+    ``currsize`` for the number of cached results and ``maxsize`` for the
+    maximum, 0 if the memo is disabled.
+    """
+    return xpcache.memo.stats()
+
+
+# Keyword arguments to read_protocols in the current batch worker
+_worker_kwargs = {}
+# Error from setting up the current batch worker, if any
+_worker_error = []
+
+# Small protocol to check arguments and warm the parser
+_WARM_PROTOCOL = '<XProtocol> { <ParamLong."Count"> { 1 } }'
+
+
+def _init_worker(kwargs):
+    """ Store read_protocols arguments, warm grammar for batch worker """
+    _worker_kwargs.clear()
+    _worker_kwargs.update(kwargs)
+    del _worker_error[:]
+    # Trigger compilation of regular expressions and other lazy setup.  The
+    # pool restarts workers with errors in the initializer, without end, so
+    # keep the error, for ``_read_item`` to return.
+    try:
+        read_protocols(_WARM_PROTOCOL, **kwargs)
+    except Exception as err:
+        _worker_error.append(err)
+
+
+def _read_item(read, item):
+    """ Return ``read(item)`` with worker arguments, or exception raised """
+    if _worker_error:
+        return _worker_error[0]
+    try:
+        return read(item, **_worker_kwargs)
+    except Exception as err:
+        return err
+
+
+def _read_text(text):
+    """ Parse protocol text `text`, return protocols or exception """
+    return _read_item(read_protocols, text)
+
+
+def _read_path(path):
+    """ Parse protocols in file `path`, return protocols or exception """
+    return _read_item(read_protocols_file, path)
+
+
+def read_protocols_many(items, workers=None, chunksize=1, paths=False,
+                        **kwargs):
+    """ Parse protocols from many strings or files with a process pool
+
+    Parameters
+    ----------
+    items : sequence
+        Sequence of str, each containing protocol text, or, if `paths` is
+        True, each the name of a file containing protocols.
+    workers : None or int, optional
+        Number of worker processes.  None means one per CPU.  1 parses in the
+        current process, without a pool.
+    chunksize : int, optional
+        Number of items to send to a worker at a time.  Larger chunks reduce
+        the overhead of communicating with the workers for small items.
+    paths : {False, True}, optional
+        If True, `items` are file names, to read with
+        ``read_protocols_file``.  If False, `items` are protocol text, to
+        parse with ``read_protocols``.
+    **kwargs : dict
+        Other keyword arguments for ``read_protocols``, such as `engine` and
+        `result`.  Each worker parses a small protocol with these arguments
+        when it starts, so that the first real item does not pay for lazy
+        setup.  This process parses the same protocol first, so invalid
+        arguments raise an error before starting the workers.
+
+    Returns
+    -------
+    results : list
+        One entry per item in `items`, in the same order.  The entry is the
+        result of ``read_protocols`` for the item, or the exception instance
+        raised when reading or parsing the item, such as ``IOError``,
+        ``ParseException`` or ``xpfast.ParseError``.  Results and exceptions
+        pass from the workers by pickling, which is much cheaper for the
+        'fast' engine and for 'nodes' results than for pyparsing results.
+    """
+    import multiprocessing
+    items = list(items)
+    read = _read_path if paths else _read_text
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    # Check arguments, and warm the parser for workers == 1
+    read_protocols(_WARM_PROTOCOL, **kwargs)
+    if workers == 1:
+        _worker_kwargs.update(kwargs)
+        try:
+            return [read(item) for item in items]
+        finally:
+            _worker_kwargs.clear()
+    pool = multiprocessing.Pool(workers, _init_worker, (kwargs,))
+    try:
+        results = pool.map(read, items, chunksize)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+
+def _decode(buf, encoding):
+    """ Decode bytes `buf`, translating newlines as for text mode files """
+    text = buf.decode(encoding)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+_ws_bytes_match = re.compile(br'[ \t\r\n]*').match
+
+
+def read_protocols_file(path, mmap=False, encoding=None, **kwargs):
+    """ Parse one or more XProtocols from file `path`
+
+    Parameters
+    ----------
+    path : str
+        File name.
+    mmap : {False, True}, optional
+        If False, read the whole file into a string, and parse that.  If
+        True, memory map the file, find the top level protocols in the
+        mapped bytes, and decode and parse one protocol at a time.  Memory
+        mapping is slower, and only lowers peak memory for results smaller
+        than the text, such as 'nodes' results of files with many protocols;
+        'native' results take more memory than the text.
+    encoding : None or str, optional
+        Encoding of the file.  None means the default encoding for opening
+        files in text mode.
+    **kwargs : dict
+        Other keyword arguments for ``read_protocols``.
+
+    Returns
+    -------
+    protocols : sequence
+        Parsed protocols, as for ``read_protocols``.
+    """
+    if encoding is None:
+        encoding = locale.getpreferredencoding(False)
+    buf = None
+    if mmap:
+        with io.open(path, 'rb') as fobj:
+            # Cannot map empty files
+            if os.fstat(fobj.fileno()).st_size:
+                buf = _mmap(fobj.fileno(), 0, access=ACCESS_READ)
+    if buf is None:
+        with io.open(path, 'rt', encoding=encoding) as fobj:
+            return read_protocols(fobj.read(), **kwargs)
+    parse_errors = _parse_errors(kwargs.get('engine', 'pyparsing'))
+    try:
+        protocols = None
+        prev_end = 0
+        for start, end in protocol_spans(buf):
+            # Non-whitespace between protocols needs the full parse
+            if _ws_bytes_match(buf, prev_end, start).end() != start:
+                break
+            # Parse from start of line to get the same tab expansion
+            start = max(prev_end, buf.rfind(b'\n', 0, start) + 1)
+            try:
+                res = read_protocols(_decode(buf[start:end], encoding),
+                                     **kwargs)
+            except parse_errors:
+                break
+            if protocols is None:
+                protocols = res
+            else:
+                protocols = protocols + res
+            prev_end = end
+        else:
+            if (protocols is not None and
+                    _ws_bytes_match(buf, prev_end).end() == len(buf)):
+                return protocols
+        # Unusual content between or after protocols, or error; parse the
+        # whole text to get the same results and errors (with their
+        # locations) as for ``read_protocols``.
+        return read_protocols(_decode(buf[:], encoding), **kwargs)
+    finally:
+        buf.close()
+
+
+def from_dicom(path, name='MrPhoenixProtocol', header='series',
+               encoding='latin-1', **kwargs):
+    """ Parse protocol in Siemens CSA header of DICOM file `path`
+
+    Parameters
+    ----------
+    path : str
+        DICOM file name.
+    name : str, optional
+        Name of element in CSA header with protocol text.
+    header : {'series', 'image'}, optional
+        CSA header containing `name`.
+    encoding : str, optional
+        Encoding of protocol text.
+    **kwargs : dict
+        Other keyword arguments for ``read_protocols``.
+
+    Returns
+    -------
+    protocols : sequence
+        Parsed protocols, as for ``read_protocols``.
+
+    Notes
+    -----
+    Finds the text with ``xpdicom.read_csa_text``, which memory maps the
+    file, and reads the data elements before the CSA header, but not the
+    pixel data.  Raises ``xpdicom.DicomError`` if the file is not DICOM, or
+    does not have the CSA header or element.
     """
-    return dbl_quote_re.sub('"', in_str)
+    return read_protocols(read_csa_text(path, name, header, encoding),
+                          **kwargs)
+
+
+def _iter_chunks(source, chunksize):
+    """ Generate text chunks from string, file name or file object """
+    if hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunksize)
+            if not chunk:
+                break
+            yield chunk
+    elif '<' in source:
+        yield source
+    else:
+        with open(source, 'rt') as fobj:
+            for chunk in _iter_chunks(fobj, chunksize):
+                yield chunk
+
 
+def iter_protocols(source, chunksize=2 ** 16, **kwargs):
+    """ Generate protocols from `source`, one at a time
 
-def read_protocols(in_str, parse_all=True):
-    return xprotocols.parseString(in_str, parse_all)
+    Parameters
+    ----------
+    source : str or file-like
+        Protocol text if a string containing ``<``, a file name if another
+        string, or an object with a ``read`` method returning str.
+    chunksize : int, optional
+        Number of characters to read from a file at a time.
+    **kwargs : dict
+        Other keyword arguments for ``read_protocols``, such as `engine` and
+        `result`.
+
+    Yields
+    ------
+    protocol : object
+        Each parsed protocol, as for the protocols returned by
+        ``read_protocols``, as soon as the end of the protocol (and any
+        following ASCCONV section) has been read.  Only the text of the
+        current protocol is in memory.
+
+    Raises
+    ------
+    xpfast.ParseError
+        For invalid structure between protocols; see
+        ``xpindex.stream_protocols``.  Errors in protocols come from
+        ``read_protocols`` with locations relative to the protocol text.
+    """
+    for text in stream_protocols(_iter_chunks(source, chunksize)):
+        for protocol in read_protocols(text, **kwargs):
+            yield protocol
+
+
+def iter_param_blocks(source, chunksize=2 ** 16, engine='pyparsing',
+                      result='native'):
+    """ Generate parameter blocks directly inside protocols in `source`
+
+    Parameters
+    ----------
+    source : str or file-like
+        Protocol text, file name or file object, as for ``iter_protocols``.
+    chunksize : int, optional
+        Number of characters to read from a file at a time.
+    engine : {'pyparsing', 'fast'}, optional
+        Engine to parse each block, as for ``read_protocols``.
+    result : {'native', 'nodes', 'shared'}, optional
+        'native' gives the block as parsed by the engine, 'nodes' gives
+        ``xpnodes.ParamBlock`` nodes, and 'shared' gives nodes shared using
+        ``xpnodes.default_pool``, as for ``read_protocols``.
+
+    Yields
+    ------
+    block : object
+        Each parameter block directly inside a protocol, such as the
+        top-level ``<ParamMap."">``, once the protocol containing the block
+        has been read.  Card layouts and dependencies are skipped.
+    """
+    if engine == 'fast':
+        parser = lambda text, tag_type: xpfast.parse_block(text, 0)[0]
+    elif engine == 'pyparsing':
+        parser = lambda text, tag_type: _pyparsing_block(
+            text, 0, len(text), tag_type)
+    else:
+        raise ValueError('Unknown engine "{0}"'.format(engine))
+    _check_result(result)
+    for tag_type, text in stream_blocks(_iter_chunks(source, chunksize)):
+        if tag_type in xpfast._BLOCK_BODIES:
+            block = parser(text, tag_type)
+            if result == 'native':
+                yield block
+            elif result == 'nodes':
+                yield block_node(block)
+            else:
+                yield share(block_node(block))
+
+
+def get(text, path, default=None, index=None, engine='fast'):
+    """ Return value at `path` in `text`, parsing only the selected block
+
+    Parameters
+    ----------
+    text : str
+        String containing protocols.
+    path : str or Selector
+        Path to block, such as ``'ParamMap[""]/ParamLong["Count"]'``.  See
+        ``xpindex.Selector`` for the syntax.
+    default : object, optional
+        Value to return if there is no matching block, or if the block has no
+        value.
+    index : None or BlockIndex, optional
+        Index of blocks in `text`, from ``index_blocks``.  If None, index
+        `text`.  Pass an index to make several queries on the same text.
+    engine : {'fast', 'pyparsing'}, optional
+        'fast' parses the block with ``xpfast``, 'pyparsing' with the grammar
+        element for the block type, from ``block_elements``.
+
+    Returns
+    -------
+    value : object
+        The value of the first matching block, or the block itself for
+        XProtocol and blocks without values, such as dependencies.
+    """
+    if engine == 'fast':
+        parser = None
+    elif engine == 'pyparsing':
+        parser = _pyparsing_block
+    else:
+        raise ValueError('Unknown engine "{0}"'.format(engine))
+    return _get(text, path, default, index, parser)
@@ -0,0 +1,182 @@
+""" Profile time spent in each element of a pyparsing grammar
+
+``ParseProfiler`` replaces ``ParserElement._parseNoCache``, the method that
+runs every match attempt of every element, with a timing wrapper, for the
+duration of a ``with`` block.  See ``xpparse.profile`` to profile the
+xprotocol grammar.
+"""
+from __future__ import print_function
+
+from timeit import default_timer
+
+from pyparsing import ParserElement, ParseBaseException
+
+
+def element_names(namespace):
+    """ Label grammar elements in `namespace` and their sub-elements
+
+    Parameters
+    ----------
+    namespace : dict
+        Mapping of names to objects, such as ``globals()`` of a grammar
+        module.  Names of ``ParserElement`` objects label the elements.
+
+    Returns
+    -------
+    names : dict
+        Mapping of element id to label.  Elements in `namespace` have their
+        name there.  Other elements reachable from these have the label of
+        their parent, a dot, and their position in the parent, such as
+        ``attr.0.1``.  Where an element has more than one parent, the label
+        comes from the first, in order of the names in `namespace`.
+    """
+    names = {}
+    elements = []
+    for name in sorted(namespace):
+        element = namespace[name]
+        if (isinstance(element, ParserElement) and not name.startswith('_')
+                and id(element) not in names):
+            names[id(element)] = name
+            elements.append(element)
+    todo = list(elements)
+    while todo:
+        element = todo.pop(0)
+        children = getattr(element, 'exprs', None)
+        if children is None:
+            child = getattr(element, 'expr', None)
+            children = [] if child is None else [child]
+        for i, child in enumerate(children):
+            if id(child) not in names:
+                names[id(child)] = '{0}.{1}'.format(names[id(element)], i)
+                todo.append(child)
+    return names
+
+
+class ParseProfile(object):
+    """ Statistics for grammar elements from ``ParseProfiler``
+
+    ``rows`` is a list with one tuple for each element that was called, of
+    (label, calls, successes, failures, cumulative time, self time).  Times
+    are in seconds.  Cumulative time is the time from the start to the end
+    of the outermost call of the element, including time in sub-elements.
+    Self time excludes time in the calls to other elements.  Times include
+    some profiler overhead, proportional to the number of calls.
+    """
+
+    columns = ('name', 'calls', 'successes', 'failures', 'cumtime',
+               'selftime')
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def sorted(self, key='selftime', limit=None):
+        """ Return rows sorted by column `key`, largest first
+
+        Parameters
+        ----------
+        key : str, optional
+            Column to sort by, one of ``columns``.
+        limit : None or int, optional
+            Maximum number of rows to return.
+
+        Returns
+        -------
+        rows : list
+            Sorted rows.
+        """
+        i = self.columns.index(key)
+        rows = sorted(self.rows, key=lambda row: row[i], reverse=key != 'name')
+        return rows if limit is None else rows[:limit]
+
+    def report(self, key='selftime', limit=20):
+        """ Return text table of rows sorted by `key`, see ``sorted`` """
+        lines = ['{0:>9s} {1:>9s} {2:>9s} {3:>10s} {4:>10s}  {5}'.format(
+            'calls', 'successes', 'failures', 'cumtime', 'selftime', 'name')]
+        for name, calls, successes, failures, cum, self_ in self.sorted(
+                key, limit):
+            lines.append(
+                '{0:9d} {1:9d} {2:9d} {3:10.4f} {4:10.4f}  {5}'.format(
+                    calls, successes, failures, cum, self_, name))
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.report()
+
+
+class ParseProfiler(object):
+    """ Context manager to time all grammar element match attempts
+
+    Use as::
+
+        with ParseProfiler(names) as profiler:
+            element.parseString(text)
+        print(profiler.profile())
+
+    Times all pyparsing parses in the process while active, so not safe to
+    use while other threads parse.  With packrat parsing, cache hits are not
+    calls.
+
+    Parameters
+    ----------
+    names : None or dict, optional
+        Mapping of element id to label, as from ``element_names``.  Other
+        elements have ``str(element)`` as label.
+    """
+
+    def __init__(self, names=None):
+        self.names = {} if names is None else names
+        # Element -> [calls, successes, failures, cumtime, selftime, active]
+        self.stats = {}
+
+    def __enter__(self):
+        stats = self.stats
+        # Time in sub-element calls, for each active call
+        child_times = []
+        original = ParserElement.__dict__['_parseNoCache']
+
+        def _parseNoCache(element, instring, loc, doActions=True,
+                          callPreParse=True):
+            try:
+                record = stats[element]
+            except KeyError:
+                record = stats[element] = [0, 0, 0, 0., 0., 0]
+            record[0] += 1
+            record[5] += 1
+            child_times.append(0.)
+            start = default_timer()
+            try:
+                value = original(element, instring, loc, doActions,
+                                 callPreParse)
+            except ParseBaseException:
+                record[2] += 1
+                raise
+            else:
+                record[1] += 1
+                return value
+            finally:
+                elapsed = default_timer() - start
+                record[4] += elapsed - child_times.pop()
+                record[5] -= 1
+                if not record[5]:  # Outermost call of recursive element
+                    record[3] += elapsed
+                if child_times:
+                    child_times[-1] += elapsed
+
+        self._saved = (original, ParserElement.__dict__['_parse'])
+        ParserElement._parseNoCache = _parseNoCache
+        if self._saved[1] is original:  # Packrat disabled
+            ParserElement._parse = _parseNoCache
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        ParserElement._parseNoCache, ParserElement._parse = self._saved
+
+    def profile(self):
+        """ Return ``ParseProfile`` of statistics so far """
+        rows = []
+        for element, record in self.stats.items():
+            name = self.names.get(id(element))
+            if name is None:
+                name = str(element)
+            rows.append((name,) + tuple(record[:5]))
+        return ParseProfile(rows)